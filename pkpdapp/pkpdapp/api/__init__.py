@@ -16,6 +16,7 @@ from .views import (
     DoseView,
     ProtocolView,
     SimulateCombinedView,
+    SimulateBatchCombinedView,
     SimulatePdView,
     UnitView,
     BiomarkerTypeView,
@@ -0,0 +1,97 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import json
+import struct
+import numpy as np
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.mediatypes import _MediaType
+
+
+class SimulationBinaryRenderer(BaseRenderer):
+    """
+    Renders simulation results as typed arrays instead of JSON text.
+
+    The response body is a little-endian uint32 giving the length of a JSON
+    header, the UTF-8 encoded header, padding up to a multiple of 8 bytes,
+    and then the raw array data. The header has a "dtype" ("float64", or
+    "float32" if requested with ``Accept: application/x-pkpdapp-simulation;
+    dtype=float32``) and a "groups" list. Each group has the "group" id,
+    the id of its "time" output, the number of scenarios ("scenarios", only
+    for batch results), the "steady_state_time" (only if requested) and
+    "outputs", a list of dicts giving the variable
+    "id", "offset" (in bytes, from the start of the array data) and
+    "length" (number of values) of each array. For batch results each
+    output has a list of offsets and lengths, one for each scenario.
+
+    The renderer expects the view to pass a list of dicts with "group",
+    "time" and "outputs" (variable id -> numpy array, or list of numpy
+    arrays for batch results). Any other data (e.g. errors) is rendered as
+    JSON.
+    """
+
+    media_type = "application/x-pkpdapp-simulation"
+    format = "bin"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        response = (renderer_context or {}).get("response")
+        if response is not None and response.status_code >= 400:
+            return json.dumps(data).encode("utf-8")
+
+        dtype = np.float64
+        if accepted_media_type:
+            params = _MediaType(accepted_media_type).params
+            if params.get("dtype") == "float32":
+                dtype = np.float32
+
+        arrays = []
+        offset = 0
+
+        def add_array(values):
+            nonlocal offset
+            values = np.ascontiguousarray(values, dtype=dtype)
+            arrays.append(values)
+            block = {"offset": offset, "length": len(values)}
+            offset += values.nbytes
+            return block
+
+        groups = []
+        for group in data:
+            group_header = {"group": group["group"], "time": group["time"]}
+            if "steady_state_time" in group:
+                group_header["steady_state_time"] = group["steady_state_time"]
+            outputs = []
+            for var_id, values in group["outputs"].items():
+                if isinstance(values, list):
+                    group_header["scenarios"] = len(values)
+                    blocks = [add_array(v) for v in values]
+                    outputs.append(
+                        {
+                            "id": var_id,
+                            "offset": [b["offset"] for b in blocks],
+                            "length": [b["length"] for b in blocks],
+                        }
+                    )
+                else:
+                    outputs.append({"id": var_id, **add_array(values)})
+            group_header["outputs"] = outputs
+            groups.append(group_header)
+
+        header = json.dumps({"dtype": np.dtype(dtype).name, "groups": groups}).encode(
+            "utf-8"
+        )
+        # align the array data to 8 bytes so it can be viewed directly
+        padding = -(4 + len(header)) % 8
+        return b"".join(
+            [struct.pack("<I", len(header)), header, b" " * padding]
+            + [
+                a.astype(a.dtype.newbyteorder("<"), copy=False).tobytes()
+                for a in arrays
+            ]
+        )
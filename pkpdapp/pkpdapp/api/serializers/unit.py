@@ -29,9 +29,11 @@ class UnitSerializer(serializers.ModelSerializer):
 
     def get_compatible_units(self, unit) -> List[Dict[str, str]]:
         compound = self.context.get("compound")
-        compatible_units = unit.get_compatible_units(compound=compound)
-        sorted_units = compatible_units.order_by(
-            "-g", "-m", "-mol", "-s", "K", "A", "cd", "-multiplier"
+        # sorted in memory, so the units come from the in-process unit index
+        # without a query per unit
+        sorted_units = sorted(
+            unit.get_compatible_unit_list(compound=compound),
+            key=lambda u: (-u.g, -u.m, -u.mol, -u.s, u.K, u.A, u.cd, -u.multiplier),
         )
         return [
             {
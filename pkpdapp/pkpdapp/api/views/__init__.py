@@ -48,6 +48,7 @@ from .inference import (
 )
 from .simulate import (
     SimulateCombinedView,
+    SimulateBatchCombinedView,
     SimulatePdView,
 )
 from .results_table import ResultsTableView
@@ -3,18 +3,117 @@
 # is released under the BSD 3-clause license. See accompanying LICENSE.md for
 # copyright notice and full license details.
 #
+import itertools
 from rest_framework import views, status
 from rest_framework.response import Response
 from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
 from drf_spectacular.utils import extend_schema
 import myokit
-from pkpdapp.models import CombinedModel, PharmacodynamicModel, Variable
+from pkpdapp.api.renderers import SimulationBinaryRenderer
+from pkpdapp.models import CombinedModel, PharmacodynamicModel, Simulation, Variable
+
+
+def _get_time_variable_ids(instance, context):
+    """
+    Returns the ids of the time variables, either given by the serializer
+    context or looked up for the output ids in ``instance``.
+    """
+    time_variable_ids = context.get("time_variable_ids")
+    if time_variable_ids is None:
+        time_variable_ids = set(
+            Variable.objects.filter(
+                pk__in=instance.keys(), name__in=["time", "t"]
+            ).values_list("id", flat=True)
+        )
+    return time_variable_ids
+
+
+def get_time_variable_ids(model):
+    """
+    Returns the ids of the time variables of ``model``.
+    """
+    return set(
+        model.variables.filter(name__in=["time", "t"]).values_list("id", flat=True)
+    )
+
+
+def get_simulation_tolerance(model, simulation_id):
+    """
+    Returns the (absolute, relative) solver tolerance of the simulation
+    with id ``simulation_id`` in the project of ``model``, or None if no id
+    is given. Raises :class:`Simulation.DoesNotExist` if there is no such
+    simulation.
+    """
+    if simulation_id is None:
+        return None
+    simulation = Simulation.objects.get(pk=simulation_id, project=model.get_project())
+    return simulation.abs_tolerance, simulation.rel_tolerance
+
+
+def get_binary_results(results, time_variable_ids):
+    """
+    Returns results of simulate or simulate_batch (called with as_numpy)
+    in the form expected by :class:`SimulationBinaryRenderer`.
+    """
+    binary_results = []
+    for result in results:
+        if "outputs" in result:
+            outputs = result["outputs"]
+        else:
+            outputs = {
+                k: v
+                for k, v in result.items()
+                if k not in ["group_id", "steady_state_time"]
+            }
+        time = next((k for k in outputs if k in time_variable_ids), None)
+        binary_result = {
+            "group": result["group_id"],
+            "time": time,
+            "outputs": outputs,
+        }
+        if "steady_state_time" in result:
+            binary_result["steady_state_time"] = result["steady_state_time"]
+        binary_results.append(binary_result)
+    return binary_results
 
 
 class SimulateSerializer(serializers.Serializer):
     outputs = serializers.ListField(child=serializers.CharField())
     variables = serializers.DictField(child=serializers.FloatField())
     time_max = serializers.FloatField(required=False)
+    max_points = serializers.IntegerField(
+        required=False,
+        min_value=3,
+        help_text=(
+            "reduce the number of time points returned to at most this many, "
+            "keeping peaks and troughs"
+        ),
+    )
+    log_times = serializers.ListField(
+        child=serializers.FloatField(),
+        required=False,
+        help_text="only return outputs at these times",
+    )
+    steady_state = serializers.BooleanField(
+        required=False,
+        help_text=(
+            "repeat the last dosing period once the solution has reached "
+            "a periodic steady state instead of solving it"
+        ),
+    )
+    simulation = serializers.IntegerField(
+        required=False,
+        help_text="id of the simulation whose solver tolerances are used",
+    )
+    preview = serializers.BooleanField(
+        required=False,
+        help_text=(
+            "return a quick, coarse result and refine it in the background, "
+            "so that a later identical request handled by the same server "
+            "process returns the refined result"
+        ),
+    )
 
 
 class SimulateResponseSerializer(serializers.Serializer):
@@ -23,23 +122,101 @@ class SimulateResponseSerializer(serializers.Serializer):
     outputs = serializers.DictField(
         child=serializers.ListField(child=serializers.FloatField())
     )
+    steady_state_time = serializers.FloatField(required=False, allow_null=True)
 
     def to_representation(self, instance):
         outputs = {}
         times = []
         group = None
+        representation = {}
+        time_variable_ids = _get_time_variable_ids(instance, self.context)
         for var_id, values in instance.items():
             if var_id == "group_id":
                 group = values
                 continue
-            variable = Variable.objects.get(pk=var_id)
-            if variable.name == "time" or variable.name == "t":
+            if var_id == "steady_state_time":
+                representation["steady_state_time"] = values
+                continue
+            if var_id in time_variable_ids:
                 times = values
             outputs[var_id] = values
+        representation.update(
+            {
+                "outputs": outputs,
+                "time": times,
+                "group": group,
+            }
+        )
+        return representation
+
+
+class SimulateBatchSerializer(serializers.Serializer):
+    outputs = serializers.ListField(child=serializers.CharField())
+    variables = serializers.ListField(
+        child=serializers.DictField(child=serializers.FloatField()),
+        required=False,
+        help_text="list of variable sets, one for each scenario",
+    )
+    grid = serializers.DictField(
+        child=serializers.ListField(child=serializers.FloatField(), min_length=1),
+        required=False,
+        help_text=(
+            "dict mapping variable names to lists of values, "
+            "a scenario is simulated for every combination of these values"
+        ),
+    )
+    time_max = serializers.FloatField(required=False)
+    max_points = serializers.IntegerField(required=False, min_value=3)
+    log_times = serializers.ListField(child=serializers.FloatField(), required=False)
+    simulation = serializers.IntegerField(
+        required=False,
+        help_text="id of the simulation whose solver tolerances are used",
+    )
+
+    max_scenarios = 1000
+
+    def validate(self, data):
+        if ("variables" in data) == ("grid" in data):
+            raise serializers.ValidationError(
+                "exactly one of variables or grid must be given"
+            )
+        if "grid" in data:
+            qnames = list(data["grid"].keys())
+            data["variables"] = [
+                dict(zip(qnames, values))
+                for values in itertools.product(*data["grid"].values())
+            ]
+        if len(data["variables"]) == 0:
+            raise serializers.ValidationError("no scenarios given")
+        if len(data["variables"]) > self.max_scenarios:
+            raise serializers.ValidationError(
+                f"at most {self.max_scenarios} scenarios can be simulated at once"
+            )
+        return data
+
+
+class SimulateBatchResponseSerializer(serializers.Serializer):
+    time = serializers.ListField(
+        child=serializers.ListField(child=serializers.FloatField())
+    )
+    group = serializers.IntegerField(required=False, allow_null=True)
+    outputs = serializers.DictField(
+        child=serializers.ListField(
+            child=serializers.ListField(child=serializers.FloatField())
+        )
+    )
+
+    def to_representation(self, instance):
+        outputs = instance["outputs"]
+        times = []
+        time_variable_ids = _get_time_variable_ids(outputs, self.context)
+        for var_id, values in outputs.items():
+            if var_id in time_variable_ids:
+                times = values
         return {
             "outputs": outputs,
             "time": times,
-            "group": group,
+            "group": instance["group_id"],
         }
 
 
@@ -56,21 +233,51 @@ class ErrorResponseSerializer(serializers.Serializer):
     },
 )
 class SimulateBaseView(views.APIView):
+    renderer_classes = [JSONRenderer, SimulationBinaryRenderer]
+
     def post(self, request, pk, format=None):
         try:
             m = self.model.objects.get(pk=pk)
         except self.model.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        outputs = request.data.get("outputs", None)
-        variables = request.data.get("variables", None)
-        time_max = request.data.get("time_max", None)
+        serializer = SimulateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        preview = data.get("preview", False)
+        binary = isinstance(request.accepted_renderer, SimulationBinaryRenderer)
         try:
-            result = m.simulate(outputs, variables, time_max)
+            tolerance = get_simulation_tolerance(m, data.get("simulation", None))
+        except Simulation.DoesNotExist:
+            serialized_result = ErrorResponseSerializer(
+                {"error": "simulation not found in the model's project"}
+            )
+            return Response(serialized_result.data, status=status.HTTP_400_BAD_REQUEST)
+        simulate = m.simulate_preview if preview else m.simulate
+        try:
+            result = simulate(
+                data["outputs"],
+                data["variables"],
+                data.get("time_max", None),
+                as_numpy=binary,
+                max_points=data.get("max_points", None),
+                log_times=data.get("log_times", None),
+                steady_state=data.get("steady_state", False),
+                tolerance=tolerance,
+            )
         except myokit.MyokitError as e:
             serialized_result = ErrorResponseSerializer({"error": str(e)})
             return Response(serialized_result.data, status=status.HTTP_400_BAD_REQUEST)
-        serialized_result = SimulateResponseSerializer(result, many=True)
-        return Response(serialized_result.data)
+        time_variable_ids = get_time_variable_ids(m)
+        headers = {"X-Simulation-Preview": "true"} if preview else None
+        if binary:
+            return Response(
+                get_binary_results(result, time_variable_ids), headers=headers
+            )
+        serialized_result = SimulateResponseSerializer(
+            result, many=True, context={"time_variable_ids": time_variable_ids}
+        )
+        return Response(serialized_result.data, headers=headers)
 
 
 class SimulateCombinedView(SimulateBaseView):
@@ -79,3 +286,53 @@ class SimulateCombinedView(SimulateBaseView):
 
 class SimulatePdView(SimulateBaseView):
     model = PharmacodynamicModel
+
+
+@extend_schema(
+    request=SimulateBatchSerializer,
+    responses={
+        200: SimulateBatchResponseSerializer(many=True),
+        400: ErrorResponseSerializer,
+        404: None,
+    },
+)
+class SimulateBatchCombinedView(views.APIView):
+    renderer_classes = [JSONRenderer, SimulationBinaryRenderer]
+
+    def post(self, request, pk, format=None):
+        try:
+            m = CombinedModel.objects.get(pk=pk)
+        except CombinedModel.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        serializer = SimulateBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        binary = isinstance(request.accepted_renderer, SimulationBinaryRenderer)
+        try:
+            tolerance = get_simulation_tolerance(m, data.get("simulation", None))
+        except Simulation.DoesNotExist:
+            serialized_result = ErrorResponseSerializer(
+                {"error": "simulation not found in the model's project"}
+            )
+            return Response(serialized_result.data, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = m.simulate_batch(
+                data["outputs"],
+                data["variables"],
+                data.get("time_max", None),
+                as_numpy=binary,
+                max_points=data.get("max_points", None),
+                log_times=data.get("log_times", None),
+                tolerance=tolerance,
+            )
+        except myokit.MyokitError as e:
+            serialized_result = ErrorResponseSerializer({"error": str(e)})
+            return Response(serialized_result.data, status=status.HTTP_400_BAD_REQUEST)
+        time_variable_ids = get_time_variable_ids(m)
+        if binary:
+            return Response(get_binary_results(result, time_variable_ids))
+        serialized_result = SimulateBatchResponseSerializer(
+            result, many=True, context={"time_variable_ids": time_variable_ids}
+        )
+        return Response(serialized_result.data)
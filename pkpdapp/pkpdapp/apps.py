@@ -12,6 +12,37 @@ class PkpdAppConfig(AppConfig):
 
     def ready(self):
         from django.contrib.auth.models import User
-        from .signals import add_profile_on_user_save
-        from django.db.models.signals import post_save
+        from .signals import (
+            add_profile_on_user_save,
+            clear_conversion_factors_on_save,
+            clear_unit_index_on_save,
+            invalidate_simulation_results_on_save,
+        )
+        from django.db.models.signals import post_save, post_delete
+        from .models import (
+            CombinedModel,
+            Compound,
+            Dose,
+            PharmacodynamicModel,
+            Project,
+            Protocol,
+            Unit,
+        )
         post_save.connect(add_profile_on_user_save, sender=User)
+        # variables are not listed, the simulation results are keyed by
+        # their values and units instead (so they can still be fast deleted)
+        for sender in [
+            CombinedModel,
+            Compound,
+            Dose,
+            PharmacodynamicModel,
+            Project,
+            Protocol,
+        ]:
+            post_save.connect(invalidate_simulation_results_on_save, sender=sender)
+            post_delete.connect(invalidate_simulation_results_on_save, sender=sender)
+        for sender in [Compound, Unit]:
+            post_save.connect(clear_conversion_factors_on_save, sender=sender)
+            post_delete.connect(clear_conversion_factors_on_save, sender=sender)
+        post_save.connect(clear_unit_index_on_save, sender=Unit)
+        post_delete.connect(clear_unit_index_on_save, sender=Unit)
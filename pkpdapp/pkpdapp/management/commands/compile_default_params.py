@@ -0,0 +1,39 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+from django.core.management.base import BaseCommand, CommandError
+from pkpdapp.utils.default_params import (
+    DEFAULTS_PATH,
+    WORKBOOK_PATH,
+    is_up_to_date,
+    write_defaults,
+)
+
+
+class Command(BaseCommand):
+    help = """
+    Compiles the default parameters of the library models from
+    ParametersValue_Species.xlsx into ParametersValue_Species.json, which
+    is loaded at run time. Run this after changing the workbook.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="only check that the compiled parameters are up to date",
+        )
+
+    def handle(self, **options):
+        if options["check"]:
+            if not is_up_to_date():
+                raise CommandError(
+                    f"{DEFAULTS_PATH} is out of date with {WORKBOOK_PATH}, "
+                    "run 'python manage.py compile_default_params'"
+                )
+            self.stdout.write(self.style.SUCCESS(f"{DEFAULTS_PATH} is up to date"))
+            return
+        write_defaults()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {DEFAULTS_PATH}"))
@@ -0,0 +1,130 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import datetime
+import os
+import time
+from django.conf import settings
+from django.core.cache import close_caches
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+from pkpdapp.models import CombinedModel
+from pkpdapp.utils.process_pool import get_process_pool
+
+
+def warm_model(pk):
+    """
+    Builds the combined model with primary key ``pk`` and compiles the
+    simulators of its dosing structures into the simulator cache, returning
+    the primary key, name, the structure keys, the build and compile times
+    in seconds and the error message (None if successful).
+    """
+    name = None
+    keys = []
+    build_time = compile_time = None
+    try:
+        m = CombinedModel.objects.get(pk=pk)
+        name = m.name
+        start = time.perf_counter()
+        m.get_myokit_model()
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        keys = m.warm_simulators()
+        compile_time = time.perf_counter() - start
+        error = None
+    except Exception as e:
+        error = str(e)
+    return pk, name, keys, build_time, compile_time, error
+
+
+class Command(BaseCommand):
+    help = """
+    Builds the combined models of recently active projects and compiles
+    the simulators of their dosing structures into the simulator cache
+    (SIMULATOR_CACHE_DIR), so that the first simulation after a deploy
+    does not have to wait for them.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help=(
+                "warm the models of projects with a user that logged in "
+                "within this many days (default: 30)"
+            ),
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count(),
+            help="number of models to build in parallel (default: number of CPUs)",
+        )
+
+    def get_items(self, days):
+        since = timezone.now() - datetime.timedelta(days=days)
+        return list(
+            CombinedModel.objects.filter(
+                read_only=False,
+                project__users__last_login__gte=since,
+            )
+            .distinct()
+            .values_list("pk", flat=True)
+        )
+
+    def handle(self, **options):
+        if not settings.SIMULATOR_CACHE_DIR:
+            # compiled simulators would only be kept by the processes of
+            # this command
+            self.stdout.write(
+                self.style.WARNING(
+                    "SIMULATOR_CACHE_DIR is not set, nothing to warm the "
+                    "simulators into"
+                )
+            )
+            return
+
+        items = self.get_items(options["days"])
+        self.stdout.write(f"Warming {len(items)} models...")
+
+        if options["processes"] > 1:
+            # forked workers must not share the database and cache
+            # connections of this process, they open their own
+            connections.close_all()
+            close_caches()
+        pool = get_process_pool("warm_models", options["processes"])
+        start = time.perf_counter()
+        if pool is None:
+            results = [warm_model(item) for item in items]
+        else:
+            results = pool.map(warm_model, items)
+        total_time = time.perf_counter() - start
+
+        failed = 0
+        structures = set()
+        results = sorted(results, key=lambda r: -((r[3] or 0.0) + (r[4] or 0.0)))
+        self.stdout.write(
+            f"{'model':<40} {'id':>6} {'build (s)':>10} {'compile (s)':>12}"
+        )
+        for pk, name, keys, build_time, compile_time, error in results:
+            name = str(name)[:40]
+            structures.update(keys)
+            if error is not None:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"{name:<40} {pk:>6} {error}"))
+                continue
+            self.stdout.write(
+                f"{name:<40} {pk:>6} {build_time:>10.3f} {compile_time:>12.3f}"
+            )
+        message = (
+            f"Warmed {len(structures)} simulators of {len(results) - failed} "
+            f"models in {total_time:.1f}s, {failed} failed"
+        )
+        if failed:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
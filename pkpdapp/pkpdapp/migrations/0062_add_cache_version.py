@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-17 10:12
+
+from django.db import migrations, models
+import pkpdapp.models.myokit_model_mixin
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pkpdapp", "0061_add_auc_units"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="combinedmodel",
+            name="cache_version",
+            field=models.CharField(
+                max_length=32,
+                default=pkpdapp.models.myokit_model_mixin.new_cache_version,
+                editable=False,
+                help_text=(
+                    "changed whenever the myokit model or simulator changes, "
+                    "used to invalidate cached copies"
+                ),
+            ),
+        ),
+        migrations.AddField(
+            model_name="pharmacodynamicmodel",
+            name="cache_version",
+            field=models.CharField(
+                max_length=32,
+                default=pkpdapp.models.myokit_model_mixin.new_cache_version,
+                editable=False,
+                help_text=(
+                    "changed whenever the myokit model or simulator changes, "
+                    "used to invalidate cached copies"
+                ),
+            ),
+        ),
+        migrations.AddField(
+            model_name="pharmacokineticmodel",
+            name="cache_version",
+            field=models.CharField(
+                max_length=32,
+                default=pkpdapp.models.myokit_model_mixin.new_cache_version,
+                editable=False,
+                help_text=(
+                    "changed whenever the myokit model or simulator changes, "
+                    "used to invalidate cached copies"
+                ),
+            ),
+        ),
+    ]
@@ -13,6 +13,10 @@ from pkpdapp.models import (
     Unit,
     DerivedVariable,
 )
+from pkpdapp.models.myokit_model_mixin import (
+    invalidate_simulation_results,
+    new_cache_version,
+)
 import myokit
 import os
 import tempfile
@@ -20,7 +24,7 @@ from myokit.formats.diffsl import DiffSLExporter
 from django.db import models
 from django.urls import reverse
 import logging
-from pkpdapp.utils.default_params import defaults
+from pkpdapp.utils.default_params import get_defaults
 from pkpdapp.utils.derived_variables import (
     add_pk_variable,
     add_pd_variable,
@@ -144,6 +148,15 @@ class CombinedModel(MyokitModelMixin, StoredModel):
             "units specified by the mmt model)"
         ),
     )
+    cache_version = models.CharField(
+        max_length=32,
+        default=new_cache_version,
+        editable=False,
+        help_text=(
+            "changed whenever the myokit model or simulator changes, "
+            "used to invalidate cached copies"
+        ),
+    )
     __original_pk_model = None
     __original_pk_model2 = None
     __original_pk_effect_model = None
@@ -583,7 +596,23 @@ class CombinedModel(MyokitModelMixin, StoredModel):
         )
         self.__original_has_anti_drug_antibodies = self.has_anti_drug_antibodies
 
-    def reset_params_to_defaults(self, species, compoundType, variables=None):
+    def reset_params_to_defaults(
+        self, species, compoundType, variables=None, dry_run=False
+    ):
+        """
+        Sets the default value, unit and unit_per_body_weight of the
+        ``variables`` (all variables of the model if None) of a library model
+        to the defaults for the model, ``species`` and ``compoundType``.
+
+        All units are looked up in one query and all changed variables are
+        saved with one bulk update. Returns a dict mapping the qnames of
+        the changed variables to dicts of the changed fields and their new
+        values. If ``dry_run``, the variables are not changed, otherwise
+        the cached simulation results of the project are invalidated.
+        """
+        from pkpdapp.models import Variable
+
+        changes = {}
         if self.is_library_model:
             project = self.project
             if project is None:
@@ -633,25 +662,44 @@ class CombinedModel(MyokitModelMixin, StoredModel):
                 model2_name,
             )
             if variables is None:
-                variables = self.variables.all()
+                variables = self.variables.select_related("unit")
+            defaults = get_defaults()
+
+            # find the defaults of all variables and the symbols of the units
+            # they use
+            planned = []
+            symbols = set()
             for v in variables:
+                variable_defaults = []
                 for mn in [model_name, model2_name]:
                     if mn is None:
                         continue
-                    varName = v.name
                     defaultVal = (
                         defaults.get(mn, {})
-                        .get(varName, {})
+                        .get(v.name, {})
                         .get(species, {})
                         .get(compoundType, None)
                     )
                     if defaultVal is None:
                         continue
-                    if defaultVal.get("unit", "") == "dimensionless":
-                        defaultVal["unit"] = ""
-                    unit = Unit.objects.filter(
-                        symbol=defaultVal.get("unit", "")
-                    ).first()
+                    symbol = defaultVal.get("unit", "")
+                    if symbol == "dimensionless":
+                        symbol = ""
+                    symbols.update([symbol, symbol[:-3]])
+                    variable_defaults.append((defaultVal.get("value", None), symbol))
+                if variable_defaults:
+                    planned.append((v, variable_defaults))
+
+            # the unit with the lowest id for each symbol, as .first() would
+            units = {}
+            for unit in Unit.objects.filter(symbol__in=symbols).order_by("-id"):
+                units[unit.symbol] = unit
+
+            changed_variables = []
+            for v, variable_defaults in planned:
+                new_values = {}
+                for value, symbol in variable_defaults:
+                    unit = units.get(symbol)
                     # TODO: previously only the vol_per_kg units were per body weight
                     # but now vmax can also be per body weight
                     # in the future might want to swap to just enumerating some
@@ -661,28 +709,43 @@ class CombinedModel(MyokitModelMixin, StoredModel):
                     if unit is not None:
                         is_vol_per_kg = unit.m == 3 and unit.g == -1
                         if is_vol_per_kg:
-                            unit = Unit.objects.filter(
-                                symbol=defaultVal.get("unit", "")[:-3]
-                            ).first()
+                            unit = units.get(symbol[:-3])
                     # vmax is a special case that might be in units of amount/time
                     # or amount/(time*kg)
                     if is_vmax:
-                        is_per_kg = defaultVal.get("unit", "").endswith("/kg")
+                        is_per_kg = symbol.endswith("/kg")
                         if is_per_kg:
-                            unit = Unit.objects.filter(
-                                symbol=defaultVal.get("unit", "")[:-3]
-                            ).first()
-                    value = defaultVal.get("value", None)
-                    print(f"setting {v.qname} to default value {value} and unit {unit}")
+                            unit = units.get(symbol[:-3])
                     if value is not None:
-                        v.default_value = value
+                        new_values["default_value"] = value
                     if unit is not None:
-                        v.unit_per_body_weight = is_preclinical and (
+                        new_values["unit_per_body_weight"] = is_preclinical and (
                             is_vol_per_kg or is_vmax
                         )
-                        v.unit = unit
-                    if not v._state.adding:
-                        v.save()
+                        new_values["unit"] = unit
+                variable_changes = {
+                    field: new_value
+                    for field, new_value in new_values.items()
+                    if getattr(v, field) != new_value
+                }
+                if not variable_changes:
+                    continue
+                changes[v.qname] = variable_changes
+                if dry_run:
+                    continue
+                for field, new_value in variable_changes.items():
+                    setattr(v, field, new_value)
+                if not v._state.adding:
+                    changed_variables.append(v)
+
+            Variable.objects.bulk_update(
+                changed_variables, ["default_value", "unit", "unit_per_body_weight"]
+            )
+            # bulk_update does not send post_save, so the cached simulation
+            # results have to be invalidated here
+            if changed_variables:
+                invalidate_simulation_results(self.get_project())
+        return changes
 
 
 class PkpdMapping(StoredModel):
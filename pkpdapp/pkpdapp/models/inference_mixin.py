@@ -4,13 +4,17 @@
 # copyright notice and full license details.
 #
 
+from django.conf import settings
 from django.db import transaction
 import numpy as np
 import pints
 import myokit
 import time
+import traceback
+import pymc3 as pm
 import theano.tensor as tt
 import theano
+from scipy.special import expit, logit
 from tdigest import TDigest
 from pkpdapp.models import (
     Inference,
@@ -38,6 +42,122 @@ samplers_dict = {
     'Population MCMC': pints.PopulationMCMC
 }
 
+# number of iterations chain worker processes run between reporting results
+chain_block_size = 10
+
+
+def _run_chains(mixin, chain_indices, start, stop, initial_phase_iterations,
+                seed, conn):
+    """
+    Runs iterations ``start`` to ``stop`` of the chains ``chain_indices`` of
+    ``mixin`` (an :class:`InferenceMixin`) in a worker process, sending
+    blocks of at most ``chain_block_size`` iterations to ``conn``. Each
+    iteration is a list with a ``(x, score, n_evals)`` tuple per chain.
+
+    The global numpy random state, used by the pints samplers, is seeded
+    from ``seed`` (a ``np.random.SeedSequence``), as forked workers would
+    otherwise all draw the same random numbers.
+    """
+    from pkpdapp.utils.process_pool import mark_worker_process
+
+    mark_worker_process()
+    np.random.seed(seed.generate_state(4))
+    try:
+        block = []
+        for i in range(start, stop):
+            if i == initial_phase_iterations:
+                for c in chain_indices:
+                    mixin._inference_objects[c].set_initial_phase(False)
+            block.append([
+                mixin._step_chain(mixin._inference_objects[c])
+                for c in chain_indices
+            ])
+            if len(block) == chain_block_size or i == stop - 1:
+                conn.send(('ok', block))
+                block = []
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def _receive_chains(conn, process):
+    """
+    Returns the next block of iterations sent by a :func:`_run_chains`
+    worker.
+    """
+    while not conn.poll(1.0):
+        if not process.is_alive():
+            raise RuntimeError(
+                'inference worker exited with code {}'.format(
+                    process.exitcode
+                )
+            )
+    try:
+        status, value = conn.recv()
+    except EOFError:
+        raise RuntimeError('inference worker exited unexpectedly')
+    if status == 'error':
+        raise RuntimeError('inference worker failed:\n{}'.format(value))
+    return value
+
+
+_worker_log_posterior = None
+
+
+def _init_population_worker(log_posterior):
+    from pkpdapp.utils.process_pool import mark_worker_process
+
+    global _worker_log_posterior
+    mark_worker_process()
+    _worker_log_posterior = log_posterior
+
+
+def _evaluate_in_worker(x):
+    return _worker_log_posterior(x)
+
+
+class PopulationEvaluator:
+    """
+    Evaluates a log-posterior for all the candidate points proposed by a
+    population-based optimiser in parallel.
+
+    With ``processes`` > 1 the candidates are split over a pool of forked
+    worker processes, each with its own copy of ``log_posterior``.
+    Otherwise, or if processes cannot be forked, the candidates are
+    evaluated one after the other.
+    """
+
+    def __init__(self, log_posterior, processes=0):
+        from pkpdapp.utils.process_pool import can_fork, get_fork_context
+
+        self._log_posterior = log_posterior
+        self._pool = None
+        if processes < 2 or not can_fork():
+            return
+        try:
+            self._pool = get_fork_context().Pool(
+                processes,
+                initializer=_init_population_worker,
+                initargs=(log_posterior,)
+            )
+        except (OSError, ValueError, AssertionError) as e:
+            print('could not create population worker processes:', e)
+
+    def __call__(self, xs):
+        """
+        Returns the log-posterior of each point in ``xs``.
+        """
+        if self._pool is not None:
+            return self._pool.map(_evaluate_in_worker, list(xs))
+        return [self._log_posterior(x) for x in xs]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
 
 class ChainWriter:
     """
@@ -397,15 +517,8 @@ class InferenceMixin:
                 'in model'
             )
 
-        pymc3_model = \
-            self._observed_log_likelihoods[0].create_pymc3_model(
-                *self._observed_log_likelihoods[1:]
-            )
-
-        self._pints_log_posterior = PyMC3LogPosterior(
-            pymc3_model, self._observed_log_likelihoods, self._priors,
-            optimisation=(self.inference.algorithm.category == 'OP')
-        )
+        self._pints_log_posterior = self._create_log_posterior()
+        self._population_evaluator = None
 
         # create chains if not exist
         if self.inference.chains.count() == 0:
@@ -532,6 +645,32 @@ class InferenceMixin:
                 self._inference_method(x0, sigma0)
             )
 
+    def _create_log_posterior(self):
+        optimisation = self.inference.algorithm.category == 'OP'
+        if (
+            settings.INFERENCE_NUMPY_LOG_POSTERIOR and
+            NumpyLogPosterior.is_supported(
+                self._priors, self._observed_log_likelihoods
+            )
+        ):
+            print('using numpy log-posterior')
+            return NumpyLogPosterior(
+                self._observed_log_likelihoods, self._priors,
+                optimisation=optimisation
+            )
+
+        forward_models = []
+        pymc3_model = \
+            self._observed_log_likelihoods[0].create_pymc3_model(
+                *self._observed_log_likelihoods[1:],
+                forward_models=forward_models
+            )
+
+        return PyMC3LogPosterior(
+            pymc3_model, self._observed_log_likelihoods, self._priors,
+            optimisation=optimisation, forward_models=forward_models
+        )
+
     @staticmethod
     def get_inference_type_and_method(inference):
         inference_type = inference.algorithm.category
@@ -575,28 +714,106 @@ class InferenceMixin:
                         value=prior_values[0]
                     )
 
-    def step_inference(self, writer, output_writer):
-        # runs one set of ask / tell
-        fn_values = []
-        x0s = []
-        for obj in self._inference_objects:
-            x = obj.ask()
-            if self._inference_type == "SA":  # sampling
-                score = self._pints_log_posterior(x)
-                self.inference.number_of_function_evals += 1
-                x, score, accepted = obj.tell(score)
-            else:
+    def _step_chain(self, obj):
+        # runs one ask / tell of a single chain, returns the current point
+        # (in model space), its score and the number of function evaluations
+        x = obj.ask()
+        if self._inference_type == "SA":  # sampling
+            score = self._pints_log_posterior(x)
+            n_evals = 1
+            x, score, accepted = obj.tell(score)
+        else:
+            if self._population_evaluator is None:
                 scores = [self._pints_log_posterior(xi) for xi in x]
-                self.inference.number_of_function_evals += len(x)
-                obj.tell(scores)
-                x = obj.xbest()
-                score = -obj.fbest()
-
-            x0s.append(self._pints_log_posterior.to_model(x))
-            fn_values.append(score)
+            else:
+                scores = self._population_evaluator(x)
+            n_evals = len(x)
+            obj.tell(scores)
+            x = obj.xbest()
+            score = -obj.fbest()
+        return self._pints_log_posterior.to_model(x), score, n_evals
+
+    def _append_iteration(self, results, writer, output_writer):
+        # records one iteration, given a (x, score, n_evals) tuple per chain
+        x0s = [x for x, _, _ in results]
+        fn_values = [score for _, score, _ in results]
+        self.inference.number_of_function_evals += sum(
+            n_evals for _, _, n_evals in results
+        )
         writer.append(fn_values, x0s, self.inference.number_of_iterations)
         output_writer.append(x0s, self.inference.number_of_iterations)
 
+    def step_inference(self, writer, output_writer):
+        # runs one set of ask / tell
+        results = [
+            self._step_chain(obj) for obj in self._inference_objects
+        ]
+        self._append_iteration(results, writer, output_writer)
+
+    def get_number_of_processes(self):
+        """
+        Returns the number of worker processes to run the chains in, or 0
+        to run them one after the other in this process. Each process runs
+        the ask / tell loop of one or more chains with its own copy of the
+        log-posterior.
+        """
+        from pkpdapp.utils.process_pool import can_fork
+
+        processes = min(
+            settings.INFERENCE_PROCESSES, len(self._inference_objects)
+        )
+        if processes < 2 or not can_fork():
+            return 0
+        return processes
+
+    def _run_chains_parallel(self, processes, start, stop,
+                             initial_phase_iterations, writer,
+                             output_writer, on_iteration):
+        # runs iterations start to stop with the chains split over
+        # processes forked workers, which inherit the samplers and the
+        # log-posterior. Results are gathered and written here.
+        from pkpdapp.utils.process_pool import get_fork_context
+
+        context = get_fork_context()
+        n_chains = len(self._inference_objects)
+        seeds = np.random.SeedSequence().spawn(processes)
+        workers = []
+        try:
+            for k in range(processes):
+                chain_indices = list(range(k, n_chains, processes))
+                recv_conn, send_conn = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_run_chains,
+                    args=(self, chain_indices, start, stop,
+                          initial_phase_iterations, seeds[k], send_conn),
+                    daemon=True,
+                )
+                process.start()
+                send_conn.close()
+                workers.append((chain_indices, recv_conn, process))
+
+            i = start
+            while i < stop:
+                blocks = [
+                    _receive_chains(conn, process)
+                    for _, conn, process in workers
+                ]
+                for step in range(len(blocks[0])):
+                    results = [None] * n_chains
+                    for (chain_indices, _, _), block in zip(workers, blocks):
+                        for c, result in zip(chain_indices, block[step]):
+                            results[c] = result
+                    self.inference.number_of_iterations += 1
+                    self._append_iteration(results, writer, output_writer)
+                    on_iteration(i)
+                    i += 1
+        finally:
+            for _, conn, process in workers:
+                conn.close()
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
     def run_inference(self):
         # runs ask / tell
         time_start = time.time()
@@ -634,14 +851,8 @@ class InferenceMixin:
             store_output_range=self.inference.algorithm.category == 'SA',
             pooled=self._pooled
         )
-        for i in range(n_iterations, max_iterations):
-            if i == initial_phase_iterations:
-                print('Turning off initial phase')
-                for sampler in self._inference_objects:
-                    sampler.set_initial_phase(False)
 
-            self.inference.number_of_iterations += 1
-            self.step_inference(writer, output_writer)
+        def on_iteration(i):
             time_now = time.time()
             self.inference.time_elapsed = time_now - time_start
 
@@ -655,17 +866,188 @@ class InferenceMixin:
                     ]
                 )
 
-        # write out the remaining iterations
-        writer.write()
-        output_writer.write()
+        try:
+            processes = self.get_number_of_processes()
+            if processes > 0 and n_iterations < max_iterations:
+                print('running chains in {} processes'.format(processes))
+                self._run_chains_parallel(
+                    processes, n_iterations, max_iterations,
+                    initial_phase_iterations, writer, output_writer,
+                    on_iteration
+                )
+            else:
+                # chains run one after the other, so evaluate the populations
+                # of population-based optimisers in parallel instead
+                if (
+                    self._inference_type == 'OP' and
+                    issubclass(
+                        self._inference_method, pints.PopulationBasedOptimiser
+                    ) and
+                    n_iterations < max_iterations
+                ):
+                    self._population_evaluator = PopulationEvaluator(
+                        self._pints_log_posterior,
+                        processes=settings.INFERENCE_POPULATION_PROCESSES,
+                    )
+                for i in range(n_iterations, max_iterations):
+                    if i == initial_phase_iterations:
+                        print('Turning off initial phase')
+                        for sampler in self._inference_objects:
+                            sampler.set_initial_phase(False)
+
+                    self.inference.number_of_iterations += 1
+                    self.step_inference(writer, output_writer)
+                    on_iteration(i)
+
+            # write out the remaining iterations
+            writer.write()
+            output_writer.write()
+        finally:
+            # stop the worker processes of the population evaluator and of
+            # the forward models, if any
+            if self._population_evaluator is not None:
+                self._population_evaluator.close()
+                self._population_evaluator = None
+            self._pints_log_posterior.close()
         self.inference.save()
 
     def fixed_variables(self):
         return self._fixed_variables
 
 
+def _softplus(x):
+    return np.logaddexp(0.0, x)
+
+
+def _get_constant_value(variable):
+    """
+    Returns the value of a theano constant or shared variable, or None if
+    ``variable`` is neither.
+    """
+    if isinstance(variable, tt.TensorConstant):
+        return variable.data
+    if isinstance(variable, theano.compile.SharedVariable):
+        return variable.get_value()
+    return None
+
+
+class ParameterTransform:
+    """
+    Transforms a parameter vector between the model space of the priors and
+    the unconstrained search space of their pymc3 model.
+
+    The log, logodds and interval (with constant bounds) transforms are
+    applied to the whole vector at once with NumPy, any other transform
+    uses a compiled theano function for its slice of the vector.
+
+    Arguments:
+        transforms -- the pymc3 transform (or None) of each prior
+        slices -- the index (or slice) of each prior in the parameter vector
+        lengths -- the length of each prior
+    """
+
+    def __init__(self, transforms, slices, lengths):
+        n_parameters = sum(lengths)
+        log = []
+        logodds = []
+        interval = []
+        interval_lower = []
+        interval_upper = []
+        self._others = []
+        for transform, prior_slice, length in zip(transforms, slices, lengths):
+            if transform is None:
+                continue
+            indices = np.arange(n_parameters)[prior_slice]
+            indices = np.atleast_1d(indices).tolist()
+            if transform.name == 'log':
+                log += indices
+                continue
+            if transform.name == 'logodds':
+                logodds += indices
+                continue
+            if transform.name == 'interval':
+                lower = _get_constant_value(transform.a)
+                upper = _get_constant_value(transform.b)
+                if lower is not None and upper is not None:
+                    interval += indices
+                    interval_lower += np.broadcast_to(lower, length).tolist()
+                    interval_upper += np.broadcast_to(upper, length).tolist()
+                    continue
+            is_scalar = length == 1
+            self._others.append((
+                prior_slice,
+                PyMC3LogPosterior._transform_forward(transform, is_scalar),
+                PyMC3LogPosterior._transform_backward(transform, is_scalar),
+                self._jacobian_det(transform, is_scalar),
+            ))
+        self._log = np.array(log, dtype=int)
+        self._logodds = np.array(logodds, dtype=int)
+        self._interval = np.array(interval, dtype=int)
+        self._interval_lower = np.array(interval_lower, dtype=float)
+        self._interval_width = \
+            np.array(interval_upper, dtype=float) - self._interval_lower
+
+    @staticmethod
+    def _jacobian_det(transform, is_scalar=True):
+        if is_scalar:
+            x = tt.dscalar('x')
+            x.tag.test_value = 1.0
+        else:
+            x = tt.dvector('x')
+            x.tag.test_value = [1.0]
+        return theano.function([x], transform.jacobian_det(x))
+
+    def to_search(self, x):
+        """
+        Returns a copy of ``x`` transformed from model to search space.
+        """
+        y = np.array(x, dtype=float)
+        y[self._log] = np.log(y[self._log])
+        y[self._logodds] = logit(y[self._logodds])
+        z = y[self._interval] - self._interval_lower
+        y[self._interval] = np.log(z) - np.log(self._interval_width - z)
+        for prior_slice, forward, _, _ in self._others:
+            y[prior_slice] = forward(y[prior_slice])
+        return y
+
+    def to_model(self, y):
+        """
+        Returns a copy of ``y`` transformed from search to model space.
+        """
+        x = np.array(y, dtype=float)
+        x[self._log] = np.exp(x[self._log])
+        x[self._logodds] = expit(x[self._logodds])
+        x[self._interval] = self._interval_lower + \
+            self._interval_width * expit(x[self._interval])
+        for prior_slice, _, backward, _ in self._others:
+            x[prior_slice] = backward(x[prior_slice])
+        return x
+
+    def log_jacobian_det(self, y):
+        """
+        Returns the log of the absolute determinant of the Jacobian of
+        :meth:`to_model` at the search space point ``y``.
+        """
+        y = np.asarray(y, dtype=float)
+        result = np.sum(y[self._log])
+        z = y[self._logodds]
+        result += np.sum(-_softplus(-z) - _softplus(z))
+        z = y[self._interval]
+        result += np.sum(
+            np.log(self._interval_width) - _softplus(-z) - _softplus(z)
+        )
+        for prior_slice, _, _, jacobian_det in self._others:
+            result += np.sum(jacobian_det(y[prior_slice]))
+        return float(result)
+
+
 class PyMC3LogPosterior(pints.LogPDF):
-    def __init__(self, model, log_likelihoods, priors, optimisation=False):
+    def __init__(self, model, log_likelihoods, priors, optimisation=False,
+                 forward_models=None):
+        # forward models of the pymc3 model, closed by close()
+        if forward_models is None:
+            forward_models = []
+        self._forward_models = forward_models
         self._original_prior_names = [
             p.name for p in priors
         ]
@@ -689,16 +1071,9 @@ class PyMC3LogPosterior(pints.LogPDF):
         self._transform_names = [
             t if t is None else t.name for t in self._transforms
         ]
-        self._transform_backwards = [
-            self._transform_backward(t, l == 1) for t, l in zip(
-                self._transforms, self._prior_lengths
-            )
-        ]
-        self._transform_forwards = [
-            self._transform_forward(t, l == 1) for t, l in zip(
-                self._transforms, self._prior_lengths
-            )
-        ]
+        self._parameter_transform = ParameterTransform(
+            self._transforms, self._prior_slices, self._prior_lengths
+        )
         self._prior_names = [
             self._get_name(p, t) for p, t in zip(priors, self._transforms)
         ]
@@ -783,22 +1158,17 @@ class PyMC3LogPosterior(pints.LogPDF):
         return mean.name + log_likelihood.name
 
     def to_search(self, x):
-        y = x.copy()
-        for prior_index, prior_slice in enumerate(self._prior_slices):
-            y[prior_slice] = \
-                self._transform_forwards[prior_index](
-                    y[prior_slice]
-            )
-        return y
+        return self._parameter_transform.to_search(x)
 
     def to_model(self, x):
-        y = x.copy()
-        for prior_index, prior_slice in enumerate(self._prior_slices):
-            y[prior_slice] = \
-                self._transform_backwards[prior_index](
-                    y[prior_slice]
-            )
-        return y
+        return self._parameter_transform.to_model(x)
+
+    def log_jacobian_det(self, x):
+        """
+        Returns the log of the absolute determinant of the Jacobian of
+        :meth:`to_model` at the search space point ``x``.
+        """
+        return self._parameter_transform.log_jacobian_det(x)
 
     def get_call_dict_from_params(self, x):
         return {
@@ -854,3 +1224,300 @@ class PyMC3LogPosterior(pints.LogPDF):
             sampled_values.append(output_values)
 
         return sampled_values
+
+    def close(self):
+        """
+        Terminates the worker processes of the forward models, if any.
+        """
+        for forward_model in self._forward_models:
+            forward_model.close()
+
+
+class NumpyLogPosterior(pints.LogPDF):
+    """
+    Log-posterior for observed log_likelihoods with Normal or LogNormal
+    noise around the outputs of mechanistic models, and scalar priors with
+    Uniform, Normal or LogNormal distributions with fixed parameters (use
+    :meth:`is_supported` to check this).
+
+    Takes the same search space points and gives the same values as
+    :class:`PyMC3LogPosterior`, but runs the forward models directly and
+    evaluates the log-pdfs with NumPy, so no theano graph is built or
+    compiled.
+    """
+
+    def __init__(self, log_likelihoods, priors, optimisation=False):
+        self._log_likelihoods = log_likelihoods
+        self._original_prior_names = [p.name for p in priors]
+        prior_indices = {p.pk: i for i, p in enumerate(priors)}
+
+        # priors, and the pymc3 transforms of their distributions
+        forms = [p.form for p in priors]
+        parameters = np.array([
+            self._get_fixed_values(p.get_noise_log_likelihoods())
+            for p in priors
+        ], dtype=float).reshape(-1, 2)
+        self._uniform, self._normal, self._lognormal = [
+            np.array([i for i, f in enumerate(forms) if f == form], dtype=int)
+            for form in [
+                LogLikelihood.Form.UNIFORM,
+                LogLikelihood.Form.NORMAL,
+                LogLikelihood.Form.LOGNORMAL,
+            ]
+        ]
+        self._uniform_lower, self._uniform_upper = \
+            parameters[self._uniform].T
+        self._normal_mean, self._normal_sigma = parameters[self._normal].T
+        self._lognormal_mean, self._lognormal_sigma = \
+            parameters[self._lognormal].T
+        self._log_prior_constant = (
+            -np.sum(np.log(self._uniform_upper - self._uniform_lower))
+            - np.sum(np.log(self._normal_sigma))
+            - np.sum(np.log(self._lognormal_sigma))
+            - 0.5 * np.log(2 * np.pi) * (
+                len(self._normal) + len(self._lognormal)
+            )
+        )
+        transforms = []
+        for form, (a, b) in zip(forms, parameters):
+            if form == LogLikelihood.Form.UNIFORM:
+                transforms.append(pm.transforms.interval(a, b))
+            elif form == LogLikelihood.Form.LOGNORMAL:
+                transforms.append(pm.transforms.log)
+            else:
+                transforms.append(None)
+        self._parameter_transform = ParameterTransform(
+            transforms, list(range(len(priors))), [1] * len(priors)
+        )
+
+        # forward models, with the indices of their fitted parameters
+        self._forward_models = []
+        model_outputs = {}
+        self._observed = []
+        for log_likelihood in log_likelihoods:
+            mean, sigma = log_likelihood.get_noise_log_likelihoods()
+            if mean.pk not in model_outputs:
+                parents, output_names, times, _ = mean.get_output_data()
+                forward_model, fitted_parameters = mean.create_forward_model(
+                    output_names, times
+                )
+                model_outputs[mean.pk] = (len(self._forward_models), parents)
+                self._forward_models.append((
+                    forward_model,
+                    np.array([
+                        prior_indices[param.child.pk]
+                        for param in fitted_parameters
+                    ], dtype=int)
+                ))
+            model_index, parents = model_outputs[mean.pk]
+            values = np.array(log_likelihood.get_data()[0], dtype=float)
+            lognormal = log_likelihood.form == LogLikelihood.Form.LOGNORMAL
+            if lognormal:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    values = np.log(values)
+            # the index of a sigma with a prior, or the value of a fixed one
+            if sigma.pk in prior_indices:
+                sigma_index = prior_indices[sigma.pk]
+                sigma_value = None
+            else:
+                sigma_index = None
+                sigma_value = self._get_fixed_values([sigma])[0]
+            self._observed.append((
+                model_index, parents.index(log_likelihood), values,
+                lognormal, sigma_index, sigma_value
+            ))
+
+        if optimisation:
+            self._sign = -1.0
+            self._exception_value = np.inf
+        else:
+            self._sign = 1.0
+            self._exception_value = -np.inf
+
+    @staticmethod
+    def _get_fixed_values(log_likelihoods):
+        """
+        Returns the scalar values of ``log_likelihoods``, or None if any of
+        them is random or not a scalar.
+        """
+        values = []
+        for log_likelihood in log_likelihoods:
+            if log_likelihood.is_random():
+                return None
+            value = log_likelihood.sample()
+            if value is None or np.ndim(value) != 0:
+                return None
+            values.append(float(value))
+        return values
+
+    @classmethod
+    def is_supported(cls, priors, log_likelihoods):
+        """
+        Returns True if the log-posterior of the observed ``log_likelihoods``
+        with ``priors`` can be calculated by this class.
+        """
+        prior_pks = set()
+        for prior in priors:
+            if (
+                not prior.is_a_distribution() or
+                prior.get_total_length() != 1 or
+                prior.has_data()
+            ):
+                return False
+            noise = prior.get_noise_log_likelihoods()
+            if len(noise) != 2 or cls._get_fixed_values(noise) is None:
+                return False
+            prior_pks.add(prior.pk)
+
+        observed_pks = set(ll.pk for ll in log_likelihoods)
+        for log_likelihood in log_likelihoods:
+            if (
+                log_likelihood.form not in [
+                    LogLikelihood.Form.NORMAL, LogLikelihood.Form.LOGNORMAL
+                ] or
+                not log_likelihood.has_data()
+            ):
+                return False
+            noise = log_likelihood.get_noise_log_likelihoods()
+            if len(noise) != 2:
+                return False
+            mean, sigma = noise
+            if mean.form != LogLikelihood.Form.MODEL:
+                return False
+            if (
+                sigma.pk not in prior_pks and
+                cls._get_fixed_values([sigma]) is None
+            ):
+                return False
+            # the model outputs must all be observed, and its random
+            # parameters must all be scalar priors
+            if any(p.pk not in observed_pks for p in mean.parents.all()):
+                return False
+            for param in mean.parameters.all():
+                if param.length is not None:
+                    return False
+                if param.child.is_random() and param.child.pk not in prior_pks:
+                    return False
+        return True
+
+    def n_parameters(self):
+        return len(self._original_prior_names)
+
+    def parameter_names(self):
+        return self._original_prior_names
+
+    def to_search(self, x):
+        return self._parameter_transform.to_search(x)
+
+    def to_model(self, x):
+        return self._parameter_transform.to_model(x)
+
+    def log_jacobian_det(self, x):
+        """
+        Returns the log of the absolute determinant of the Jacobian of
+        :meth:`to_model` at the search space point ``x``.
+        """
+        return self._parameter_transform.log_jacobian_det(x)
+
+    def _log_prior(self, x):
+        """
+        Returns the log-prior at the model space point ``x``.
+        """
+        u = x[self._uniform]
+        if np.any(u < self._uniform_lower) or np.any(u > self._uniform_upper):
+            return -np.inf
+        z = (x[self._normal] - self._normal_mean) / self._normal_sigma
+        result = self._log_prior_constant - 0.5 * np.dot(z, z)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y = np.log(x[self._lognormal])
+        z = (y - self._lognormal_mean) / self._lognormal_sigma
+        return result - 0.5 * np.dot(z, z) - np.sum(y)
+
+    def _simulate(self, x):
+        """
+        Returns the outputs of each forward model at the model space point
+        ``x``.
+        """
+        return [
+            forward_model.simulate(x[indices])
+            for forward_model, indices in self._forward_models
+        ]
+
+    def _get_means_and_sigmas(self, x):
+        outputs = self._simulate(x)
+        means = []
+        sigmas = []
+        for (
+            model_index, output_index, _, _, sigma_index, sigma_value
+        ) in self._observed:
+            means.append(outputs[model_index][output_index])
+            if sigma_index is None:
+                sigmas.append(sigma_value)
+            else:
+                sigmas.append(x[sigma_index])
+        return means, sigmas
+
+    def _log_likelihood(self, x):
+        """
+        Returns the log-likelihood of the data at the model space point
+        ``x``.
+        """
+        result = 0.0
+        means, sigmas = self._get_means_and_sigmas(x)
+        for (_, _, values, lognormal, _, _), mean, sigma in zip(
+            self._observed, means, sigmas
+        ):
+            if sigma <= 0:
+                return -np.inf
+            r = values - mean
+            result += (
+                -0.5 * np.dot(r, r) / sigma**2
+                - len(values) * (np.log(sigma) + 0.5 * np.log(2 * np.pi))
+            )
+            if lognormal:
+                result -= np.sum(values)
+        return result
+
+    def __call__(self, x):
+        try:
+            x_model = self.to_model(x)
+            result = self._log_prior(x_model) + self.log_jacobian_det(x)
+            if np.isfinite(result):
+                result += self._log_likelihood(x_model)
+        except myokit.SimulationError as e:
+            print('ERROR in forward simulation at params:')
+            print(x)
+            print(e)
+            return self._exception_value
+        if np.isnan(result):
+            return self._exception_value
+        return self._sign * result
+
+    def generative_model_range(self, x):
+        means, sigmas = self._get_means_and_sigmas(self.to_model(x))
+        values_min = []
+        values_max = []
+        for output_values, sigma, log_likelihood in zip(
+                means, sigmas, self._log_likelihoods
+        ):
+            output_values_min, output_values_max = \
+                log_likelihood.noise_range(output_values, [0, sigma])
+            values_min.append(output_values_min)
+            values_max.append(output_values_max)
+        return values_min, means, values_max
+
+    def sample_generative_model(self, x):
+        means, sigmas = self._get_means_and_sigmas(self.to_model(x))
+        return [
+            log_likelihood.add_noise(output_values, [0, sigma])
+            for output_values, sigma, log_likelihood in zip(
+                means, sigmas, self._log_likelihoods
+            )
+        ]
+
+    def close(self):
+        """
+        Terminates the worker processes of the forward models, if any.
+        """
+        for forward_model, _ in self._forward_models:
+            forward_model.close()
@@ -4,6 +4,7 @@
 # copyright notice and full license details.
 #
 
+from django.conf import settings
 from django.db import models
 from django.db.models import Q
 import pymc3 as pm
@@ -491,7 +492,7 @@ class LogLikelihood(models.Model):
 
         return output_values_min, output_values_max
 
-    def _create_pymc3_model(self, pm_model, parent, ops):
+    def _create_pymc3_model(self, pm_model, parent, ops, forward_models=None):
         # we are a graph not a tree, so
         # if name already in pm_model return it
         # ode models can have multiple outputs, so make
@@ -563,18 +564,18 @@ class LogLikelihood(models.Model):
             op = theano.shared(value)
         elif self.form == self.Form.NORMAL:
             mean, sigma = self.get_noise_log_likelihoods()
-            mean = mean._create_pymc3_model(pm_model, self, ops)
-            sigma = sigma._create_pymc3_model(pm_model, self, ops)
+            mean = mean._create_pymc3_model(pm_model, self, ops, forward_models)
+            sigma = sigma._create_pymc3_model(pm_model, self, ops, forward_models)
             op = pm.Normal(name, mean, sigma, observed=observed, shape=shape)
         elif self.form == self.Form.LOGNORMAL:
             mean, sigma = self.get_noise_log_likelihoods()
-            mean = mean._create_pymc3_model(pm_model, self, ops)
-            sigma = sigma._create_pymc3_model(pm_model, self, ops)
+            mean = mean._create_pymc3_model(pm_model, self, ops, forward_models)
+            sigma = sigma._create_pymc3_model(pm_model, self, ops, forward_models)
             op = pm.LogNormal(name, mean, sigma, observed=observed, shape=shape)
         elif self.form == self.Form.UNIFORM:
             lower, upper = self.get_noise_log_likelihoods()
-            lower = lower._create_pymc3_model(pm_model, self, ops)
-            upper = upper._create_pymc3_model(pm_model, self, ops)
+            lower = lower._create_pymc3_model(pm_model, self, ops, forward_models)
+            upper = upper._create_pymc3_model(pm_model, self, ops, forward_models)
             op = pm.Uniform(name, lower, upper, observed=observed, shape=shape)
         elif self.form == self.Form.MODEL:
             # ASSUMPTIONS / LIMITATIONS: - parents of models must be observed
@@ -583,16 +584,9 @@ class LogLikelihood(models.Model):
             # are the same subjects of input data, we only check that the
             # lengths of the subject vectors are the same
 
-            output_names = []
-            times = []
-            subjects = []
+            parents, output_names, times, subjects = self.get_output_data()
             all_subjects = set()
-            for parent in parents:
-                output = LogLikelihoodParameter.objects.get(parent=parent, child=self)
-                _, this_times, this_subjects = parent.get_data()
-                output_names.append(output.variable.qname)
-                times.append(this_times)
-                subjects.append(this_subjects)
+            for this_subjects in subjects:
                 all_subjects.update(this_subjects)
 
             all_subjects = sorted(list(all_subjects))
@@ -614,11 +608,13 @@ class LogLikelihood(models.Model):
             forward_model, fitted_parameters = self.create_forward_model(
                 output_names, times, subjects
             )
+            if forward_models is not None:
+                forward_models.append(forward_model)
             forward_model_op = ODEop(name, forward_model)
             if fitted_parameters:
                 # create child pymc3 models
                 all_params = [
-                    param.child._create_pymc3_model(pm_model, self, ops)
+                    param.child._create_pymc3_model(pm_model, self, ops, forward_models)
                     for param in fitted_parameters
                 ]
 
@@ -664,7 +660,7 @@ class LogLikelihood(models.Model):
             params = self.get_noise_log_likelihoods()
             pymc3_params = []
             for param in params:
-                param = param._create_pymc3_model(pm_model, self, ops)
+                param = param._create_pymc3_model(pm_model, self, ops, forward_models)
                 pymc3_params.append(param)
             lcls = {"arg{}".format(i): param for i, param in enumerate(pymc3_params)}
             op = eval(self.description, None, lcls)
@@ -693,12 +689,35 @@ class LogLikelihood(models.Model):
             return None
         return ops[name][parent_index]
 
-    def create_pymc3_model(self, *other_log_likelihoods):
+    def get_output_data(self):
+        """
+        for a log_likelihood that includes a mechanistic model, return the
+        log_likelihoods of its outputs (its parents), and the output
+        variable qname, times and subjects of each of them
+        """
+        parents = list(self.parents.order_by())
+        output_names = []
+        times = []
+        subjects = []
+        for parent in parents:
+            output = LogLikelihoodParameter.objects.get(parent=parent, child=self)
+            _, this_times, this_subjects = parent.get_data()
+            output_names.append(output.variable.qname)
+            times.append(this_times)
+            subjects.append(this_subjects)
+        return parents, output_names, times, subjects
+
+    def create_pymc3_model(self, *other_log_likelihoods, forward_models=None):
+        """
+        create the pymc3 model of this and the other log_likelihoods, the
+        forward models of any mechanistic models are appended to
+        forward_models if given
+        """
         ops = {}
         with pm.Model() as pm_model:
-            self._create_pymc3_model(pm_model, None, ops)
+            self._create_pymc3_model(pm_model, None, ops, forward_models)
             for ll in other_log_likelihoods:
-                ll._create_pymc3_model(pm_model, None, ops)
+                ll._create_pymc3_model(pm_model, None, ops, forward_models)
         return pm_model
 
     def create_forward_model(self, output_names, output_times, output_subjects=None):
@@ -735,6 +754,7 @@ class LogLikelihood(models.Model):
             output_times,
             output_subjects,
             fixed_parameters_dict,
+            processes=settings.FORWARD_MODEL_PROCESSES,
         )
 
         fitted_parameters = [
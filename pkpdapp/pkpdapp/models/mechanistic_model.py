@@ -7,6 +7,7 @@
 from django.db import models
 from django.core.exceptions import ValidationError
 from pkpdapp.models import MyokitModelMixin
+from pkpdapp.models.myokit_model_mixin import new_cache_version
 from pkpdapp.models.tag import Tag
 
 
@@ -45,6 +46,15 @@ class MechanisticModel(models.Model, MyokitModelMixin):
             "units specified by the mmt model)"
         ),
     )
+    cache_version = models.CharField(
+        max_length=32,
+        default=new_cache_version,
+        editable=False,
+        help_text=(
+            "changed whenever the myokit model or simulator changes, "
+            "used to invalidate cached copies"
+        ),
+    )
 
     is_library_model = models.BooleanField(
         default=False,
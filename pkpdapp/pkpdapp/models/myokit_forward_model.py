@@ -4,9 +4,25 @@
 # copyright notice and full license details.
 #
 
+import os
+import myokit
 import numpy as np
 from sys import float_info
 
+_worker_forward_model = None
+
+
+def _init_subject_worker(forward_model):
+    from pkpdapp.utils.process_pool import mark_worker_process
+
+    global _worker_forward_model
+    mark_worker_process()
+    _worker_forward_model = forward_model
+
+
+def _simulate_subjects_in_worker(args):
+    return _worker_forward_model._simulate_subjects(*args)
+
 
 class MyokitForwardModel:
     """
@@ -24,6 +40,8 @@ class MyokitForwardModel:
         representing key-value pairs for fixed parameters
         fixed_parameter_dict(=None by default) -- a dictionary
         representing key-value pairs for fixed parameters
+        processes(=None by default) -- if 2 or more, the subjects are split
+        over this many forked worker processes
     """
 
     def __init__(
@@ -35,6 +53,7 @@ class MyokitForwardModel:
         times,
         subjects=None,
         fixed_parameter_dict=None,
+        processes=None,
     ):
         model = myokit_model
         self._sim = myokit_simulator
@@ -59,10 +78,13 @@ class MyokitForwardModel:
             self._n_subjects = max([np.max(s_array) for s_array in self._subjects]) + 1
             self._times_all = []
             self._output_indices = []
+            # positions of each subject's values in the outputs
+            self._subject_positions = []
             for s in range(self._n_subjects):
+                positions = [np.flatnonzero(s_array == s) for s_array in self._subjects]
+                self._subject_positions.append(positions)
                 times_by_subject = [
-                    t_array[s_array == s]
-                    for t_array, s_array in zip(self._times, self._subjects)
+                    t_array[p] for t_array, p in zip(self._times, positions)
                 ]
                 self._times_all.append(
                     np.sort(list(set(np.concatenate(times_by_subject))))
@@ -141,6 +163,12 @@ class MyokitForwardModel:
             self._all_parameter_names.index(v) for v in self._variable_parameter_names
         ]
 
+        self._initial_value_function = self._create_initial_value_function()
+
+        self._processes = processes
+        self._pool = None
+        self._pool_pid = None
+
     def n_outputs(self):
         """
         Returns the number of output dimensions.
@@ -156,12 +184,44 @@ class MyokitForwardModel:
         """
         return self._n_parameters
 
+    def _create_initial_value_function(self):
+        """
+        Returns a function that calculates the initial state from an array of
+        constant values (ordered as ``self._const_names``), or a 2d array
+        with a column of constant values for each subject. Returns None if
+        the initial values cannot be written in terms of the constants.
+        """
+        model = self._sim._model
+        indices = {model.get(name): i for i, name in enumerate(self._const_names)}
+        writer = myokit.numpy_writer()
+        writer.set_lhs_function(lambda lhs: "p[{}]".format(indices[lhs.var()]))
+        try:
+            inits = [
+                writer.ex(init.clone(expand=True, retain=list(indices)))
+                for init in model.initial_values()
+            ]
+        except KeyError:
+            return None
+        return eval("lambda p: [{}]".format(", ".join(inits)), {"numpy": np})
+
+    def _initial_states(self, parameters):
+        """
+        Returns the initial state for the constant values ``parameters``, or
+        a list with the initial state of each subject if ``parameters`` is a
+        2d array with a column for each subject.
+        """
+        if self._initial_value_function is None:
+            return None
+        states = self._initial_value_function(parameters)
+        shape = parameters.shape[1:]
+        return np.array([np.broadcast_to(x, shape) for x in states]).T.tolist()
+
     def _set_const(self, parameters):
         """
         Sets values of constant model parameters.
         """
-        for id_var, var in enumerate(self._const_names):
-            self._sim.set_constant(var, float(parameters[id_var]))
+        for var, value in zip(self._const_names, parameters):
+            self._sim.set_constant(var, value)
 
     def _set_init(self, parameters):
         """
@@ -174,6 +234,88 @@ class MyokitForwardModel:
 
         self._sim.set_state(states)
 
+    def _run(self, log_times, parameters, state):
+        """
+        Simulates the model with the constant values ``parameters`` (a list
+        of floats) from initial state ``state`` (calculated from
+        ``parameters`` if None) and returns the converted outputs at
+        ``log_times``.
+        """
+        # Reset simulation
+        self._sim.reset()
+
+        # Set constant model parameters
+        self._set_const(parameters)
+
+        # Set initial conditions
+        if state is None:
+            self._set_init(parameters)
+        else:
+            self._sim.set_state(state)
+
+        # Simulate: need +100*epsilon for times to ensure simulation
+        # surpasses last time
+        t_max = log_times[-1] + 1e2 * float_info.epsilon
+        output = self._sim.run(t_max, log=self._output_names, log_times=log_times)
+
+        return self._convert_units(output)
+
+    def _simulate_subjects(self, subjects, parameters, states):
+        """
+        Simulates each subject in ``subjects``, with the constant values and
+        initial states in the lists ``parameters`` and ``states``, and
+        returns a list with the values of each output for each subject.
+        """
+        results = []
+        for s, subject_parameters, state in zip(subjects, parameters, states):
+            output = self._run(self._times_all[s], subject_parameters, state)
+            results.append(
+                [
+                    np.array(output[name])[indices]
+                    for name, indices in zip(
+                        self._output_names, self._output_indices[s]
+                    )
+                ]
+            )
+        return results
+
+    def _get_pool(self):
+        """
+        Returns the pool of worker processes used to simulate the subjects,
+        or None if the subjects are simulated in this process.
+        """
+        from pkpdapp.utils.process_pool import can_fork, get_fork_context
+
+        if self._processes is None or self._processes < 2:
+            return None
+        # pools are not shared with forked children of the owner process
+        if self._pool is not None and self._pool_pid == os.getpid():
+            return self._pool
+        self._pool = None
+        if not can_fork():
+            return None
+        try:
+            self._pool = get_fork_context().Pool(
+                min(self._processes, self._n_subjects),
+                initializer=_init_subject_worker,
+                initargs=(self,),
+            )
+        except (OSError, ValueError, AssertionError) as e:
+            print("could not create subject worker processes:", e)
+            return None
+        self._pool_pid = os.getpid()
+        return self._pool
+
+    def close(self):
+        """
+        Terminates the worker processes, if any. They are started again if
+        the model is simulated after this.
+        """
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+
     def simulate(self, parameters):
         """
         Returns the numerical solution of the model outputs for specified
@@ -221,22 +363,11 @@ class MyokitForwardModel:
                 for count, idx in enumerate(self._variable_parameter_indices):
                     full_parameters[idx] = parameters[count]
 
-            # Reset simulation
-            self._sim.reset()
-
-            # Set constant model parameters
-            self._set_const(full_parameters)
-
-            # Set initial conditions
-            self._set_init(full_parameters)
-
-            # Simulate: need +100*epsilon for times to ensure simulation
-            # surpasses last time
-            t_max = self._times_all[-1] + 1e2 * float_info.epsilon
-            log_times = self._times_all
-            output = self._sim.run(t_max, log=self._output_names, log_times=log_times)
-
-            output = self._convert_units(output)
+            output = self._run(
+                self._times_all,
+                full_parameters.tolist(),
+                self._initial_states(full_parameters),
+            )
 
             result = [
                 np.array(output[name])[indices]
@@ -255,40 +386,44 @@ class MyokitForwardModel:
                 for count, idx in enumerate(self._variable_parameter_indices):
                     full_parameters[idx, :] = parameters[count, :]
 
-            # preallocate results
-            result = [np.empty_like(t) for t in self._times]
-            for s in range(self._n_subjects):
-                # Reset simulation
-                self._sim.reset()
-
-                # Set constant model parameters
-                self._set_const(full_parameters[:, s])
-
-                # Set initial conditions
-                self._set_init(full_parameters[:, s])
+            # constant values and initial states of all subjects
+            subject_parameters = full_parameters.T.tolist()
+            states = self._initial_states(full_parameters)
+            if states is None:
+                states = [None] * self._n_subjects
 
-                # Simulate: need +100*epsilon for times to ensure simulation
-                # surpasses last time
-                t_max = self._times_all[s][-1] + 1e2 * float_info.epsilon
-                log_times = self._times_all[s]
-                output = self._sim.run(
-                    t_max, log=self._output_names, log_times=log_times
+            pool = self._get_pool()
+            if pool is None:
+                outputs = self._simulate_subjects(
+                    range(self._n_subjects), subject_parameters, states
                 )
+            else:
+                chunks = np.array_split(
+                    np.arange(self._n_subjects),
+                    min(self._processes, self._n_subjects),
+                )
+                outputs = []
+                for chunk_outputs in pool.map(
+                    _simulate_subjects_in_worker,
+                    [
+                        (
+                            chunk.tolist(),
+                            [subject_parameters[s] for s in chunk],
+                            [states[s] for s in chunk],
+                        )
+                        for chunk in chunks
+                    ],
+                ):
+                    outputs += chunk_outputs
 
-                output = self._convert_units(output)
-
-                # scatter this subject's output across result according to
-                # output_indices
-                for output_index, (name, indices, subjects) in enumerate(
-                    zip(
-                        self._output_names,
-                        self._output_indices[s],
-                        self._subjects,
-                    )
+            # preallocate results, and scatter each subject's output across
+            # them according to subject_positions
+            result = [np.empty_like(t) for t in self._times]
+            for s, subject_outputs in enumerate(outputs):
+                for output_result, positions, values in zip(
+                    result, self._subject_positions[s], subject_outputs
                 ):
-                    result[output_index][s == subjects] = np.array(output[name])[
-                        indices
-                    ]
+                    output_result[positions] = values
 
         return result
 
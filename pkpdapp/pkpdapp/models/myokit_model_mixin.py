@@ -4,25 +4,99 @@
 # copyright notice and full license details.
 #
 
+import hashlib
+import json
+import os
+import uuid
+from collections import OrderedDict
 import pkpdapp
 import numpy as np
 from myokit.formats.mathml import MathMLExpressionWriter
 from myokit.formats.sbml import SBMLParser
 import myokit
 import threading
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
 import logging
 
 logger = logging.getLogger(__name__)
 
-lock = threading.Lock()
+# default solver tolerances (abs_tol, rel_tol)
+DEFAULT_TOLERANCE = (1e-08, 1e-08)
+# coarse solver tolerances and number of points of a preview simulation
+PREVIEW_TOLERANCE = (1e-04, 1e-04)
+PREVIEW_MAX_POINTS = 500
+# number of variables created, updated or deleted per query in update_model
+VARIABLE_BATCH_SIZE = 500
+
+
+def new_cache_version():
+    """
+    Returns a new random token for the ``cache_version`` of a model.
+    """
+    return uuid.uuid4().hex
+
+
+class SimulationContext:
+    """
+    Everything needed from the database to simulate ``model`` (a
+    :class:`MyokitModelMixin`), loaded once and shared by all the runs (e.g.
+    subject groups) of a simulation: the project and its compound, all
+    variables with their units, the dosed variables with a lag time and the
+    unit conversion factors used so far.
+    """
+
+    def __init__(self, model):
+        from pkpdapp.models import Compound
+
+        self.project = model.get_project()
+        self.compound = None
+        if self.project is not None:
+            self.compound = Compound.objects.select_related(
+                "molecular_mass_unit",
+                "target_molecular_mass_unit",
+                "target2_molecular_mass_unit",
+            ).get(pk=self.project.compound_id)
+        self.is_library_model = model.is_library_model
+        self.variables = {v.qname: v for v in model.variables.select_related("unit")}
+        self.tlag_qnames = []
+        if isinstance(model, pkpdapp.models.CombinedModel):
+            self.tlag_qnames = [
+                dv.pk_variable.qname
+                for dv in model.derived_variables.select_related("pk_variable")
+                if dv.type == "TLG"
+            ]
+        self._conversion_factors = {}
+
+    def get_variable(self, qname):
+        try:
+            return self.variables[qname]
+        except KeyError:
+            raise pkpdapp.models.Variable.DoesNotExist(
+                f"Variable with qname {qname} does not exist in model."
+            )
+
+    def get_conversion_factor(self, variable, myokit_variable, calculate):
+        """
+        Returns the factor converting ``variable`` to the units of
+        ``myokit_variable``, calling ``calculate()`` only the first time.
+        """
+        key = (variable.qname, str(myokit_variable.unit()))
+        factor = self._conversion_factors.get(key)
+        if factor is None:
+            factor = self._conversion_factors[key] = calculate()
+        return factor
 
 
 class MyokitModelMixin:
-    def _initialise_variables(self, model, variables):
+    def _initialise_variables(self, model, variables, context=None):
+        if context is None:
+            context = SimulationContext(self)
+
         # Convert units
         variables = {
-            qname: self._convert_unit_qname(qname, value, model)
+            qname: self._convert_unit_qname(qname, value, model, context)
             for qname, value in variables.items()
         }
 
@@ -54,25 +128,26 @@ class MyokitModelMixin:
         )
         return amount_conversion_factor
 
-    def _get_myokit_protocols(self, model, dosing_protocols, override_tlag, time_max):
+    def _get_myokit_protocols(
+        self, model, dosing_protocols, override_tlag, time_max, context=None
+    ):
+        if context is None:
+            context = SimulationContext(self)
         protocols = {}
         time_var = model.binding("time")
-        project = self.get_project()
-        if project is None:
-            compound = None
-        else:
-            compound = project.compound
+        project = context.project
+        compound = context.compound
 
         for qname, protocol in dosing_protocols.items():
             amount_var = model.get(qname)
             set_administration(model, amount_var)
-            tlag_value = self._get_tlag_value(qname)
+            tlag_value = self._get_tlag_value(qname, context)
             # override tlag if set
             if qname in override_tlag:
                 tlag_value = override_tlag[qname]
 
             target = None
-            if self.is_library_model:
+            if context.is_library_model:
                 if "CT1" in qname or "AT1" in qname:
                     target = 1
                 elif "CT2" in qname or "AT2" in qname:
@@ -96,31 +171,46 @@ class MyokitModelMixin:
             protocols[_get_pacing_label(amount_var)] = get_protocol(dosing_events)
         return protocols
 
-    def _get_override_tlag(self, variables):
+    def _get_override_tlag(self, variables, context=None):
+        if context is None:
+            context = SimulationContext(self)
         override_tlag = {}
-        if isinstance(self, pkpdapp.models.CombinedModel):
-            for dv in self.derived_variables.all():
-                if dv.type == "TLG":
-                    derived_param = dv.pk_variable.qname + "_tlag_ud"
-                    if derived_param in variables:
-                        override_tlag[dv.pk_variable.qname] = variables[derived_param]
+        for qname in context.tlag_qnames:
+            derived_param = qname + "_tlag_ud"
+            if derived_param in variables:
+                override_tlag[qname] = variables[derived_param]
         return override_tlag
 
-    def _get_tlag_value(self, qname):
-        from pkpdapp.models import Variable
-
+    def _get_tlag_value(self, qname, context=None):
         # get tlag value default to 0
         derived_param = qname + "_tlag_ud"
-        try:
-            return self.variables.get(qname=derived_param).default_value
-        except Variable.DoesNotExist:
+        if context is None:
+            context = SimulationContext(self)
+        variable = context.variables.get(derived_param)
+        if variable is None:
             return 0.0
+        return variable.default_value
 
     def _get_myokit_model_cache_key(self):
-        return "myokit_model_{}_{}".format(self._meta.db_table, self.id)
+        return "myokit_model_{}_{}_{}".format(
+            self._meta.db_table, self.id, self.cache_version
+        )
 
     def _get_myokit_simulator_cache_key(self):
-        return "myokit_simulator_{}_{}".format(self._meta.db_table, self.id)
+        return "myokit_simulator_{}_{}_{}".format(
+            self._meta.db_table, self.id, self.cache_version
+        )
+
+    def _update_cache_version(self):
+        """
+        Invalidates the cached myokit model and simulator of this model in
+        all processes, by changing the version stored on its row.
+        """
+        self.cache_version = new_cache_version()
+        if self.pk is not None:
+            type(self).objects.filter(pk=self.pk).update(
+                cache_version=self.cache_version
+            )
 
     @staticmethod
     def sbml_string_to_mmt(sbml):
@@ -129,21 +219,23 @@ class MyokitModelMixin:
 
     @staticmethod
     def parse_sbml_string(sbml):
-        with lock:
-            model = SBMLParser().parse_string(str.encode(sbml)).myokit_model()
-        return model
+        return SBMLParser().parse_string(str.encode(sbml)).myokit_model()
 
     @staticmethod
     def parse_mmt_string(mmt):
-        with lock:
-            model, _, _ = myokit.parse(mmt)
+        model, _, _ = myokit.parse(mmt)
         return model
 
     def create_myokit_model(self):
         return self.parse_mmt_string(self.mmt)
 
     def create_myokit_simulator(
-        self, override_tlag=None, model=None, time_max=None, dosing_protocols=None
+        self,
+        override_tlag=None,
+        model=None,
+        time_max=None,
+        dosing_protocols=None,
+        context=None,
     ):
         if override_tlag is None:
             override_tlag = {}
@@ -152,41 +244,58 @@ class MyokitModelMixin:
             model = self.get_myokit_model()
 
         if dosing_protocols is None:
-            # add a dose_rate variable to the model for each
-            # dosed variable
-            dosing_protocols = {}
-            for v in self.variables.filter(state=True):
-                for p in v.protocols.all():
-                    dosing_protocols[v.qname] = p
+            dosing_protocols = self._get_default_dosing_protocols()
 
         protocols = self._get_myokit_protocols(
             model=model,
             dosing_protocols=dosing_protocols,
             override_tlag=override_tlag,
             time_max=time_max,
+            context=context,
         )
 
-        with lock:
-            sim = myokit.Simulation(model, protocol=protocols)
-        return sim
+        from pkpdapp.utils.simulator_cache import get_simulation
+
+        return get_simulation(model, protocols)
+
+    def _get_default_dosing_protocols(self):
+        # add a dose_rate variable to the model for each
+        # dosed variable
+        dosing_protocols = {}
+        for v in self.variables.filter(state=True):
+            for p in v.protocols.all():
+                dosing_protocols[v.qname] = p
+        return dosing_protocols
 
     def get_myokit_simulator(self):
-        key = self._get_myokit_simulator_cache_key()
-        with lock:
-            myokit_simulator = cache.get(key)
-        if myokit_simulator is None:
-            myokit_simulator = self.create_myokit_simulator()
-            cache.set(key, myokit_simulator, timeout=None)
-        return myokit_simulator
+        if settings.SIMULATOR_CACHE_DIR:
+            # unpickling a simulator from the shared cache recompiles it,
+            # loading the compiled module from the disk cache is much cheaper
+            return self.create_myokit_simulator()
+        from pkpdapp.utils.single_flight import get_or_build
+
+        return get_or_build(
+            self._get_myokit_simulator_cache_key(), self.create_myokit_simulator
+        )
 
     def get_myokit_model(self):
+        """
+        Returns a copy of the myokit model, which the caller may modify.
+
+        Models are cached in each process (see :func:`get_myokit_model_cache`)
+        in front of the shared cache. Both are keyed by the model's
+        ``cache_version``, so a cached model is never used once the model
+        has been updated in any process.
+        """
+        from pkpdapp.utils.single_flight import get_or_build
+
         key = self._get_myokit_model_cache_key()
-        with lock:
-            myokit_model = cache.get(key)
+        model_cache = get_myokit_model_cache()
+        myokit_model = model_cache.get(key)
         if myokit_model is None:
-            myokit_model = self.create_myokit_model()
-            cache.set(key, myokit_model, timeout=None)
-        return myokit_model
+            myokit_model = get_or_build(key, self.create_myokit_model)
+            model_cache.set(key, myokit_model)
+        return myokit_model.clone()
 
     def is_variables_out_of_date(self):
         model = self.get_myokit_model()
@@ -202,38 +311,63 @@ class MyokitModelMixin:
     def update_simulator(self):
         # delete simulator from cache
         cache.delete(self._get_myokit_simulator_cache_key())
+        self._update_cache_version()
 
     def update_model(self):
         logger.info("UPDATE MODEL")
         # delete model and simulators from cache
         cache.delete(self._get_myokit_simulator_cache_key())
         cache.delete(self._get_myokit_model_cache_key())
+        self._update_cache_version()
+
+        # update the variables of the model, all in one transaction and with
+        # a fixed number of queries for the existing variables
+        with transaction.atomic():
+            self._update_variables()
 
-        # update the variables of the model
+    def _update_variables(self):
         from pkpdapp.models import Variable
 
         removed_variables = self.calculate_removed_variables()
 
         model = self.get_myokit_model()
+
+        # load the existing variables once, and match them to the myokit
+        # variables in memory
+        existing_variables = list(self.variables.select_related("unit"))
+        variables_by_qname = {}
+        for v in existing_variables:
+            variables_by_qname.setdefault(v.qname, []).append(v)
+        num_variables = len(existing_variables)
+
+        def get_variable(myokit_variable):
+            return Variable.get_variable(
+                self,
+                myokit_variable,
+                existing=variables_by_qname.get(myokit_variable.qname(), []),
+                num_variables=num_variables,
+            )
+
+        changed_variables = []
         new_variables = []
         old_variables = []
         for v in model.variables(const=True, sort=True):
             if v.is_literal() and v.qname() not in removed_variables:
-                v = Variable.get_variable(self, v)
+                v = get_variable(v)
                 if v._state.adding:
                     new_variables.append(v)
                 else:
                     # parameters could originally be outputs
                     if not v.constant:
                         v.constant = True
-                        v.save()
+                        changed_variables.append(v)
                     old_variables.append(v)
 
         new_states = []
         old_states = []
         for v in model.variables(state=True, sort=True):
             if v.qname() not in removed_variables:
-                v = Variable.get_variable(self, v)
+                v = get_variable(v)
                 if v._state.adding:
                     new_states.append(v)
                 else:
@@ -243,7 +377,7 @@ class MyokitModelMixin:
         old_outputs = []
         for v in model.variables(const=False, state=False, sort=True):
             if v.qname() not in removed_variables:
-                v = Variable.get_variable(self, v)
+                v = get_variable(v)
                 if v._state.adding:
                     # if output not in states set state false
                     # so only states with initial conditions as
@@ -256,9 +390,13 @@ class MyokitModelMixin:
                     # outputs could originally be parameters
                     if v.constant:
                         v.constant = False
-                        v.save()
+                        changed_variables.append(v)
                     old_outputs.append(v)
 
+        Variable.objects.bulk_update(
+            changed_variables, ["constant"], batch_size=VARIABLE_BATCH_SIZE
+        )
+
         all_new_variables = new_variables + new_states + new_outputs
         all_old_variables = old_variables + old_states + old_outputs
         logger.debug("ALL NEW VARIABLES")
@@ -288,10 +426,16 @@ class MyokitModelMixin:
                 )
 
         # delete all variables that are not in new
-        for variable in self.variables.all():
-            if variable not in all_old_variables:
+        old_ids = {v.id for v in all_old_variables}
+        deleted_ids = []
+        for variable in existing_variables:
+            if variable.id not in old_ids:
                 logger.debug(f"DELETING VARIABLE {variable.qname} (id = {variable.id})")
-                variable.delete()
+                deleted_ids.append(variable.id)
+        for i in range(0, len(deleted_ids), VARIABLE_BATCH_SIZE):
+            Variable.objects.filter(
+                id__in=deleted_ids[i : i + VARIABLE_BATCH_SIZE]
+            ).delete()
 
         # for library models: set created variables to defaults
         if (
@@ -308,7 +452,7 @@ class MyokitModelMixin:
                 # and set units for concentration variables
                 for v in all_new_variables:
                     if v.unit is not None:
-                        compatible_units = v.unit.get_compatible_units(
+                        compatible_units = v.unit.get_compatible_unit_list(
                             compound=project.compound
                         )
                         default_unit_symbol = None
@@ -328,7 +472,7 @@ class MyokitModelMixin:
                                     break
 
         # save all new variables
-        Variable.objects.bulk_create(all_new_variables)
+        Variable.objects.bulk_create(all_new_variables, batch_size=VARIABLE_BATCH_SIZE)
 
     def calculate_removed_variables(self):
         removed_variables = []
@@ -457,22 +601,19 @@ class MyokitModelMixin:
         variables = model.variables(const=True, sort=True)
         return [self._serialise_variable(v) for v in variables]
 
-    def _conversion_factor(self, variable, myokit_variable_sbml):
-        target = None
-        if self.is_library_model:
-            if "CT1" in variable.qname or "AT1" in variable.qname:
-                target = 1
-            elif "CT2" in variable.qname or "AT2" in variable.qname:
-                target = 2
-        if variable.unit is None:
-            conversion_factor = 1.0
-        else:
-            project = self.get_project()
-            compound = None
-            if project is not None:
-                compound = project.compound
+    def _conversion_factor(self, variable, myokit_variable_sbml, context):
+        def calculate():
+            target = None
+            if context.is_library_model:
+                if "CT1" in variable.qname or "AT1" in variable.qname:
+                    target = 1
+                elif "CT2" in variable.qname or "AT2" in variable.qname:
+                    target = 2
+            if variable.unit is None:
+                return 1.0
+            project = context.project
             conversion_factor = variable.unit.convert_to(
-                myokit_variable_sbml.unit(), compound=compound, target=target
+                myokit_variable_sbml.unit(), compound=context.compound, target=target
             )
             if (
                 project is not None
@@ -480,58 +621,77 @@ class MyokitModelMixin:
                 and variable.unit_per_body_weight
             ):
                 conversion_factor *= project.species_weight
-        return conversion_factor
+            return conversion_factor
+
+        return context.get_conversion_factor(variable, myokit_variable_sbml, calculate)
 
-    def _convert_unit(self, variable, myokit_variable_sbml, value):
-        conversion_factor = self._conversion_factor(variable, myokit_variable_sbml)
+    def _convert_unit(self, variable, myokit_variable_sbml, value, context):
+        conversion_factor = self._conversion_factor(
+            variable, myokit_variable_sbml, context
+        )
 
         return conversion_factor * value
 
-    def _convert_unit_qname(self, qname, value, myokit_model):
+    def _convert_unit_qname(self, qname, value, myokit_model, context=None):
+        if context is None:
+            context = SimulationContext(self)
         try:
-            variable = self.variables.get(qname=qname)
+            variable = context.get_variable(qname)
         except pkpdapp.models.Variable.DoesNotExist:
             raise ValueError(f"Variable with qname {qname} does not exist in model.")
         myokit_variable_sbml = myokit_model.get(qname)
-        new_value = self._convert_unit(variable, myokit_variable_sbml, value)
+        new_value = self._convert_unit(variable, myokit_variable_sbml, value, context)
         return new_value
 
-    def _convert_bound_unit(self, binding, value, myokit_model):
+    def _convert_bound_unit(self, binding, value, myokit_model, context=None):
+        if context is None:
+            context = SimulationContext(self)
         myokit_variable_sbml = myokit_model.binding(binding)
-        variable = self.variables.get(qname=myokit_variable_sbml.qname())
-        return self._convert_unit(variable, myokit_variable_sbml, value)
+        variable = context.get_variable(myokit_variable_sbml.qname())
+        return self._convert_unit(variable, myokit_variable_sbml, value, context)
 
-    def serialize_datalog(self, datalog, myokit_model):
+    def serialize_datalog(self, datalog, myokit_model, as_numpy=False, context=None):
+        """
+        Returns a dict mapping variable ids to the logged values converted
+        to the variable units, as lists or, if ``as_numpy``, numpy arrays.
+        If given, variables and conversion factors are taken from
+        ``context`` (a :class:`SimulationContext`).
+        """
+        if context is None:
+            context = SimulationContext(self)
         result = {}
         for k, v in datalog.items():
-            variable = self.variables.get(qname=k)
+            variable = context.get_variable(k)
             myokit_variable_sbml = myokit_model.get(k)
 
             if variable.unit is None:
                 conversion_factor = 1.0
             else:
                 conversion_factor = self._conversion_factor(
-                    variable, myokit_variable_sbml
+                    variable, myokit_variable_sbml, context
                 )
 
-            result[variable.id] = (np.frombuffer(v) / conversion_factor).tolist()
+            values = np.frombuffer(v) / conversion_factor
+            result[variable.id] = values if as_numpy else values.tolist()
 
         return result
 
     def get_time_max(self):
         return self.time_max
 
-    def _handle_nonlinarities(self, model, dosing_protocols):
+    def _handle_nonlinarities(self, model, dosing_protocols, context=None):
+        if context is None:
+            context = SimulationContext(self)
         # For nonlinearities, add PKNonlinearities.C_Drug to variables with the
         # value of the first dose concentration
         if (
-            self.is_library_model
+            context.is_library_model
             and model.has_variable("PKNonlinearities.C_Drug")
             and dosing_protocols is not None
             and len(dosing_protocols) > 0
         ):
 
-            project = self.get_project()
+            project = context.project
             myokit_var = model.get("PKNonlinearities.C_Drug")
             # set C_Drug equal to the sum of the first dose amounts for all protocols
             # within this group
@@ -540,7 +700,7 @@ class MyokitModelMixin:
             dose_sum = 0.0
             for protocol in dosing_protocols.values():
                 amount_conversion_factor = self._get_protocol_amount_conversion_factor(
-                    project, protocol, myokit_var, project.compound, target=None
+                    project, protocol, myokit_var, context.compound, target=None
                 )
                 dose_sum += protocol.doses.first().amount * amount_conversion_factor
 
@@ -548,36 +708,250 @@ class MyokitModelMixin:
             dose_sum = max(dose_sum, 1e-6)
             myokit_var.set_rhs(dose_sum)
 
+    def _prepare_simulation(
+        self, variables, time_max, dosing_protocols, model=None, context=None
+    ):
+        """
+        Returns the myokit model with ``variables`` set and dose rates
+        added, the myokit protocols and the time_max in model units. If
+        ``model`` is not given a new copy of the myokit model is used, if
+        ``context`` is not given a new :class:`SimulationContext`.
+        """
+        if model is None:
+            model = self.get_myokit_model()
+        if context is None:
+            context = SimulationContext(self)
+
+        # Convert units
+        variables = self._initialise_variables(model, variables, context)
+        time_max = self._convert_bound_unit("time", time_max, model, context)
+        self._handle_nonlinarities(model, dosing_protocols, context)
+
+        # get tlag vars
+        override_tlag = self._get_override_tlag(variables, context)
+        if dosing_protocols is None:
+            dosing_protocols = self._get_default_dosing_protocols()
+        protocols = self._get_myokit_protocols(
+            model=model,
+            dosing_protocols=dosing_protocols,
+            override_tlag=override_tlag,
+            time_max=time_max,
+            context=context,
+        )
+        return model, protocols, time_max
+
     def simulate_model(
         self,
         outputs=None,
         variables=None,
         time_max=None,
         dosing_protocols=None,
+        simulators=None,
+        model=None,
+        as_numpy=False,
+        max_points=None,
+        log_times=None,
+        steady_state=False,
+        tolerance=None,
+        context=None,
     ):
-        model = self.get_myokit_model()
+        """
+        Simulate the model for a single set of dosing protocols.
+
+        If ``simulators`` is a dict, compiled simulators are looked up and
+        stored in it (keyed by their pacing labels), so that repeated calls
+        with the same structure reuse the same compiled simulator. If
+        ``model`` is given, this (modifiable) copy of the myokit model is
+        used instead of fetching a new one. If ``as_numpy`` the outputs are
+        returned as numpy arrays instead of lists. See :meth:`simulate` for
+        ``max_points``, ``log_times``, ``steady_state`` and ``tolerance``.
+        Runs of the same simulation can share a :class:`SimulationContext`.
+        """
+        from pkpdapp.utils.steady_state import get_dosing_period
 
-        # Convert units
-        variables = self._initialise_variables(model, variables)
-        time_max = self._convert_bound_unit("time", time_max, model)
-        self._handle_nonlinarities(model, dosing_protocols)
+        if context is None:
+            context = SimulationContext(self)
+        model, protocols, time_max = self._prepare_simulation(
+            variables, time_max, dosing_protocols, model=model, context=context
+        )
+        if simulators is None:
+            simulators = {}
+        sim = _reuse_simulator(simulators, model, protocols)
+        dosing_period = None
+        if steady_state:
+            dosing_period = get_dosing_period(protocols, time_max, model)
+        datalog, steady_state_time = _run_simulator(
+            sim,
+            time_max,
+            outputs,
+            model.time().qname(),
+            log_times=self._convert_log_times(log_times, time_max, model, context),
+            max_points=max_points,
+            dosing_period=dosing_period,
+            tolerance=tolerance,
+        )
+        result = self.serialize_datalog(
+            datalog, model, as_numpy=as_numpy, context=context
+        )
+        if steady_state:
+            result["steady_state_time"] = self._convert_steady_state_time(
+                steady_state_time, model, context
+            )
+        return result
 
-        # get tlag vars
-        override_tlag = self._get_override_tlag(variables)
-        # create simulator
-        sim = self.create_myokit_simulator(
-            override_tlag=override_tlag,
-            model=model,
-            time_max=time_max,
-            dosing_protocols=dosing_protocols,
+    def _convert_steady_state_time(self, steady_state_time, model, context):
+        if steady_state_time is None:
+            return None
+        return steady_state_time / self._convert_bound_unit("time", 1.0, model, context)
+
+    def _convert_log_times(self, log_times, time_max, model, context):
+        """
+        Converts ``log_times`` to model units, dropping any after
+        ``time_max`` (already in model units).
+        """
+        if log_times is None:
+            return None
+        log_times = np.sort(np.asarray(log_times, dtype=float))
+        log_times = self._convert_bound_unit("time", log_times, model, context)
+        return log_times[(log_times >= 0) & (log_times <= time_max)]
+
+    def _simulate_models_parallel(
+        self,
+        pool,
+        outputs,
+        time_max,
+        runs,
+        max_points=None,
+        log_times=None,
+        steady_state=False,
+        tolerance=None,
+        context=None,
+    ):
+        """
+        Simulate the model for each ``(variables, dosing_protocols)`` pair in
+        ``runs`` using the worker processes in ``pool``.
+
+        All database access happens in this process, the workers only
+        compile (once per model structure) and run the myokit simulations.
+        """
+        from pkpdapp.utils.simulator_cache import (
+            get_literal_constants,
+            get_structure_key,
         )
-        # TODO: take these from simulation model
-        sim.set_tolerance(abs_tol=1e-08, rel_tol=1e-08)
-        # Simulate, logging only state variables given by `outputs`
-        datalog = sim.run(time_max, log=outputs)
-        return self.serialize_datalog(datalog, model)
+        from pkpdapp.utils.steady_state import get_dosing_period
+
+        if context is None:
+            context = SimulationContext(self)
+        base_model = self.get_myokit_model()
+        prepared = [
+            self._prepare_simulation(
+                variables,
+                time_max,
+                dosing_protocols,
+                model=base_model.clone(),
+                context=context,
+            )
+            for variables, dosing_protocols in runs
+        ]
+        jobs = [
+            {
+                # workers share compiled simulators between all models with
+                # the same structure
+                "key": get_structure_key(model, protocols.keys()),
+                "code": model.code(),
+                "protocols": protocols,
+                "constants": get_literal_constants(model),
+                "state": model.initial_values(as_floats=True),
+                "time_max": model_time_max,
+                "outputs": outputs,
+                "time_key": model.time().qname(),
+                "log_times": self._convert_log_times(
+                    log_times, model_time_max, model, context
+                ),
+                "max_points": max_points,
+                "dosing_period": (
+                    get_dosing_period(protocols, model_time_max, model)
+                    if steady_state
+                    else None
+                ),
+                "tolerance": tolerance,
+            }
+            for model, protocols, model_time_max in prepared
+        ]
+        results = []
+        for (datalog, steady_state_time), (model, _, _) in zip(
+            pool.map(_simulate_in_worker, jobs), prepared
+        ):
+            result = self.serialize_datalog(
+                datalog, model, as_numpy=True, context=context
+            )
+            if steady_state:
+                result["steady_state_time"] = self._convert_steady_state_time(
+                    steady_state_time, model, context
+                )
+            results.append(result)
+        return results
 
-    def simulate(self, outputs=None, variables=None, time_max=None):
+    def _get_simulation_variables(self, variables=None, context=None):
+        """
+        Returns the default values of all constant variables, overridden by
+        any given in ``variables``.
+        """
+        if context is None:
+            context = SimulationContext(self)
+        default_variables = {
+            v.qname: v.get_default_value()
+            for v in context.variables.values()
+            if v.constant
+        }
+        if variables is None:
+            return default_variables
+        return {
+            **default_variables,
+            **variables,
+        }
+
+    def _get_model_dosing_protocols(self, project):
+        """
+        Returns the project's protocols, the sorted subject groups and a
+        list of dosing protocols (dicts mapping qnames to protocols) to
+        simulate: first those of the project, then those of each group.
+        """
+        # add a dose_rate variable to the model for each
+        # dosed variable
+        protocols = project.protocols.select_related(
+            "variable", "amount_unit", "time_unit"
+        ).prefetch_related("doses")
+        project_dosing_protocols = {
+            p.variable.qname: p
+            for p in protocols
+            if p.group_id is None and p.variable is not None
+        }
+        model_dosing_protocols = [project_dosing_protocols]
+
+        groups = get_subject_groups(project)
+        # sort groups starting alphabetically, but with those starting with Sim first
+        groups = sorted(groups, key=lambda g: (not g.name.startswith("Sim"), g.name))
+
+        for group in groups:
+            print("GROUP:", group.name)
+            dosing_protocols = {
+                p.variable.qname: p for p in protocols if p.group_id == group.id
+            }
+            model_dosing_protocols.append(dosing_protocols)
+        return protocols, groups, model_dosing_protocols
+
+    def simulate(
+        self,
+        outputs=None,
+        variables=None,
+        time_max=None,
+        as_numpy=False,
+        max_points=None,
+        log_times=None,
+        steady_state=False,
+        tolerance=None,
+    ):
         """
         Arguments
         ---------
@@ -587,6 +961,24 @@ class MyokitModelMixin:
             dict mapping variable names to values for model parameters
         time_max: float
             maximum time to simulate to
+        as_numpy: bool
+            return the outputs as (read-only) numpy arrays instead of lists
+        max_points: int
+            if given, reduce each result to at most this many time points
+            (or three per output, if that is larger) using shape-preserving
+            decimation, so peaks and troughs are kept
+        log_times: list
+            if given, only return the outputs at these times (in the units
+            of the time variable)
+        steady_state: bool
+            if True, stop solving regularly repeated doses once the solution
+            has reached a periodic steady state and repeat the last dosing
+            period instead. The time the steady state was reached (or None)
+            is returned for each group under "steady_state_time"
+        tolerance: tuple
+            the (absolute, relative) tolerance of the ODE solver, defaults
+            to :data:`DEFAULT_TOLERANCE`. Use the ``abs_tolerance`` and
+            ``rel_tolerance`` of a :class:`pkpdapp.models.Simulation`
 
         Returns
         -------
@@ -601,52 +993,542 @@ class MyokitModelMixin:
         if outputs is None:
             outputs = []
 
-        default_variables = {
-            v.qname: v.get_default_value() for v in self.variables.filter(constant=True)
-        }
-        if variables is None:
-            variables = default_variables
-        else:
-            variables = {
-                **default_variables,
-                **variables,
-            }
+        # everything the runs of all groups need from the database is loaded
+        # once here, so the number of queries does not grow with the number
+        # of variables
+        context = SimulationContext(self)
+        variables = self._get_simulation_variables(variables, context)
+        project = context.project
+        protocols, groups, model_dosing_protocols = self._get_model_dosing_protocols(
+            project
+        )
 
-        # add a dose_rate variable to the model for each
-        # dosed variable
-        project = self.get_project()
-        protocols = project.protocols.all()
-        project_dosing_protocols = {
-            p.variable.qname: p
-            for p in protocols
-            if p.group is None and p.variable is not None
-        }
-        model_dosing_protocols = [project_dosing_protocols]
+        result_cache = get_simulation_result_cache()
+        cache_key = self._get_simulation_result_cache_key(
+            outputs,
+            variables,
+            time_max,
+            context,
+            protocols,
+            groups,
+            max_points=max_points,
+            log_times=log_times,
+            steady_state=steady_state,
+            tolerance=tolerance,
+        )
+        result = None
+        if cache_key is not None:
+            result = result_cache.get(cache_key)
+        if result is None:
+            result = self._simulate_runs(
+                outputs,
+                time_max,
+                [
+                    (variables, dosing_protocols)
+                    for dosing_protocols in model_dosing_protocols
+                ],
+                max_points=max_points,
+                log_times=log_times,
+                steady_state=steady_state,
+                tolerance=tolerance,
+                context=context,
+            )
+            result[0].update({"group_id": None})
+            for r, group in zip(result[1:], groups):
+                r.update({"group_id": group.id if group is not None else None})
+            _set_read_only(result)
+            if cache_key is not None:
+                result_cache.set(cache_key, result)
+        # cached results are shared, so return copies that callers can modify
+        return [_copy_result(r, as_numpy) for r in result]
+
+    def simulate_preview(
+        self,
+        outputs=None,
+        variables=None,
+        time_max=None,
+        as_numpy=False,
+        max_points=None,
+        log_times=None,
+        steady_state=False,
+        tolerance=None,
+    ):
+        """
+        Quickly simulates the model at a coarse tolerance (at most
+        :data:`PREVIEW_TOLERANCE`) and resolution (``max_points``, by default
+        :data:`PREVIEW_MAX_POINTS`), e.g. to update plots while a parameter
+        is being dragged, and schedules the same simulation at the full
+        ``tolerance`` in a background thread. Once this has finished,
+        :meth:`simulate` with the same arguments in the same process returns
+        the refined result straight from the result cache. If results cannot
+        be cached (e.g. the shared cache is unavailable) nothing is scheduled.
+
+        Takes the same arguments and returns the same result as
+        :meth:`simulate`.
+        """
+        if tolerance is None:
+            tolerance = DEFAULT_TOLERANCE
+        preview_tolerance = tuple(
+            max(t, p) for t, p in zip(tolerance, PREVIEW_TOLERANCE)
+        )
+        preview_max_points = PREVIEW_MAX_POINTS if max_points is None else max_points
+        result = self.simulate(
+            outputs=outputs,
+            variables=variables,
+            time_max=time_max,
+            as_numpy=as_numpy,
+            max_points=preview_max_points,
+            log_times=log_times,
+            steady_state=steady_state,
+            tolerance=preview_tolerance,
+        )
+        # the refined result is only useful if it can be cached
+        if (
+            settings.SIMULATION_RESULT_CACHE_MAX_BYTES > 0
+            and get_simulation_results_version(self.get_project()) is not None
+            and _get_units_version() is not None
+        ):
+            _schedule_refinement(
+                self,
+                outputs=outputs,
+                variables=variables,
+                time_max=time_max,
+                max_points=max_points,
+                log_times=log_times,
+                steady_state=steady_state,
+                tolerance=tolerance,
+            )
+        return result
 
-        groups = get_subject_groups(project)
-        # sort groups starting alphabetically, but with those starting with Sim first
-        groups = sorted(groups, key=lambda g: (not g.name.startswith("Sim"), g.name))
+    def warm_simulators(self):
+        """
+        Compiles the simulators :meth:`simulate` uses for the dosing of the
+        project and of each subject group, without running them, so that
+        they are stored in the simulator cache (see
+        :func:`pkpdapp.utils.simulator_cache.get_simulation`). Returns the
+        structure keys of the compiled simulators.
+        """
+        from pkpdapp.utils.simulator_cache import get_simulation, get_structure_key
+
+        context = SimulationContext(self)
+        variables = self._get_simulation_variables(context=context)
+        _, _, model_dosing_protocols = self._get_model_dosing_protocols(context.project)
+        base_model = self.get_myokit_model()
+        keys = []
+        for dosing_protocols in model_dosing_protocols:
+            model, protocols, _ = self._prepare_simulation(
+                variables,
+                self.get_time_max(),
+                dosing_protocols,
+                model=base_model.clone(),
+                context=context,
+            )
+            key = get_structure_key(model, protocols.keys())
+            if key not in keys:
+                get_simulation(model, protocols)
+                keys.append(key)
+        return keys
 
-        for group in groups:
-            print("GROUP:", group.name)
-            dosing_protocols = {
-                p.variable.qname: p for p in protocols if p.group == group
-            }
-            model_dosing_protocols.append(dosing_protocols)
+    def simulate_batch(
+        self,
+        outputs=None,
+        variables_list=None,
+        time_max=None,
+        as_numpy=False,
+        max_points=None,
+        log_times=None,
+        tolerance=None,
+    ):
+        """
+        Simulate the model for many sets of variables at once, e.g. for a
+        parameter sweep. The model is fetched and compiled once and reused
+        for all sets of variables and subject groups.
+
+        Arguments
+        ---------
+        outputs: list
+            list of output names to return
+        variables_list: list
+            list of dicts mapping variable names to values for model
+            parameters, one for each scenario
+        time_max: float
+            maximum time to simulate to
+        as_numpy: bool
+            return the outputs as numpy arrays instead of lists
+        max_points: int
+            see :meth:`simulate`
+        log_times: list
+            see :meth:`simulate`
+        tolerance: tuple
+            see :meth:`simulate`
+
+        Returns
+        -------
+        output: list
+            a list with a dict for the project and each subject group, with
+            the group id under "group_id" and, under "outputs", a dict
+            mapping variable ids to a list of arrays, one for each scenario
+        """
+        if time_max is None:
+            time_max = self.get_time_max()
+
+        if outputs is None:
+            outputs = []
+
+        if variables_list is None:
+            variables_list = [None]
+
+        context = SimulationContext(self)
+        variables_list = [
+            self._get_simulation_variables(v, context) for v in variables_list
+        ]
+        project = context.project
+        _, groups, model_dosing_protocols = self._get_model_dosing_protocols(project)
 
-        result = [
+        runs = [
+            (variables, dosing_protocols)
+            for dosing_protocols in model_dosing_protocols
+            for variables in variables_list
+        ]
+        results = self._simulate_runs(
+            outputs,
+            time_max,
+            runs,
+            max_points=max_points,
+            log_times=log_times,
+            tolerance=tolerance,
+            context=context,
+        )
+
+        batch_result = []
+        n = len(variables_list)
+        group_ids = [None] + [group.id for group in groups]
+        for i, group_id in enumerate(group_ids):
+            group_results = results[i * n : (i + 1) * n]
+            batch_result.append(
+                {
+                    "group_id": group_id,
+                    "outputs": {
+                        var_id: [
+                            r[var_id] if as_numpy else r[var_id].tolist()
+                            for r in group_results
+                        ]
+                        for var_id in group_results[0].keys()
+                    },
+                }
+            )
+        return batch_result
+
+    def _simulate_runs(
+        self,
+        outputs,
+        time_max,
+        runs,
+        max_points=None,
+        log_times=None,
+        steady_state=False,
+        tolerance=None,
+        context=None,
+    ):
+        """
+        Simulate the model for each ``(variables, dosing_protocols)`` pair in
+        ``runs``, returning the serialized results (as numpy arrays) in the
+        same order. All runs share ``context`` (a :class:`SimulationContext`).
+        """
+        from pkpdapp.utils.process_pool import get_process_pool
+
+        if context is None:
+            context = SimulationContext(self)
+
+        # only worth the overhead of the process pool for more than two runs
+        pool = None
+        if len(runs) > 2:
+            pool = get_process_pool("simulate", settings.SIMULATE_PROCESSES)
+
+        if pool is not None:
+            return self._simulate_models_parallel(
+                pool,
+                outputs,
+                time_max,
+                runs,
+                max_points,
+                log_times,
+                steady_state,
+                tolerance,
+                context,
+            )
+
+        # runs with the same dosed variables share a compiled simulator, and
+        # all runs start from a copy of the same myokit model
+        base_model = self.get_myokit_model()
+        simulators = {}
+        return [
             self.simulate_model(
                 variables=variables,
                 time_max=time_max,
                 outputs=outputs,
                 dosing_protocols=dosing_protocols,
+                simulators=simulators,
+                model=base_model.clone(),
+                as_numpy=True,
+                max_points=max_points,
+                log_times=log_times,
+                steady_state=steady_state,
+                tolerance=tolerance,
+                context=context,
             )
-            for dosing_protocols in model_dosing_protocols
+            for variables, dosing_protocols in runs
         ]
-        result[0].update({"group_id": None})
-        for r, group in zip(result[1:], groups):
-            r.update({"group_id": group.id if group is not None else None})
-        return result
+
+    def _get_simulation_result_cache_key(
+        self,
+        outputs,
+        variables,
+        time_max,
+        context,
+        protocols,
+        groups,
+        max_points=None,
+        log_times=None,
+        steady_state=False,
+        tolerance=None,
+    ):
+        """
+        Returns a hash of everything that determines the result of
+        :meth:`simulate`, or None if the result should not be cached.
+        The model is identified by its cache key, which changes whenever its
+        myokit model does (see :meth:`_update_cache_version`), instead of
+        regenerating its code on every call. The variables are hashed
+        directly, with the ids of their units and
+        the version of the unit index (which changes whenever a unit is
+        saved or deleted, see :func:`pkpdapp.models.units.clear_unit_index`).
+        Anything else (e.g. the compound or the species weight) is covered
+        by the project's simulation results version, which changes whenever
+        the project, its compound, models, protocols or doses are saved.
+        """
+        version = get_simulation_results_version(context.project)
+        units_version = _get_units_version()
+        if version is None or units_version is None:
+            # without a shared version we cannot tell when results are stale
+            return None
+        content = {
+            "model": self._get_myokit_model_cache_key(),
+            "version": version,
+            "units_version": units_version,
+            "variables": sorted(variables.items()),
+            "units": sorted(
+                (v.qname, v.unit_id, v.unit_per_body_weight)
+                for v in context.variables.values()
+            ),
+            "time_max": time_max,
+            "outputs": outputs,
+            "max_points": max_points,
+            "steady_state": steady_state,
+            "tolerance": None if tolerance is None else list(tolerance),
+            "log_times": None if log_times is None else list(log_times),
+            "groups": [(g.id, g.name) for g in groups],
+            "protocols": [
+                (
+                    p.id,
+                    p.variable_id,
+                    p.group_id,
+                    p.amount_unit_id,
+                    p.time_unit_id,
+                    p.amount_per_body_weight,
+                    [
+                        (
+                            d.start_time,
+                            d.amount,
+                            d.duration,
+                            d.repeats,
+                            d.repeat_interval,
+                        )
+                        for d in p.doses.all()
+                    ],
+                )
+                for p in protocols
+            ],
+        }
+        content = json.dumps(content, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+_simulation_result_cache = None
+_simulation_result_cache_lock = threading.Lock()
+
+
+def _get_simulation_result_size(result):
+    return sum(
+        values.nbytes
+        for group_result in result
+        for values in group_result.values()
+        if isinstance(values, np.ndarray)
+    )
+
+
+def _set_read_only(result):
+    for group_result in result:
+        for values in group_result.values():
+            if isinstance(values, np.ndarray):
+                values.flags.writeable = False
+
+
+def _copy_result(group_result, as_numpy):
+    """
+    Returns a copy of a (cached) group result, converting numpy arrays to
+    lists unless ``as_numpy``.
+    """
+    if as_numpy:
+        return dict(group_result)
+    return {
+        k: v.tolist() if isinstance(v, np.ndarray) else v
+        for k, v in group_result.items()
+    }
+
+
+_myokit_model_cache = None
+_myokit_model_cache_lock = threading.Lock()
+
+
+def get_myokit_model_cache():
+    """
+    Returns the in-process cache of parsed myokit models, holding at most
+    ``settings.MYOKIT_MODEL_CACHE_SIZE`` models. Use its ``stats()`` method
+    for the number of hits, misses and evictions.
+    """
+    global _myokit_model_cache
+    with _myokit_model_cache_lock:
+        if _myokit_model_cache is None:
+            from pkpdapp.utils.lru_cache import LRUCache
+
+            _myokit_model_cache = LRUCache(
+                settings.MYOKIT_MODEL_CACHE_SIZE, size_of=lambda model: 1
+            )
+    return _myokit_model_cache
+
+
+def get_simulation_result_cache():
+    """
+    Returns the in-process cache of :meth:`MyokitModelMixin.simulate` results.
+    """
+    global _simulation_result_cache
+    with _simulation_result_cache_lock:
+        if _simulation_result_cache is None:
+            from pkpdapp.utils.lru_cache import LRUCache
+
+            _simulation_result_cache = LRUCache(
+                settings.SIMULATION_RESULT_CACHE_MAX_BYTES,
+                size_of=_get_simulation_result_size,
+            )
+    return _simulation_result_cache
+
+
+def _get_simulation_results_version_key(project_id):
+    return "simulation_results_version_{}".format(project_id)
+
+
+def get_simulation_results_version(project):
+    """
+    Returns a token that changes every time ``project`` or its compound,
+    models, protocols or doses are saved (see
+    :func:`invalidate_simulation_results`).
+    The token is stored in the shared cache so it is the same for all
+    worker processes.
+    """
+    if project is None:
+        return None
+    key = _get_simulation_results_version_key(project.id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _get_units_version():
+    """
+    Returns the version of the unit index (see
+    :func:`pkpdapp.models.units.clear_unit_index`), which changes whenever
+    a unit is saved or deleted, or None if the shared cache is unavailable.
+    """
+    from pkpdapp.models.units import UNIT_INDEX_VERSION_KEY
+
+    version = cache.get(UNIT_INDEX_VERSION_KEY)
+    if version is None:
+        cache.add(UNIT_INDEX_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(UNIT_INDEX_VERSION_KEY)
+    return version
+
+
+def invalidate_simulation_results(project):
+    """
+    Invalidates all cached simulation results for ``project``.
+    """
+    if project is None:
+        return
+    key = _get_simulation_results_version_key(project.id)
+    cache.set(key, uuid.uuid4().hex, timeout=None)
+
+
+_refinement_executor = None
+_refinement_keys = set()
+_refinement_lock = threading.Lock()
+
+
+def _reset_refinement():
+    # the refinement thread does not exist in a forked process, and may
+    # have held the lock when it was forked
+    global _refinement_executor, _refinement_keys, _refinement_lock
+    _refinement_executor = None
+    _refinement_keys = set()
+    _refinement_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_refinement)
+
+
+def _refine(model, key, kwargs):
+    from django.db import connection
+
+    try:
+        model.simulate(**kwargs)
+    except Exception:
+        logger.exception("refining simulation of %s failed", model)
+    finally:
+        with _refinement_lock:
+            _refinement_keys.discard(key)
+        # the thread has its own database connection, don't leak it
+        connection.close()
+
+
+def _schedule_refinement(model, **kwargs):
+    """
+    Runs ``model.simulate(**kwargs)`` in a background thread so that the
+    full-tolerance result ends up in the result cache. Simulations that are
+    already scheduled are not scheduled again.
+
+    The result cache is per process (see
+    :func:`get_simulation_result_cache`), so only later requests handled by
+    the same process get the refined result, others simulate it again.
+    """
+    global _refinement_executor
+    key = (
+        type(model).__name__,
+        model.pk,
+        json.dumps(kwargs, sort_keys=True, default=str),
+    )
+    with _refinement_lock:
+        if key in _refinement_keys:
+            return
+        _refinement_keys.add(key)
+        if _refinement_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            _refinement_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="simulate-refine"
+            )
+    _refinement_executor.submit(_refine, model, key, kwargs)
 
 
 def set_administration(model, drug_amount, direct=True):
@@ -720,15 +1602,146 @@ def get_protocol(events):
     Parameters
     ----------
     events
-        list of (level, start, duration)
+        list of (level, start, duration) or
+        (level, start, duration, period, multiplier)
     """
     myokit_protocol = myokit.Protocol()
     for e in events:
-        myokit_protocol.schedule(e[0], e[1], e[2])
+        myokit_protocol.schedule(*e)
 
     return myokit_protocol
 
 
+def _run_simulator(
+    sim,
+    time_max,
+    outputs,
+    time_key,
+    log_times=None,
+    max_points=None,
+    dosing_period=None,
+    tolerance=None,
+):
+    """
+    Runs ``sim`` up to ``time_max``, logging the variables in ``outputs``.
+    Returns the log and the time the periodic steady state was reached.
+
+    If ``log_times`` is given the outputs are only logged at these times,
+    if ``max_points`` is given the logged points are reduced to at most
+    this many using shape-preserving decimation (see
+    :func:`pkpdapp.utils.decimation.decimate_indices`). If ``dosing_period``
+    is given, the simulation is accelerated by repeating the solution once
+    it is periodic (see :func:`pkpdapp.utils.steady_state.run_to_steady_state`).
+    ``tolerance`` gives the solver's (abs_tol, rel_tol), defaulting to
+    :data:`DEFAULT_TOLERANCE`.
+    """
+    from pkpdapp.utils.decimation import decimate_indices
+    from pkpdapp.utils.steady_state import run_to_steady_state
+
+    if tolerance is None:
+        tolerance = DEFAULT_TOLERANCE
+    abs_tol, rel_tol = tolerance
+    sim.set_tolerance(abs_tol=abs_tol, rel_tol=rel_tol)
+    log = outputs
+    if (max_points is not None or dosing_period is not None) and (
+        time_key not in outputs
+    ):
+        # time is needed for the decimation and steady state detection
+        log = list(outputs) + [time_key]
+
+    steady_state_time = None
+    if dosing_period is None:
+        # Simulate, logging only state variables given by `outputs`
+        datalog = sim.run(time_max, log=log, log_times=log_times)
+    else:
+        datalog, steady_state_time = run_to_steady_state(
+            sim, time_max, log, time_key, dosing_period
+        )
+        if log_times is not None and len(log_times) > 0:
+            times = datalog[time_key]
+            datalog = {k: np.interp(log_times, times, v) for k, v in datalog.items()}
+
+    if max_points is not None:
+        datalog = {k: np.frombuffer(v) for k, v in datalog.items()}
+        indices = decimate_indices(
+            datalog[time_key],
+            [v for k, v in datalog.items() if k != time_key],
+            max_points,
+        )
+        datalog = {k: v[indices] for k, v in datalog.items()}
+    if log is not outputs:
+        datalog = {k: v for k, v in datalog.items() if k in outputs}
+    return datalog, steady_state_time
+
+
+def _reuse_simulator(simulators, model, protocols):
+    """
+    Returns a simulator for ``model`` with ``protocols`` attached.
+
+    The model structure only depends on which variables are dosed, so
+    simulators are stored in ``simulators`` keyed by the pacing labels. A
+    stored simulator is updated with the protocols, literal constants and
+    initial state of ``model`` and reset, giving the same result as a newly
+    compiled simulator.
+    """
+    from pkpdapp.utils.simulator_cache import (
+        get_literal_constants,
+        get_simulation,
+        update_simulation,
+    )
+
+    key = tuple(sorted(protocols.keys()))
+    sim = simulators.get(key)
+    if sim is None:
+        sim = get_simulation(model, protocols)
+        simulators[key] = sim
+        return sim
+
+    update_simulation(
+        sim,
+        protocols,
+        get_literal_constants(model),
+        model.initial_values(as_floats=True),
+    )
+    return sim
+
+
+# compiled simulators held by each simulation worker process, see
+# MyokitModelMixin._simulate_models_parallel
+_worker_simulators = OrderedDict()
+_WORKER_SIMULATORS_MAX = 32
+
+
+def _simulate_in_worker(job):
+    """
+    Runs a single simulation job in a worker process, compiling the model
+    only if this worker has not seen the same model structure before.
+    """
+    from pkpdapp.utils.simulator_cache import get_simulation, update_simulation
+
+    sim = _worker_simulators.get(job["key"])
+    if sim is None:
+        model = myokit.parse_model(job["code"])
+        sim = get_simulation(model, job["protocols"])
+        _worker_simulators[job["key"]] = sim
+        if len(_worker_simulators) > _WORKER_SIMULATORS_MAX:
+            _worker_simulators.popitem(last=False)
+    else:
+        _worker_simulators.move_to_end(job["key"])
+        update_simulation(sim, job["protocols"], job["constants"], job["state"])
+    datalog, steady_state_time = _run_simulator(
+        sim,
+        job["time_max"],
+        job["outputs"],
+        job["time_key"],
+        log_times=job["log_times"],
+        max_points=job["max_points"],
+        dosing_period=job["dosing_period"],
+        tolerance=job["tolerance"],
+    )
+    return {k: np.asarray(v) for k, v in datalog.items()}, steady_state_time
+
+
 def _get_pacing_label(variable):
     return f'pace_{variable.qname().replace(".", "_")}'
 
@@ -819,35 +1832,78 @@ def _get_dosing_events(
     tlag_time=0.0,
     time_max=None,
 ):
+    """
+    Returns the dosing events for ``doses`` as a list of
+    (level, start, duration, period, multiplier) tuples. Regularly repeated
+    doses give a single periodic event (or a few, if some repeats are
+    snapped to ``time_max``), so the number of events does not grow with the
+    number of repeats.
+    """
     dosing_events = []
     for d in doses.all():
         if d.repeat_interval <= 0:
             continue
-        start_times = np.arange(
-            d.start_time + tlag_time,
-            d.start_time + tlag_time + d.repeat_interval * d.repeats,
-            d.repeat_interval,
-        )
-        if len(start_times) == 0:
+        first_start = d.start_time + tlag_time
+        n = d.repeats
+        if n <= 0:
             continue
-        dose_level = d.amount / d.duration
-        dosing_events += [
-            (
-                (amount_conversion_factor / time_conversion_factor) * dose_level,
-                time_conversion_factor * start_time,
-                time_conversion_factor * d.duration,
+        level = (amount_conversion_factor / time_conversion_factor) * (
+            d.amount / d.duration
+        )
+        start = time_conversion_factor * first_start
+        period = time_conversion_factor * d.repeat_interval
+        duration = time_conversion_factor * d.duration
+        dosing_events += _get_periodic_events(
+            level, start, duration, period, n, time_max
+        )
+    return dosing_events
+
+
+def _get_periodic_events(level, start, duration, period, n, time_max=None):
+    """
+    Returns a list of (level, start, duration, period, multiplier) events
+    for ``n`` repeats of a dose every ``period`` starting at ``start``. Any
+    repeat that starts or ends within 1e-6 of ``time_max`` is snapped to
+    ``time_max`` and split into its own event.
+    """
+    if n > 1 and duration > period:
+        # overlapping doses cannot be a periodic event
+        return [
+            event
+            for i in range(n)
+            for event in _get_periodic_events(
+                level, start + i * period, duration, period, 1, time_max
             )
-            for start_time in start_times
         ]
-    # if any dosing events are close to time_max,
-    # make them equal to time_max
+
+    # find the (at most two) repeats that need snapping to time_max
+    snapped = {}
     if time_max is not None:
-        for i, (level, start, duration) in enumerate(dosing_events):
-            if abs(start - time_max) < 1e-6:
-                dosing_events[i] = (level, time_max, duration)
-            elif abs(start + duration - time_max) < 1e-6:
-                dosing_events[i] = (level, start, time_max - start)
-    return dosing_events
+        candidates = set()
+        for t in [time_max, time_max - duration]:
+            i = int(round((t - start) / period))
+            candidates.update([i - 1, i, i + 1])
+        for i in sorted(candidates):
+            if i < 0 or i >= n:
+                continue
+            repeat_start = start + i * period
+            if abs(repeat_start - time_max) < 1e-6:
+                snapped[i] = (level, time_max, duration, 0, 0)
+            elif abs(repeat_start + duration - time_max) < 1e-6:
+                snapped[i] = (level, repeat_start, time_max - repeat_start, 0, 0)
+
+    events = []
+    first = 0
+    for i in sorted(snapped.keys()) + [n]:
+        count = i - first
+        if count == 1:
+            events.append((level, start + first * period, duration, 0, 0))
+        elif count > 1:
+            events.append((level, start + first * period, duration, period, count))
+        if i < n:
+            events.append(snapped[i])
+        first = i + 1
+    return events
 
 
 def get_subject_groups(project):
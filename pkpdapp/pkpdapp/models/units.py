@@ -4,8 +4,11 @@
 # copyright notice and full license details.
 #
 
+import threading
+import uuid
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
-from django.db.models import Q
 import myokit
 
 # https://stackoverflow.com/questions/14711203/perform-a-logical-exclusive-or-on-a-django-q-object
@@ -24,6 +27,88 @@ class QQ:
         return x | y
 
 
+_conversion_factor_cache = None
+_conversion_factor_cache_lock = threading.Lock()
+
+
+def get_conversion_factor_cache():
+    """
+    Returns the in-process cache of unit conversion factors, holding at most
+    ``settings.UNIT_CONVERSION_CACHE_SIZE`` factors. Use its ``stats()``
+    method for the number of hits, misses and evictions.
+    """
+    global _conversion_factor_cache
+    with _conversion_factor_cache_lock:
+        if _conversion_factor_cache is None:
+            from pkpdapp.utils.lru_cache import LRUCache
+
+            _conversion_factor_cache = LRUCache(
+                settings.UNIT_CONVERSION_CACHE_SIZE, size_of=lambda factor: 1
+            )
+    return _conversion_factor_cache
+
+
+def clear_conversion_factor_cache():
+    """
+    Removes all cached unit conversion factors of this process.
+    """
+    get_conversion_factor_cache().clear()
+
+
+def _get_molecular_mass(compound, target=None):
+    """
+    Returns the molecular mass (as a value and unit symbol) of the compound,
+    or of its first or second target, used to convert between g and mol.
+    """
+    if compound is None:
+        return None
+    if target == 1:
+        return (
+            compound.target_molecular_mass,
+            compound.target_molecular_mass_unit.symbol,
+        )
+    elif target == 2:
+        return (
+            compound.target2_molecular_mass,
+            compound.target2_molecular_mass_unit.symbol,
+        )
+    return (compound.molecular_mass, compound.molecular_mass_unit.symbol)
+
+
+def _get_unit_key(unit):
+    return (tuple(unit.exponents()), unit.multiplier_log_10())
+
+
+def _conversion_factor(from_unit, to_unit, compound=None, target=None):
+    """
+    Returns the factor converting values in myokit unit ``from_unit`` to
+    ``to_unit``, using the molecular mass of the compound (or its target) to
+    convert between g and mol, or raises ``myokit.IncompatibleUnitError``.
+
+    Factors (and incompatibilities) are cached, keyed by the two units and
+    the molecular mass used, so changed units or compounds never give a
+    stale factor.
+    """
+    molecular_mass = _get_molecular_mass(compound, target)
+    key = (_get_unit_key(from_unit), _get_unit_key(to_unit), molecular_mass)
+    cache = get_conversion_factor_cache()
+    factor = cache.get(key)
+    if factor is None:
+        helpers = []
+        if molecular_mass is not None:
+            helpers = ["{} [{}]".format(*molecular_mass)]
+        try:
+            factor = myokit.Unit.conversion_factor(
+                from_unit, to_unit, helpers=helpers
+            ).value()
+        except myokit.IncompatibleUnitError as e:
+            factor = e
+        cache.set(key, factor)
+    if isinstance(factor, myokit.IncompatibleUnitError):
+        raise myokit.IncompatibleUnitError(str(factor))
+    return factor
+
+
 class Unit(models.Model):
     """
     Model replicating the Unit class from myokit
@@ -134,169 +219,52 @@ class Unit(models.Model):
             myokit_unit = unit
         else:
             myokit_unit = unit.get_myokit_unit()
-        helpers = []
-        if compound is not None:
-            if target == 1:
-                helpers = [
-                    f"{compound.target_molecular_mass} [{compound.target_molecular_mass_unit.symbol}]"  # noqa: E501
-                ]
-            elif target == 2:
-                helpers = [
-                    f"{compound.target2_molecular_mass} [{compound.target2_molecular_mass_unit.symbol}]"  # noqa: E501
-                ]
-            else:
-                helpers = [
-                    f"{compound.molecular_mass} [{compound.molecular_mass_unit.symbol}]"  # noqa: E501
-                ]
-        return myokit.Unit.conversion_factor(
-            self.get_myokit_unit(),
-            myokit_unit,
-            helpers=helpers,
-        ).value()
+        return _conversion_factor(
+            self.get_myokit_unit(), myokit_unit, compound=compound, target=target
+        )
 
     @staticmethod
     def convert_between_myokit_units(from_unit, to_unit, compound=None, target=None):
-        helpers = []
-        if compound is not None:
-            if target == 1:
-                helpers = [
-                    f"{compound.target_molecular_mass} [{compound.target_molecular_mass_unit.symbol}]"  # noqa: E501
-                ]
-            elif target == 2:
-                helpers = [
-                    f"{compound.target2_molecular_mass} [{compound.target2_molecular_mass_unit.symbol}]"  # noqa: E501
-                ]
-            else:
-                helpers = [
-                    f"{compound.molecular_mass} [{compound.molecular_mass_unit.symbol}]"  # noqa: E501
-                ]
-        return myokit.Unit.conversion_factor(
-            from_unit,
-            to_unit,
-            helpers=helpers,
-        ).value()
+        return _conversion_factor(from_unit, to_unit, compound=compound, target=target)
 
-    def get_compatible_units(self, compound=None):
-        close_enough = 1e-9
-        if compound is not None:
-            g_is_same = Q(
-                g__range=(
-                    self.g - close_enough,
-                    self.g + close_enough,
-                )
-            )
-            mol_is_same = Q(
-                mol__range=(
-                    self.mol - close_enough,
-                    self.mol + close_enough,
-                )
-            )
-            mol_added_to_g = Q(
-                g__range=(
-                    self.g + self.mol - close_enough,
-                    self.g + self.mol + close_enough,
-                )
-            )
-            g_added_to_mol = Q(
-                mol__range=(
-                    self.mol + self.g - close_enough,
-                    self.mol + self.g + close_enough,
-                )
-            )
-            no_g = Q(g=0)
-            self_has_g = self.g != 0
-            self_no_g_or_mol = self.g == 0 and self.mol == 0
-            no_mol = Q(mol=0)
-            self_has_mol = self.mol != 0
-            filter = mol_is_same & g_is_same
-            mol_and_g_add_to_zero = Q(mol=1, g=-1) | Q(mol=-1, g=1)
+    def get_dimensions(self):
+        """
+        Returns the exponents of the unit, see :func:`get_dimensions`.
+        """
+        return get_dimensions(self.g, self.m, self.s, self.A, self.K, self.cd, self.mol)
 
+    def get_compatible_unit_list(self, compound=None):
+        """
+        Returns a list of all units that this unit can be converted to
+        (including itself), taken from the in-process unit index (see
+        :func:`get_unit_index`). If ``compound`` is given, amounts in g and
+        mol are convertible (using its molecular mass). The returned units
+        are shared, do not modify them.
+        """
+        index = get_unit_index()
+        g, m, s, A, K, cd, mol = self.get_dimensions()
+        g_mol_pairs = [(g, mol)]
+        if compound is not None:
             # take into account that '' is convertible to 'mol/g' or 'g/mol'
-            if self_no_g_or_mol:
-                filter |= mol_and_g_add_to_zero
-            if self_has_mol:
-                filter |= mol_added_to_g & no_mol
-            if self_has_g:
-                filter |= g_added_to_mol & no_g
-            compat_units = Unit.objects.filter(
-                filter,
-                Q(
-                    m__range=(
-                        self.m - close_enough,
-                        self.m + close_enough,
-                    )
-                ),
-                Q(
-                    s__range=(
-                        self.s - close_enough,
-                        self.s + close_enough,
-                    )
-                ),
-                Q(
-                    A__range=(
-                        self.A - close_enough,
-                        self.A + close_enough,
-                    )
-                ),
-                Q(
-                    K__range=(
-                        self.K - close_enough,
-                        self.K + close_enough,
-                    )
-                ),
-                Q(
-                    cd__range=(
-                        self.cd - close_enough,
-                        self.cd + close_enough,
-                    )
-                ),
-            )
-            return compat_units
-        else:
-            return Unit.objects.filter(
-                Q(
-                    g__range=(
-                        self.g - close_enough,
-                        self.g + close_enough,
-                    )
-                ),
-                Q(
-                    mol__range=(
-                        self.mol - close_enough,
-                        self.mol + close_enough,
-                    )
-                ),
-                Q(
-                    m__range=(
-                        self.m - close_enough,
-                        self.m + close_enough,
-                    )
-                ),
-                Q(
-                    s__range=(
-                        self.s - close_enough,
-                        self.s + close_enough,
-                    )
-                ),
-                Q(
-                    A__range=(
-                        self.A - close_enough,
-                        self.A + close_enough,
-                    )
-                ),
-                Q(
-                    K__range=(
-                        self.K - close_enough,
-                        self.K + close_enough,
-                    )
-                ),
-                Q(
-                    cd__range=(
-                        self.cd - close_enough,
-                        self.cd + close_enough,
-                    )
-                ),
-            )
+            if g == 0 and mol == 0:
+                g_mol_pairs += [(-1.0, 1.0), (1.0, -1.0)]
+            if mol != 0:
+                g_mol_pairs.append((g + mol, 0.0))
+            if g != 0:
+                g_mol_pairs.append((0.0, mol + g))
+        units = []
+        for pair in dict.fromkeys(g_mol_pairs):
+            units += index.get(get_dimensions(pair[0], m, s, A, K, cd, pair[1]), [])
+        return units
+
+    def get_compatible_units(self, compound=None):
+        """
+        Returns a queryset of all units that this unit can be converted to,
+        see :meth:`get_compatible_unit_list`.
+        """
+        return Unit.objects.filter(
+            id__in=[u.id for u in self.get_compatible_unit_list(compound=compound)]
+        )
 
     def is_time_unit(self):
         return (
@@ -308,3 +276,51 @@ class Unit(models.Model):
             and self.cd == 0
             and self.mol == 0
         )
+
+
+# shared cache key of the version of the unit index, changed whenever a unit
+# changes so that the index is rebuilt in all processes
+UNIT_INDEX_VERSION_KEY = "unit_index_version"
+
+_unit_index = None
+_unit_index_version = None
+_unit_index_lock = threading.Lock()
+
+
+def get_dimensions(g, m, s, A, K, cd, mol):
+    """
+    Returns the exponents of the seven base units as a tuple, rounded so
+    that exponents that are close enough to be equal compare equal.
+    """
+    return tuple(round(e, 6) for e in (g, m, s, A, K, cd, mol))
+
+
+def get_unit_index():
+    """
+    Returns a dict mapping the dimensions of units (see
+    :func:`get_dimensions`) to a list of all units with these dimensions.
+
+    The index is built from the database once in each process and rebuilt
+    whenever a unit has been saved or deleted in any process (see
+    :func:`clear_unit_index`).
+    """
+    global _unit_index, _unit_index_version
+    version = cache.get(UNIT_INDEX_VERSION_KEY)
+    with _unit_index_lock:
+        if _unit_index is None or version != _unit_index_version:
+            index = {}
+            for unit in Unit.objects.order_by("id"):
+                index.setdefault(unit.get_dimensions(), []).append(unit)
+            _unit_index = index
+            _unit_index_version = version
+        return _unit_index
+
+
+def clear_unit_index():
+    """
+    Marks the unit index as outdated in all processes.
+    """
+    global _unit_index
+    with _unit_index_lock:
+        _unit_index = None
+    cache.set(UNIT_INDEX_VERSION_KEY, uuid.uuid4().hex, timeout=None)
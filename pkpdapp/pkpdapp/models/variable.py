@@ -207,14 +207,18 @@ class Variable(StoredModel):
             return None
 
     @staticmethod
-    def get_variable_pk(model, myokit_variable):
-        num_variables = Variable.objects.filter(
-            pk_model=model,
-        ).count()
-        variables = Variable.objects.filter(
-            qname=myokit_variable.qname(),
-            pk_model=model,
-        )
+    def get_variable_pk(model, myokit_variable, existing=None, num_variables=None):
+        if num_variables is None:
+            num_variables = Variable.objects.filter(
+                pk_model=model,
+            ).count()
+        if existing is None:
+            variables = Variable.objects.filter(
+                qname=myokit_variable.qname(),
+                pk_model=model,
+            )
+        else:
+            variables = existing
         compound = None
         project = model.get_project()
         if project is not None:
@@ -276,14 +280,18 @@ class Variable(StoredModel):
         return None
 
     @staticmethod
-    def get_variable_pd(model, myokit_variable):
-        num_variables = Variable.objects.filter(
-            pd_model=model,
-        ).count()
-        variables = Variable.objects.filter(
-            qname=myokit_variable.qname(),
-            pd_model=model,
-        )
+    def get_variable_pd(model, myokit_variable, existing=None, num_variables=None):
+        if num_variables is None:
+            num_variables = Variable.objects.filter(
+                pd_model=model,
+            ).count()
+        if existing is None:
+            variables = Variable.objects.filter(
+                qname=myokit_variable.qname(),
+                pd_model=model,
+            )
+        else:
+            variables = existing
         project = model.get_project()
         compound = None
         if project is not None:
@@ -317,14 +325,20 @@ class Variable(StoredModel):
             )
 
     @staticmethod
-    def get_variable_dosed_pk(model, myokit_variable):
-        num_variables = Variable.objects.filter(
-            dosed_pk_model=model,
-        ).count()
-        variables = Variable.objects.filter(
-            qname=myokit_variable.qname(),
-            dosed_pk_model=model,
-        )
+    def get_variable_dosed_pk(
+        model, myokit_variable, existing=None, num_variables=None
+    ):
+        if num_variables is None:
+            num_variables = Variable.objects.filter(
+                dosed_pk_model=model,
+            ).count()
+        if existing is None:
+            variables = Variable.objects.filter(
+                qname=myokit_variable.qname(),
+                dosed_pk_model=model,
+            )
+        else:
+            variables = existing
         compound = None
         project = model.get_project()
         if project is not None:
@@ -427,18 +441,23 @@ class Variable(StoredModel):
             )
 
     @staticmethod
-    def get_variable(model, myokit_variable):
+    def get_variable(model, myokit_variable, existing=None, num_variables=None):
         """
         Gets a variable of the model from a myokit variable
         returns a new variable if it does not exist.
         Note that this new variable is not saved to the database!
+
+        To avoid querying the database for each variable, ``existing`` can
+        be the list of the model's variables with the same qname and
+        ``num_variables`` the number of variables in the model.
         """
+        kwargs = {"existing": existing, "num_variables": num_variables}
         if isinstance(model, PharmacokineticModel):
-            return Variable.get_variable_pk(model, myokit_variable)
+            return Variable.get_variable_pk(model, myokit_variable, **kwargs)
         elif isinstance(model, CombinedModel):
-            return Variable.get_variable_dosed_pk(model, myokit_variable)
+            return Variable.get_variable_dosed_pk(model, myokit_variable, **kwargs)
         elif isinstance(model, PharmacodynamicModel):
-            return Variable.get_variable_pd(model, myokit_variable)
+            return Variable.get_variable_pd(model, myokit_variable, **kwargs)
         else:
             raise RuntimeError(
                 "create_variable got unexpected model type {}".format(type(model)),
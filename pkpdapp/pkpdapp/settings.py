@@ -419,6 +419,59 @@ CACHES = {
     }
 }
 
+# Number of worker processes used to simulate subject groups in parallel,
+# 0 or 1 runs all groups serially in the request process
+SIMULATE_PROCESSES = int(os.environ.get("SIMULATE_PROCESSES", default=0))
+
+# Maximum number of worker processes used to run the chains of an inference
+# in parallel, 0 or 1 runs all chains serially in the worker process
+INFERENCE_PROCESSES = int(
+    os.environ.get("INFERENCE_PROCESSES", default=os.cpu_count() or 1)
+)
+
+# Number of worker processes used to evaluate the candidates proposed by
+# population-based optimisers (CMAES, PSO, SNES, XNES) in parallel, when the
+# chains run serially
+INFERENCE_POPULATION_PROCESSES = int(
+    os.environ.get("INFERENCE_POPULATION_PROCESSES", default=INFERENCE_PROCESSES)
+)
+
+# Number of worker processes used to simulate the subjects of a
+# hierarchical inference in parallel, 0 or 1 simulates them serially
+FORWARD_MODEL_PROCESSES = int(os.environ.get("FORWARD_MODEL_PROCESSES", default=0))
+
+# Use the NumPy log-posterior (instead of the pymc3 model) for inferences
+# with only Normal or LogNormal noise and scalar priors
+INFERENCE_NUMPY_LOG_POSTERIOR = int(
+    os.environ.get("INFERENCE_NUMPY_LOG_POSTERIOR", default=1)
+)
+
+# Memory budget (in bytes) of the per-process cache of simulation results,
+# 0 disables the cache
+SIMULATION_RESULT_CACHE_MAX_BYTES = int(
+    os.environ.get("SIMULATION_RESULT_CACHE_MAX_BYTES", default=64 * 1024 * 1024)
+)
+
+# Number of parsed myokit models cached in each process, 0 disables the cache
+MYOKIT_MODEL_CACHE_SIZE = int(os.environ.get("MYOKIT_MODEL_CACHE_SIZE", default=64))
+
+# Number of unit conversion factors cached in each process, 0 disables the
+# cache
+UNIT_CONVERSION_CACHE_SIZE = int(
+    os.environ.get("UNIT_CONVERSION_CACHE_SIZE", default=4096)
+)
+
+# Directory shared by all processes on the host in which compiled simulators
+# are stored, so they are only compiled once. It must be owned by the user
+# running the app and not writable by other users. Disabled if empty
+SIMULATOR_CACHE_DIR = os.environ.get("SIMULATOR_CACHE_DIR", default="")
+
+# Maximum total size (in bytes) of the compiled simulators in
+# SIMULATOR_CACHE_DIR, the least recently used are removed beyond this
+SIMULATOR_CACHE_MAX_BYTES = int(
+    os.environ.get("SIMULATOR_CACHE_MAX_BYTES", default=1024 * 1024 * 1024)
+)
+
 DEFAULT_FROM_EMAIL = os.environ.get("DEFAULT_FROM_EMAIL", default="webmaster@localhost")
 
 CLOUDAMQP_URL = os.environ.get("CLOUDAMQP_URL", default=None)
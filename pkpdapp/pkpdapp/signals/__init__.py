@@ -5,3 +5,10 @@
 #
 
 from .add_profile_on_user_save import add_profile_on_user_save  # noqa: F401
+from .clear_conversion_factors import (  # noqa: F401
+    clear_conversion_factors_on_save,
+)
+from .clear_unit_index import clear_unit_index_on_save  # noqa: F401
+from .invalidate_simulation_results import (  # noqa: F401
+    invalidate_simulation_results_on_save,
+)
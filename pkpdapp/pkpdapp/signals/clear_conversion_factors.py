@@ -0,0 +1,11 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+
+from pkpdapp.models.units import clear_conversion_factor_cache
+
+
+def clear_conversion_factors_on_save(sender, instance, **kwargs):
+    clear_conversion_factor_cache()
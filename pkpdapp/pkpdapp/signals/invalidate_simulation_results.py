@@ -0,0 +1,49 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+
+from django.core.exceptions import ObjectDoesNotExist
+from pkpdapp.models import (
+    CombinedModel,
+    Compound,
+    Dose,
+    PharmacodynamicModel,
+    Project,
+    Protocol,
+    Variable,
+)
+from pkpdapp.models.myokit_model_mixin import invalidate_simulation_results
+
+
+def _get_project(instance):
+    if isinstance(instance, Project):
+        return instance
+    if isinstance(instance, (CombinedModel, PharmacodynamicModel)):
+        return instance.get_project()
+    if isinstance(instance, Variable):
+        model = instance.get_model()
+        if model is None:
+            return None
+        return model.get_project()
+    if isinstance(instance, Protocol):
+        if instance.project is not None:
+            return instance.project
+        if instance.variable is not None:
+            return _get_project(instance.variable)
+        return None
+    if isinstance(instance, Dose):
+        return _get_project(instance.protocol)
+    if isinstance(instance, Compound):
+        return instance.project
+    return None
+
+
+def invalidate_simulation_results_on_save(sender, instance, **kwargs):
+    try:
+        project = _get_project(instance)
+    except ObjectDoesNotExist:
+        # related objects may already be gone when deleting
+        return
+    invalidate_simulation_results(project)
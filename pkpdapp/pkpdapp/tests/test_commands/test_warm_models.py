@@ -0,0 +1,79 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from pkpdapp.models import (
+    CombinedModel,
+    Compound,
+    PharmacokineticModel,
+    Project,
+    Protocol,
+    Unit,
+    Variable,
+)
+
+
+class TestWarmModels(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        compound = Compound.objects.create(name="demo", compound_type="LM")
+        project = Project.objects.create(name="demo", compound=compound)
+        user = User.objects.create_user(username="testuser", password="12345")
+        user.last_login = timezone.now()
+        user.save()
+        project.users.add(user)
+        self.model = CombinedModel.objects.create(
+            name="my wonderful model",
+            pk_model=PharmacokineticModel.objects.get(name="one_compartment_clinical"),
+            project=project,
+        )
+        Protocol.objects.create(
+            name="my_cool_protocol",
+            project=project,
+            compound=compound,
+            amount_unit=Unit.objects.get(symbol="mg"),
+            time_unit=Unit.objects.get(symbol="h"),
+            variable=Variable.objects.get(
+                qname="PKCompartment.A1", dosed_pk_model=self.model
+            ),
+        )
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def _simulators(self):
+        return [
+            name for name in os.listdir(self.cache_dir.name) if name.endswith(".zip")
+        ]
+
+    def test_warm_models(self):
+        out = StringIO()
+        with override_settings(SIMULATOR_CACHE_DIR=self.cache_dir.name):
+            call_command("warm_models", processes=1, stdout=out)
+        self.assertEqual(len(self._simulators()), 1)
+        self.assertIn("Warmed 1 simulators of 1 models", out.getvalue())
+
+        # simulating the model loads the warmed simulator
+        with override_settings(SIMULATOR_CACHE_DIR=self.cache_dir.name), mock.patch(
+            "pkpdapp.utils.simulator_cache._compile"
+        ) as compile:
+            self.model.simulate(outputs=["PKCompartment.C1"])
+        compile.assert_not_called()
+
+    def test_warm_models_without_cache(self):
+        out = StringIO()
+        with override_settings(SIMULATOR_CACHE_DIR=""), mock.patch.object(
+            CombinedModel, "warm_simulators"
+        ) as warm_simulators:
+            call_command("warm_models", processes=1, stdout=out)
+        warm_simulators.assert_not_called()
+        self.assertIn("SIMULATOR_CACHE_DIR is not set", out.getvalue())
@@ -4,13 +4,22 @@
 # copyright notice and full license details.
 #
 
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+import multiprocessing
 import numpy as np
+from types import SimpleNamespace
+from unittest import mock
 from pkpdapp.models import (
     LogLikelihood,
     InferenceMixin, InferenceChain, InferenceResult,
-    InferenceFunctionResult, LogLikelihoodParameter,
+    InferenceFunctionResult, LogLikelihoodParameter, MyokitForwardModel,
 )
+from pkpdapp.models.inference_mixin import (
+    NumpyLogPosterior, ParameterTransform, PopulationEvaluator,
+    PyMC3LogPosterior,
+)
+import pymc3 as pm
+import theano
 from pkpdapp.tests import create_pd_inference
 from django.core.cache import cache
 
@@ -83,6 +92,54 @@ class TestInferenceMixinSingleOutputSampling(TestCase):
         self.assertTrue(inference.time_elapsed > 0)
         self.assertTrue(inference.number_of_function_evals > 0)
 
+    def test_inference_runs_in_parallel_and_serially(self):
+        with override_settings(INFERENCE_PROCESSES=2):
+            self.assertEqual(
+                self.inference_mixin.get_number_of_processes(), 2
+            )
+        for processes in [0, 2]:
+            self.inference.chains.all().delete()
+            self.inference.number_of_iterations = 0
+            self.inference.save()
+            mixin = InferenceMixin(self.inference)
+            evals = mixin.inference.number_of_function_evals
+            with override_settings(INFERENCE_PROCESSES=processes):
+                mixin.run_inference()
+            inference = mixin.inference
+            self.assertEqual(inference.number_of_iterations, 10)
+            # one evaluation per chain and iteration
+            self.assertEqual(
+                inference.number_of_function_evals, evals + 3 * 10
+            )
+            for chain in inference.chains.all():
+                iterations = chain.inference_function_results.order_by(
+                    'iteration'
+                ).values_list('iteration', flat=True)
+                self.assertEqual(list(iterations), list(range(11)))
+
+    def test_inference_runs_in_daemonic_process(self):
+        # celery prefork workers, which run inferences, are daemonic
+        process = multiprocessing.current_process()
+        process.daemon = True
+        try:
+            with override_settings(INFERENCE_PROCESSES=2), mock.patch.object(
+                InferenceMixin, '_run_chains_parallel', autospec=True,
+                side_effect=InferenceMixin._run_chains_parallel
+            ) as run_chains_parallel:
+                self.assertEqual(
+                    self.inference_mixin.get_number_of_processes(), 2
+                )
+                self.inference_mixin.run_inference()
+            run_chains_parallel.assert_called_once()
+        finally:
+            process.daemon = False
+        inference = self.inference_mixin.inference
+        self.assertEqual(inference.number_of_iterations, 10)
+        for chain in inference.chains.all():
+            self.assertEqual(
+                chain.inference_function_results.count(), 11
+            )
+
 
 class TestInferenceMixinSingleOutput(TestCase):
     def setUp(self):
@@ -201,6 +258,38 @@ class TestInferenceMixinSingleOutput(TestCase):
                 expected = list(range(11))
                 self.assertTrue(np.array_equal(iterations, expected))
 
+    def test_numpy_log_posterior(self):
+        priors = self.inference_mixin._priors
+        observed = self.inference_mixin._observed_log_likelihoods
+        self.assertTrue(NumpyLogPosterior.is_supported(priors, observed))
+        self.assertIsInstance(
+            self.inference_mixin._pints_log_posterior, NumpyLogPosterior
+        )
+        with override_settings(INFERENCE_NUMPY_LOG_POSTERIOR=False):
+            self.assertIsInstance(
+                InferenceMixin(self.inference)._pints_log_posterior,
+                PyMC3LogPosterior
+            )
+
+        # same values as the pymc3 model
+        numpy_log_posterior = NumpyLogPosterior(observed, priors)
+        pymc3_log_posterior = PyMC3LogPosterior(
+            observed[0].create_pymc3_model(*observed[1:]), observed, priors
+        )
+        for x in [[1.3, 0.5, 1.1], [0.2, 1.9, 0.7]]:
+            x = np.array(x + [1.0] * (len(priors) - 3))
+            y = numpy_log_posterior.to_search(x)
+            np.testing.assert_allclose(y, pymc3_log_posterior.to_search(x))
+            self.assertAlmostEqual(
+                numpy_log_posterior(y), pymc3_log_posterior(y)
+            )
+            for numpy_values, pymc3_values in zip(
+                numpy_log_posterior.generative_model_range(y),
+                pymc3_log_posterior.generative_model_range(y),
+            ):
+                for a, b in zip(numpy_values, pymc3_values):
+                    np.testing.assert_allclose(a, b)
+
 
 class TestInferenceMixinSingleOutputOptimisationPopulation(TestCase):
     def setUp(self):
@@ -254,6 +343,137 @@ class TestInferenceMixinSingleOutputOptimisationPopulation(TestCase):
         self.assertTrue(inference.time_elapsed > 0)
         self.assertTrue(inference.number_of_function_evals > 0)
 
+    def test_population_evaluated_in_parallel(self):
+        evals = []
+        for processes in [0, 2]:
+            self.inference.chains.all().delete()
+            self.inference.number_of_iterations = 0
+            self.inference.number_of_function_evals = 0
+            self.inference.save()
+            mixin = InferenceMixin(self.inference)
+            with override_settings(
+                INFERENCE_PROCESSES=0,
+                INFERENCE_POPULATION_PROCESSES=processes
+            ):
+                mixin.run_inference()
+            inference = mixin.inference
+            self.assertEqual(inference.number_of_iterations, 10)
+            self.assertIsNone(mixin._population_evaluator)
+            for chain in inference.chains.all():
+                self.assertEqual(
+                    chain.inference_function_results.count(), 11
+                )
+            evals.append(inference.number_of_function_evals)
+        # every candidate of the population is counted once
+        self.assertEqual(evals[0], evals[1])
+
+
+class RandomChainsMixin:
+    """
+    Stands in for an :class:`InferenceMixin` whose chains only draw from the
+    global numpy random state, as the pints samplers do.
+    """
+
+    def __init__(self, n_chains):
+        self._inference_objects = [None] * n_chains
+        self.inference = SimpleNamespace(number_of_iterations=0)
+        self.results = []
+
+    def _step_chain(self, obj):
+        return np.random.random(), 0.0, 1
+
+    def _append_iteration(self, results, writer, output_writer):
+        self.results.append(results)
+
+
+class TestRunChainsParallel(SimpleTestCase):
+    def test_workers_draw_different_numbers(self):
+        mixin = RandomChainsMixin(n_chains=2)
+        InferenceMixin._run_chains_parallel(
+            mixin, 2, 0, 5, -1, None, None, lambda i: None
+        )
+        self.assertEqual(mixin.inference.number_of_iterations, 5)
+        draws = np.array(
+            [[x for x, _, _ in results] for results in mixin.results]
+        )
+        # forked workers would otherwise all replay the same random stream
+        self.assertFalse(np.any(draws[:, 0] == draws[:, 1]))
+
+
+class SumLogPosterior:
+    def __call__(self, x):
+        return float(np.sum(x))
+
+
+class TestPopulationEvaluator(SimpleTestCase):
+    def test_evaluate(self):
+        xs = [np.array([1.0, 2.0]), np.array([-1.0, 2.0]), np.array([3.0])]
+        expected = [3.0, 1.0, 3.0]
+        for processes in [0, 2]:
+            evaluator = PopulationEvaluator(
+                SumLogPosterior(), processes=processes
+            )
+            try:
+                self.assertEqual(evaluator._pool is not None, processes > 1)
+                self.assertEqual(evaluator(xs), expected)
+            finally:
+                evaluator.close()
+
+    def test_evaluate_in_daemonic_process(self):
+        # celery prefork workers, which run inferences, are daemonic
+        process = multiprocessing.current_process()
+        process.daemon = True
+        try:
+            evaluator = PopulationEvaluator(SumLogPosterior(), processes=2)
+        finally:
+            process.daemon = False
+        try:
+            self.assertIsNotNone(evaluator._pool)
+            self.assertEqual(
+                evaluator([np.array([1.0]), np.array([-1.0])]), [1.0, -1.0]
+            )
+        finally:
+            evaluator.close()
+
+
+class TestParameterTransform(SimpleTestCase):
+    def test_transforms(self):
+        transforms = [
+            None,
+            pm.transforms.log,
+            pm.transforms.interval(1.0, theano.shared(np.array([2.0, 5.0]))),
+            pm.transforms.logodds,
+            # uses theano
+            pm.transforms.lowerbound(1.0),
+        ]
+        slices = [0, slice(1, 3), slice(3, 5), 5, 6]
+        lengths = [1, 2, 2, 1, 1]
+        parameter_transform = ParameterTransform(transforms, slices, lengths)
+        self.assertEqual(len(parameter_transform._others), 1)
+
+        x = np.array([-0.3, 0.5, 2.0, 1.5, 4.0, 0.25, 1.9])
+        y = parameter_transform.to_search(x)
+        np.testing.assert_allclose(parameter_transform.to_model(y), x)
+
+        # same as the compiled pymc3 transforms
+        jacobian_det = 0.0
+        for transform, prior_slice, length in zip(
+            transforms, slices, lengths
+        ):
+            forward = PyMC3LogPosterior._transform_forward(
+                transform, length == 1
+            )
+            np.testing.assert_allclose(y[prior_slice], forward(x[prior_slice]))
+            if transform is not None:
+                jacobian_det += np.sum(
+                    ParameterTransform._jacobian_det(
+                        transform, length == 1
+                    )(y[prior_slice])
+                )
+        self.assertAlmostEqual(
+            parameter_transform.log_jacobian_det(y), jacobian_det
+        )
+
 
 class TestInferenceMixinSingleOutputOptimisationCovariate(TestCase):
     def setUp(self):
@@ -338,3 +558,20 @@ class TestInferenceMixinSingleOutputOptimisationCovariate(TestCase):
         inference = self.inference_mixin.inference
         self.assertTrue(inference.time_elapsed > 0)
         self.assertTrue(inference.number_of_function_evals > 0)
+
+    def test_forward_model_workers_are_closed(self):
+        with override_settings(
+            INFERENCE_PROCESSES=0, FORWARD_MODEL_PROCESSES=2
+        ), mock.patch.object(
+            MyokitForwardModel, 'close', autospec=True,
+            side_effect=MyokitForwardModel.close
+        ) as close:
+            inference_mixin = InferenceMixin(self.inference)
+            forward_models = \
+                inference_mixin._pints_log_posterior._forward_models
+            self.assertEqual(len(forward_models), 1)
+            self.assertEqual(forward_models[0]._processes, 2)
+            inference_mixin.run_inference()
+        close.assert_called_once_with(forward_models[0])
+        self.assertIsNone(forward_models[0]._pool)
+        self.assertEqual(inference_mixin.inference.number_of_iterations, 10)
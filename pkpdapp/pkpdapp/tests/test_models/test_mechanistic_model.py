@@ -9,8 +9,15 @@ from pkpdapp.models import (
     Protocol,
     PharmacokineticModel,
     CombinedModel,
+    Compound,
     Dose,
+    Project,
     Unit,
+    Variable,
+)
+from pkpdapp.models.myokit_model_mixin import (
+    get_myokit_model_cache,
+    get_simulation_results_version,
 )
 import myokit
 from django.core.exceptions import ValidationError
@@ -55,6 +62,29 @@ class TestPharmodynamicModel(TestCase):
         test_model_variables = ["TS0", "TSmax", "beta", "Growth", "TS", "t"]
         self.assertCountEqual(model_variables, test_model_variables)
 
+    def test_myokit_model_cache(self):
+        m = PharmacodynamicModel.objects.create(
+            name="my_cool_model",
+            description="description for my cool model",
+        )
+        model_cache = get_myokit_model_cache()
+        model = m.get_myokit_model()
+        hits = model_cache.stats()["hits"]
+
+        # callers get their own copy, which they can modify
+        model.add_component("extra")
+        model = m.get_myokit_model()
+        self.assertEqual(model_cache.stats()["hits"], hits + 1)
+        self.assertFalse(model.has_component("extra"))
+
+        # updating the model changes its version, in all processes
+        version = m.cache_version
+        m.mmt = "[[model]]\n\n[myokit]\ntime = 0 bind time\n\n[extra]\nx = 1"
+        m.save()
+        self.assertNotEqual(m.cache_version, version)
+        m = PharmacodynamicModel.objects.get(pk=m.pk)
+        self.assertTrue(m.get_myokit_model().has_component("extra"))
+
 
 class TestDosedPharmokineticModel(TestCase):
     def setUp(self):
@@ -81,12 +111,58 @@ class TestDosedPharmokineticModel(TestCase):
         self.assertNotEqual(v.default_value, 8)
         self.assertNotEqual(v.unit.symbol, "mL/h")
 
+        # a dry run only returns the changes
+        changes = self.model.reset_params_to_defaults("H", "LM", dry_run=True)
+        self.assertEqual(changes["PKCompartment.CL"]["default_value"], 8)
+        self.assertEqual(changes["PKCompartment.CL"]["unit"].symbol, "mL/h")
+        v.refresh_from_db()
+        self.assertNotEqual(v.default_value, 8)
+
         self.model.reset_params_to_defaults("H", "LM")
 
         v = self.model.variables.get(qname="PKCompartment.CL")
         self.assertEqual(v.default_value, 8)
         self.assertEqual(v.unit.symbol, "mL/h")
 
+    def test_reset_to_default_invalidates_simulation_results(self):
+        project = Project.objects.create(
+            name="my project",
+            compound=Compound.objects.create(name="demo", compound_type="LM"),
+        )
+        self.model.project = project
+        self.model.save()
+        self.p.project = project
+        self.p.save()
+        Dose.objects.create(
+            protocol=self.p,
+            start_time=0,
+            duration=0.1,
+            amount=1000,
+        )
+
+        # give the variables their default values already, so that only
+        # their units are reset
+        changes = self.model.reset_params_to_defaults("H", "LM", dry_run=True)
+        for qname, variable_changes in changes.items():
+            if "default_value" in variable_changes:
+                self.model.variables.filter(qname=qname).update(
+                    default_value=variable_changes["default_value"]
+                )
+        self.assertTrue(
+            any("unit" in variable_changes for variable_changes in changes.values())
+        )
+
+        outputs = ["PKCompartment.C1", "environment.t"]
+        before = self.model.simulate(outputs=outputs)
+        version = get_simulation_results_version(project)
+
+        self.model.reset_params_to_defaults("H", "LM")
+
+        self.assertNotEqual(get_simulation_results_version(project), version)
+        after = self.model.simulate(outputs=outputs)
+        c1 = Variable.objects.get(qname="PKCompartment.C1", dosed_pk_model=self.model)
+        self.assertFalse(np.allclose(before[0][c1.id], after[0][c1.id]))
+
     def test_myokit_model(self):
         model = self.model.get_myokit_model()
         pk_model = self.pk.get_myokit_model()
@@ -7,6 +7,7 @@
 import pkpdapp.tests  # noqa: F401
 from django.test import TestCase
 from numpy.testing import assert_almost_equal
+import multiprocessing
 from pkpdapp.models import (
     PharmacodynamicModel,
     MyokitForwardModel,
@@ -124,6 +125,58 @@ class TestMyokitForwardModelSingleOutput(TestCase):
         self.assertEqual(len(z_subjects[0]), len(times))
         np.testing.assert_almost_equal(z_subjects[0], z[0])
 
+    def test_subjects_in_parallel(self):
+        times = np.linspace(0, 100, 40)
+        n_subjects = 5
+        subjects = np.arange(len(times)) % n_subjects
+        parameters = np.array(
+            [np.linspace(0.5, 2.0, n_subjects), np.linspace(1.0, 3.0, n_subjects)]
+        )
+
+        results = []
+        for processes in [None, 2]:
+            forward_model = MyokitForwardModel(
+                myokit_model=self.model,
+                myokit_simulator=self.simulator,
+                outputs=["PDCompartment.TS"],
+                times=[times],
+                subjects=[subjects],
+                fixed_parameter_dict={"PDCompartment.TS0": 1},
+                conversion_factors=[1.0],
+                processes=processes,
+            )
+            try:
+                results.append(forward_model.simulate(parameters))
+                self.assertEqual(forward_model._pool is not None, bool(processes))
+            finally:
+                forward_model.close()
+            self.assertIsNone(forward_model._pool)
+        np.testing.assert_almost_equal(results[0][0], results[1][0])
+
+        # celery prefork workers, which run inferences, are daemonic
+        process = multiprocessing.current_process()
+        process.daemon = True
+        try:
+            results.append(forward_model.simulate(parameters))
+            self.assertIsNotNone(forward_model._pool)
+        finally:
+            process.daemon = False
+            forward_model.close()
+        np.testing.assert_almost_equal(results[0][0], results[2][0])
+
+        # each subject gets the result of simulating it on its own
+        for s in range(n_subjects):
+            forward_model = MyokitForwardModel(
+                myokit_model=self.model,
+                myokit_simulator=self.simulator,
+                outputs=["PDCompartment.TS"],
+                times=[times[subjects == s]],
+                fixed_parameter_dict={"PDCompartment.TS0": 1},
+                conversion_factors=[1.0],
+            )
+            z = forward_model.simulate(parameters[:, s])
+            np.testing.assert_almost_equal(results[0][0][subjects == s], z[0])
+
 
 class TestMyokitPintsForwardModelMultipleOutput(TestCase):
     def setUp(self):
@@ -302,3 +302,33 @@ class TestPkpdModel(TestCase):
         # Verify that CLada inherits unit and unit_per_body_weight from CL
         self.assertEqual(clada_var.unit, test_unit)
         self.assertEqual(clada_var.unit_per_body_weight, True)
+
+    def test_update_model_keeps_variables(self):
+        pk_model = PharmacokineticModel.objects.get(name="1-compartmental model")
+        pkpd_model = CombinedModel.objects.create(
+            name="my wonderful model",
+            pk_model=pk_model,
+            project=self.project,
+            has_saturation=True,
+        )
+        cl = pkpd_model.variables.get(qname="PKCompartment.CL")
+        cl.default_value = 1.123
+        cl.save()
+        ids = {v.qname: v.id for v in pkpd_model.variables.all()}
+        self.assertIn("PKCompartment.CLmax", ids)
+
+        # removed variables are deleted, all others are kept unchanged
+        pkpd_model.has_saturation = False
+        pkpd_model.save()
+        new_ids = {v.qname: v.id for v in pkpd_model.variables.all()}
+        del ids["PKCompartment.CLmax"]
+        self.assertEqual(new_ids, ids)
+        cl.refresh_from_db()
+        self.assertEqual(cl.default_value, 1.123)
+
+        # and created again when needed
+        pkpd_model.has_saturation = True
+        pkpd_model.save()
+        self.assertTrue(
+            pkpd_model.variables.filter(qname="PKCompartment.CLmax").exists()
+        )
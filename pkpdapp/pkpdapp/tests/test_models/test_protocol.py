@@ -9,8 +9,10 @@ from django.test import TestCase
 from pkpdapp.models import (
     Protocol,
     Compound,
+    Dose,
     Unit,
 )
+from pkpdapp.models.myokit_model_mixin import _get_dosing_events, get_protocol
 
 
 class TestProtocolModel(TestCase):
@@ -34,3 +36,40 @@ class TestProtocolModel(TestCase):
         )
 
         self.assertTrue(isinstance(p, Protocol))
+
+    def test_dosing_events(self):
+        au = Unit.objects.get(symbol='mg')
+        tu = Unit.objects.get(symbol='h')
+        c = Compound.objects.create(
+            name='my_cool_compound',
+            description='placebo',
+        )
+        p = Protocol.objects.create(
+            name='my_cool_protocol',
+            compound=c,
+            amount_unit=au,
+            time_unit=tu,
+        )
+        Dose.objects.create(
+            protocol=p,
+            start_time=1.0,
+            amount=2.0,
+            duration=0.5,
+            repeats=1000,
+            repeat_interval=24.0,
+        )
+
+        # regular repeats give a single periodic event
+        events = _get_dosing_events(p.doses, time_conversion_factor=2.0)
+        self.assertEqual(events, [(2.0, 2.0, 1.0, 48.0, 1000)])
+
+        # the repeat ending at time_max is snapped and split out
+        events = _get_dosing_events(p.doses, time_max=73.5 + 1e-8)
+        self.assertEqual(len(events), 3)
+        self.assertEqual(events[0], (4.0, 1.0, 0.5, 24.0, 3))
+        self.assertEqual(events[1][:2], (4.0, 73.0))
+        self.assertAlmostEqual(events[1][2], 0.5 + 1e-8)
+        self.assertEqual(events[2], (4.0, 97.0, 0.5, 24.0, 996))
+
+        protocol = get_protocol(events)
+        self.assertEqual(len(protocol.events()), 3)
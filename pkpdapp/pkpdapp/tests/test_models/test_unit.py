@@ -8,6 +8,11 @@ import pkpdapp.tests  # noqa: F401
 from django.db.models import Q
 from django.test import TestCase
 from pkpdapp.models import Unit, Compound
+from pkpdapp.models.units import (
+    clear_conversion_factor_cache,
+    get_conversion_factor_cache,
+    get_unit_index,
+)
 from math import log10
 
 
@@ -187,3 +192,37 @@ class TestUnitModel(TestCase):
             [],
             "Missing AUC units: {}".format(", ".join(missing_units)),
         )
+
+    def test_conversion_factor_cache(self):
+        clear_conversion_factor_cache()
+        cache = get_conversion_factor_cache()
+        mg = Unit.objects.get(symbol="mg")
+        nmol = Unit.objects.get(symbol="nmol")
+        h = Unit.objects.get(symbol="h")
+
+        factor = mg.convert_to(nmol, compound=self.compound)
+        self.assertEqual(mg.convert_to(nmol, compound=self.compound), factor)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+        # a different molecular mass gives a different factor
+        self.compound.molecular_mass *= 2
+        self.compound.save()
+        self.assertEqual(len(cache), 0)
+        self.assertAlmostEqual(mg.convert_to(nmol, compound=self.compound), factor / 2)
+
+        # incompatible units are cached as well
+        for _ in range(2):
+            self.assertFalse(mg.is_convertible_to(h))
+
+    def test_compatible_units_index(self):
+        mg = Unit.objects.get(symbol="mg")
+        self.assertIn(mg, get_unit_index()[mg.get_dimensions()])
+
+        # new units are added to the index
+        new_unit = Unit.objects.create(symbol="dg", g=1, multiplier=-1)
+        self.assertIn(new_unit, mg.get_compatible_units())
+        self.assertIn(
+            new_unit.id, [u.id for u in mg.get_compatible_unit_list(self.compound)]
+        )
+        new_unit.delete()
+        self.assertNotIn("dg", [u.symbol for u in mg.get_compatible_unit_list()])
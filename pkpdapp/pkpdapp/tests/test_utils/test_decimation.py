@@ -0,0 +1,34 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import numpy as np
+from django.test import SimpleTestCase
+from pkpdapp.utils.decimation import decimate_indices, lttb_indices
+
+
+class TestDecimation(SimpleTestCase):
+    def test_lttb_keeps_peaks(self):
+        # repeated doses: sharp peaks every 24 hours
+        x = np.linspace(0, 240, 10001)
+        y = np.exp(-0.3 * np.mod(x, 24))
+        indices = lttb_indices(x, y, 200)
+        self.assertEqual(len(indices), 200)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], len(x) - 1)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertAlmostEqual(y[indices].max(), y.max())
+        self.assertAlmostEqual(y[indices].min(), y.min(), delta=1e-3)
+
+    def test_lttb_short_input(self):
+        x = np.arange(5.0)
+        np.testing.assert_array_equal(lttb_indices(x, x, 10), np.arange(5))
+
+    def test_decimate_indices(self):
+        x = np.linspace(0, 10, 1001)
+        ys = [np.sin(x), np.cos(x)]
+        indices = decimate_indices(x, ys, 100)
+        self.assertLessEqual(len(indices), 100)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        np.testing.assert_array_equal(decimate_indices(x, ys, 2000), np.arange(len(x)))
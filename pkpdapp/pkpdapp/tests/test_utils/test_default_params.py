@@ -0,0 +1,29 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import json
+from django.test import SimpleTestCase
+from pkpdapp.utils.default_params import (
+    DEFAULTS_PATH,
+    compile_defaults,
+    get_defaults,
+    is_up_to_date,
+)
+
+
+class TestDefaultParams(SimpleTestCase):
+    def test_compiled_defaults_up_to_date(self):
+        # run 'python manage.py compile_default_params' if this fails
+        self.assertTrue(is_up_to_date())
+        with open(DEFAULTS_PATH) as f:
+            compiled = json.load(f)["defaults"]
+        self.assertEqual(compiled, compile_defaults())
+
+    def test_get_defaults(self):
+        defaults = get_defaults()
+        self.assertEqual(
+            defaults["one_compartment"]["CL"]["H"]["LM"], {"value": 8, "unit": "mL/h"}
+        )
+        self.assertIs(get_defaults(), defaults)
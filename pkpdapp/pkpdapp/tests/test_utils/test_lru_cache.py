@@ -0,0 +1,44 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+from django.test import SimpleTestCase
+from pkpdapp.utils.lru_cache import LRUCache
+
+
+class TestLRUCache(SimpleTestCase):
+    def test_get_set(self):
+        cache = LRUCache(100, size_of=len)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", "x" * 10)
+        self.assertEqual(cache.get("a"), "x" * 10)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 10)
+
+    def test_eviction(self):
+        cache = LRUCache(30, size_of=len)
+        cache.set("a", "x" * 10)
+        cache.set("b", "x" * 10)
+        cache.set("c", "x" * 10)
+        # use a so b is the least recently used
+        cache.get("a")
+        cache.set("d", "x" * 10)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertIn("d", cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.size, 30)
+
+        # values larger than the budget are not stored
+        cache.set("e", "x" * 31)
+        self.assertNotIn("e", cache)
+        self.assertEqual(len(cache), 3)
+
+    def test_disabled(self):
+        cache = LRUCache(0, size_of=len)
+        cache.set("a", "x")
+        self.assertIsNone(cache.get("a"))
@@ -0,0 +1,126 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import os
+import tempfile
+import unittest
+import myokit
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+from pkpdapp.utils import simulator_cache
+from pkpdapp.utils.simulator_cache import (
+    _check_cache_dir,
+    _evict,
+    get_literal_constants,
+    get_simulation,
+    get_structure_key,
+)
+
+MODEL = """
+[[model]]
+c.x = 1
+
+[c]
+t = 0 bind time
+dot(x) = -k * x + pace
+k = 0.5
+pace = 0 bind pace
+"""
+
+
+class TestSimulatorCache(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.model = myokit.parse_model(MODEL)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def _simulators(self):
+        # ignoring the lock files
+        return [
+            name for name in os.listdir(self.cache_dir.name) if name.endswith(".zip")
+        ]
+
+    def test_structure_key(self):
+        key = get_structure_key(self.model, ["pace"])
+        self.assertEqual(key, get_structure_key(self.model.clone(), ["pace"]))
+        self.assertNotEqual(key, get_structure_key(self.model, ["pace_x"]))
+
+        # literal values and initial values are not part of the structure
+        model = self.model.clone()
+        model.get("c.k").set_rhs(0.6)
+        model.get("c.x").set_initial_value(2)
+        self.assertEqual(key, get_structure_key(model, ["pace"]))
+
+        model.get("c.k").set_rhs("0.6 * c.x")
+        self.assertNotEqual(key, get_structure_key(model, ["pace"]))
+
+    def test_evict(self):
+        for i in range(4):
+            path = os.path.join(self.cache_dir.name, f"{i}.zip")
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+            os.utime(path, (i, i))
+        _evict(self.cache_dir.name, 250)
+        self.assertCountEqual(os.listdir(self.cache_dir.name), ["2.zip", "3.zip"])
+
+    def test_check_cache_dir(self):
+        # created accessible by the current user only
+        cache_dir = os.path.join(self.cache_dir.name, "simulators")
+        self.assertTrue(_check_cache_dir(cache_dir))
+        self.assertEqual(os.stat(cache_dir).st_mode & 0o077, 0)
+
+        # refused if other users can write to it
+        os.chmod(cache_dir, 0o777)
+        with self.assertLogs("pkpdapp.utils.simulator_cache", "WARNING"):
+            self.assertFalse(_check_cache_dir(cache_dir))
+
+        # refused if not a directory
+        path = os.path.join(self.cache_dir.name, "file")
+        open(path, "w").close()
+        with self.assertLogs("pkpdapp.utils.simulator_cache", "WARNING"):
+            self.assertFalse(_check_cache_dir(path))
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_fork_while_compiling(self):
+        # a child forked while another thread compiles can still compile
+        with simulator_cache._compile_lock:
+            pid = os.fork()
+            if pid == 0:
+                os._exit(0 if simulator_cache._compile_lock.acquire(timeout=5) else 1)
+        _, exit_status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(exit_status), 0)
+
+    def test_get_simulation(self):
+        protocol = myokit.Protocol()
+        protocol.schedule(1.0, 1.0, 1.0)
+        with override_settings(
+            SIMULATOR_CACHE_DIR=self.cache_dir.name,
+            SIMULATOR_CACHE_MAX_BYTES=1024 * 1024 * 1024,
+        ):
+            sim = get_simulation(self.model, {"pace": protocol})
+            self.assertEqual(len(self._simulators()), 1)
+            expected = sim.run(5, log=["c.x"])["c.x"]
+
+            # loaded from disk, with a different protocol attached
+            sim = get_simulation(self.model, {"pace": myokit.Protocol()})
+            self.assertEqual(len(self._simulators()), 1)
+            sim.set_protocol(protocol)
+            np.testing.assert_allclose(sim.run(5, log=["c.x"])["c.x"], expected)
+
+            # models with the same structure share the compiled simulator,
+            # but use their own constants and initial values
+            model = self.model.clone()
+            model.get("c.k").set_rhs(0.6)
+            model.get("c.x").set_initial_value(2)
+            sim = get_simulation(model, {"pace": protocol})
+            self.assertEqual(len(self._simulators()), 1)
+            self.assertEqual(sim.default_state(), [2.0])
+            new_sim = myokit.Simulation(model, protocol=protocol)
+            np.testing.assert_allclose(
+                sim.run(5, log=["c.x"])["c.x"], new_sim.run(5, log=["c.x"])["c.x"]
+            )
+            self.assertEqual(get_literal_constants(model)["c.k"], 0.6)
@@ -0,0 +1,91 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from pkpdapp.utils.single_flight import get_or_build
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class TestSingleFlight(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_or_build(self):
+        calls = []
+
+        def build():
+            calls.append(threading.current_thread().name)
+            time.sleep(0.1)
+            return {"value": 1}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_build("a", build)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"value": 1}] * 8)
+        self.assertIsNone(cache.get("a_building"))
+
+        # cached from now on
+        self.assertEqual(get_or_build("a", build), {"value": 1})
+        self.assertEqual(len(calls), 1)
+
+    def test_different_keys(self):
+        started = threading.Barrier(2, timeout=5)
+
+        def build():
+            # fails if the builds for both keys cannot run at the same time
+            started.wait()
+            return 1
+
+        threads = [
+            threading.Thread(target=get_or_build, args=(key, build))
+            for key in ["a", "b"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(started.broken)
+
+    def test_build_error(self):
+        def build():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            get_or_build("a", build)
+        self.assertIsNone(cache.get("a_building"))
+        self.assertEqual(get_or_build("a", lambda: 2), 2)
+
+
+class TestSingleFlightCacheUnavailable(SimpleTestCase):
+    def test_builds_without_waiting(self):
+        # the configured cache backend, with no server listening
+        backend = settings.CACHES["default"]["BACKEND"]
+        with override_settings(
+            CACHES={"default": {"BACKEND": backend, "LOCATION": "127.0.0.1:1"}}
+        ):
+            calls = []
+
+            def build():
+                calls.append(1)
+                return {"value": 1}
+
+            start = time.monotonic()
+            self.assertEqual(get_or_build("a", build), {"value": 1})
+            self.assertEqual(get_or_build("a", build), {"value": 1})
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual(len(calls), 2)
@@ -0,0 +1,128 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import myokit
+import numpy as np
+from django.test import SimpleTestCase
+from pkpdapp.models.myokit_model_mixin import DEFAULT_TOLERANCE
+from pkpdapp.utils.steady_state import (
+    depends_on_time,
+    get_dosing_period,
+    run_to_steady_state,
+)
+
+MODEL = """
+[[model]]
+central.A = 0
+central.AUC = 0
+
+[environment]
+t = 0 bind time
+
+[central]
+dose_rate = 0 bind pace
+k = 0.05
+dot(A) = dose_rate - k * A
+dot(AUC) = A
+"""
+
+# clearance that switches on at a given time, as for anti-drug antibodies
+TIME_SWITCHED_MODEL = MODEL.replace(
+    "dot(A) = dose_rate - k * A",
+    "tada = 500\nkada = if(environment.t < tada, 0, 0.1)\n"
+    "dot(A) = dose_rate - (k + kada) * A",
+)
+
+
+class TestSteadyState(SimpleTestCase):
+    def test_get_dosing_period(self):
+        protocol = myokit.Protocol()
+        for i in range(10):
+            protocol.schedule(1.0, 2.0 + 24.0 * i, 1.0)
+        self.assertEqual(get_dosing_period({"a": protocol}, 1000.0), (2.0, 24.0, 10))
+        # window limited by time_max
+        self.assertEqual(get_dosing_period({"a": protocol}, 100.0), (2.0, 24.0, 4))
+        self.assertIsNone(get_dosing_period({"a": protocol}, 50.0))
+
+        # periodic events
+        periodic = myokit.Protocol()
+        periodic.schedule(2.0, 12.0, 0.5, period=24.0, multiplier=20)
+        self.assertEqual(
+            get_dosing_period({"a": protocol, "b": periodic}, 1000.0),
+            (12.0, 24.0, 9),
+        )
+
+        # different periods
+        weekly = myokit.Protocol()
+        weekly.schedule(2.0, 0.0, 0.5, period=168.0, multiplier=20)
+        self.assertIsNone(get_dosing_period({"a": protocol, "b": weekly}, 1000.0))
+
+        # irregular doses
+        irregular = myokit.Protocol()
+        for start in [0.0, 24.0, 48.0, 96.0, 120.0]:
+            irregular.schedule(1.0, start, 1.0)
+        self.assertIsNone(get_dosing_period({"a": irregular}, 1000.0))
+        self.assertIsNone(get_dosing_period({}, 1000.0))
+
+    def test_run_to_steady_state(self):
+        model = myokit.parse_model(MODEL)
+        protocol = myokit.Protocol()
+        protocol.schedule(1.0, 2.0, 1.0, period=24.0, multiplier=40)
+        time_max = 1000.0
+        log = ["environment.t", "central.A", "central.AUC"]
+        dosing_period = get_dosing_period({"dose_rate": protocol}, time_max)
+        self.assertEqual(dosing_period, (2.0, 24.0, 40))
+
+        sim = myokit.Simulation(model, protocol)
+        sim.set_tolerance(*DEFAULT_TOLERANCE)
+        result, steady_state_time = run_to_steady_state(
+            sim, time_max, log, "environment.t", dosing_period
+        )
+
+        # the same simulation solved all the way through
+        plain_sim = myokit.Simulation(model, protocol)
+        plain_sim.set_tolerance(*DEFAULT_TOLERANCE)
+        plain = plain_sim.run(time_max, log=log, log_interval=0.01)
+        plain = {k: np.array(v) for k, v in plain.items()}
+
+        # the steady state is reached at the start of a dosing period, well
+        # before the last one, after which the troughs no longer change
+        self.assertIsNotNone(steady_state_time)
+        self.assertAlmostEqual((steady_state_time - 2.0) % 24.0, 0.0)
+        self.assertLess(steady_state_time, 2.0 + 30 * 24.0)
+        troughs = np.interp(
+            np.arange(2.0, 2.0 + 40 * 24.0, 24.0),
+            plain["environment.t"],
+            plain["central.A"],
+        )
+        steady = int(round((steady_state_time - 2.0) / 24.0))
+        np.testing.assert_allclose(troughs[steady:], troughs[-1], rtol=1e-4)
+        self.assertGreater(abs(troughs[1] - troughs[-1]), 1e-2 * troughs[-1])
+
+        # the extrapolated periods match the solved ones, and the simulation
+        # continues from the same state
+        self.assertAlmostEqual(sim.time(), time_max)
+        np.testing.assert_allclose(sim.state(), plain_sim.state(), rtol=1e-4)
+        time = result["environment.t"]
+        self.assertTrue(np.all(np.diff(time) > 0))
+        self.assertAlmostEqual(time[-1], time_max)
+        for key in ["central.A", "central.AUC"]:
+            expected = np.interp(time, plain["environment.t"], plain[key])
+            np.testing.assert_allclose(
+                result[key], expected, atol=1e-3 * np.max(plain[key])
+            )
+
+    def test_time_dependent_model(self):
+        protocol = myokit.Protocol()
+        protocol.schedule(1.0, 2.0, 1.0, period=24.0, multiplier=40)
+        protocols = {"dose_rate": protocol}
+        model = myokit.parse_model(MODEL)
+        self.assertFalse(depends_on_time(model))
+        self.assertEqual(get_dosing_period(protocols, 1000.0, model), (2.0, 24.0, 40))
+
+        # the solution changes at tada, so it is not extrapolated
+        model = myokit.parse_model(TIME_SWITCHED_MODEL)
+        self.assertTrue(depends_on_time(model))
+        self.assertIsNone(get_dosing_period(protocols, 1000.0, model))
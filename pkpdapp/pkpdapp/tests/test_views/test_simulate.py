@@ -3,7 +3,10 @@
 # is released under the BSD 3-clause license. See accompanying LICENSE.md for
 # copyright notice and full license details.
 #
-
+import json
+import struct
+import numpy as np
+from unittest import mock
 from pkpdapp.models import (
     PharmacodynamicModel,
     PharmacokineticModel,
@@ -13,11 +16,15 @@ from pkpdapp.models import (
     Compound,
     Dataset,
     Protocol,
+    Simulation,
     Subject,
     SubjectGroup,
     Unit,
 )
+from pkpdapp.models.myokit_model_mixin import get_simulation_result_cache
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from django.urls import reverse
@@ -95,6 +102,263 @@ class TestSimulateView(APITestCase):
                 ],
             )
 
+        # invalid arguments are rejected
+        for invalid in [
+            {"max_points": 1},
+            {"max_points": "many"},
+            {"steady_state": "maybe"},
+            {"simulation": "abc"},
+        ]:
+            response = self.client.post(url, {**data, **invalid}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            url, {"variables": data["variables"]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # booleans may be given as strings
+        with mock.patch.object(CombinedModel, "simulate_preview") as simulate_preview:
+            response = self.client.post(
+                url, {**data, "preview": "false"}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        simulate_preview.assert_not_called()
+
         url = reverse("simulate-combined-model", args=(123,))
         response = self.client.post(url, data, format="json")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_simulate_batch(self):
+        pd = PharmacodynamicModel.objects.get(
+            name="tumour_growth_gompertz",
+            read_only=False,
+        )
+        pk = PharmacokineticModel.objects.get(
+            name="one_compartment_clinical",
+        )
+        m = CombinedModel.objects.create(
+            name="my wonderful model",
+            pd_model=pd,
+            pk_model=pk,
+            project=self.project,
+        )
+
+        url = reverse("simulate-batch-combined-model", args=(m.pk,))
+        data = {
+            "outputs": ["PDCompartment.TS", "environment.t"],
+            "grid": {
+                "PDCompartment.TS0": [1.1, 1.2, 1.3],
+                "PDCompartment.beta": [0.1, 0.2],
+            },
+        }
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        ts_id = Variable.objects.get(qname="PDCompartment.TS", dosed_pk_model=m).id
+        for sim in response.data:
+            outputs = sim.get("outputs")
+            self.assertCountEqual(
+                list(outputs.keys()),
+                [
+                    Variable.objects.get(qname=qname, dosed_pk_model=m).id
+                    for qname in data["outputs"]
+                ],
+            )
+            self.assertEqual(len(sim.get("time")), 6)
+            self.assertEqual(len(outputs[ts_id]), 6)
+            # initial tumour size is set by each scenario
+            self.assertAlmostEqual(outputs[ts_id][0][0], 1.1, delta=1e-6)
+            self.assertAlmostEqual(outputs[ts_id][2][0], 1.2, delta=1e-6)
+
+        data = {
+            "outputs": ["PDCompartment.TS", "environment.t"],
+            "variables": [{"PDCompartment.TS0": 1.1}, {"PDCompartment.TS0": 1.5}],
+        }
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for sim in response.data:
+            self.assertEqual(len(sim.get("outputs")[ts_id]), 2)
+
+        # only one of variables or grid can be given
+        data["grid"] = {"PDCompartment.TS0": [1.1]}
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_simulate_binary(self):
+        pd = PharmacodynamicModel.objects.get(
+            name="tumour_growth_gompertz",
+            read_only=False,
+        )
+        pk = PharmacokineticModel.objects.get(
+            name="one_compartment_clinical",
+        )
+        m = CombinedModel.objects.create(
+            name="my wonderful model",
+            pd_model=pd,
+            pk_model=pk,
+            project=self.project,
+        )
+
+        url = reverse("simulate-combined-model", args=(m.pk,))
+        data = {
+            "outputs": ["PDCompartment.TS", "environment.t"],
+            "variables": {"PDCompartment.TS0": 1.1},
+        }
+        json_response = self.client.post(url, data, format="json")
+        response = self.client.post(
+            url,
+            data,
+            format="json",
+            HTTP_ACCEPT="application/x-pkpdapp-simulation",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        content = response.content
+        header_length = struct.unpack("<I", content[:4])[0]
+        header = json.loads(content[4 : 4 + header_length])
+        start = 4 + header_length + (-(4 + header_length) % 8)
+        values = np.frombuffer(content[start:], dtype=header["dtype"])
+
+        time_id = Variable.objects.get(qname="environment.t", dosed_pk_model=m).id
+        for group, json_group in zip(header["groups"], json_response.data):
+            self.assertEqual(group["time"], time_id)
+            for output in group["outputs"]:
+                offset = output["offset"] // 8
+                np.testing.assert_array_equal(
+                    values[offset : offset + output["length"]],
+                    json_group["outputs"][output["id"]],
+                )
+
+    def test_simulate_tolerance_and_preview(self):
+        pd = PharmacodynamicModel.objects.get(
+            name="tumour_growth_gompertz",
+            read_only=False,
+        )
+        pk = PharmacokineticModel.objects.get(
+            name="one_compartment_clinical",
+        )
+        m = CombinedModel.objects.create(
+            name="my wonderful model",
+            pd_model=pd,
+            pk_model=pk,
+            project=self.project,
+        )
+        simulation = Simulation.objects.create(
+            name="my simulation",
+            project=self.project,
+            time_max_unit=Unit.objects.get(symbol="h"),
+            abs_tolerance=1e-3,
+            rel_tolerance=1e-3,
+        )
+
+        url = reverse("simulate-combined-model", args=(m.pk,))
+        data = {
+            "outputs": ["PDCompartment.TS", "environment.t"],
+            "variables": {"PDCompartment.TS0": 1.1},
+            "simulation": simulation.id,
+            "preview": True,
+        }
+        # refine the preview straight away instead of in the background
+        with mock.patch(
+            "pkpdapp.models.myokit_model_mixin._schedule_refinement",
+            side_effect=lambda model, **kwargs: model.simulate(**kwargs),
+        ) as schedule_refinement:
+            response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Simulation-Preview"], "true")
+        ts_id = Variable.objects.get(qname="PDCompartment.TS", dosed_pk_model=m).id
+        for sim in response.data:
+            self.assertAlmostEqual(sim["outputs"][ts_id][0], 1.1, delta=1e-6)
+        schedule_refinement.assert_called_once()
+        self.assertEqual(
+            schedule_refinement.call_args.kwargs["tolerance"], (1e-3, 1e-3)
+        )
+
+        # the refined result is then returned from the result cache
+        stats = get_simulation_result_cache().stats()
+        data["preview"] = False
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("X-Simulation-Preview", response)
+        self.assertEqual(
+            get_simulation_result_cache().stats()["hits"], stats["hits"] + 1
+        )
+        self.assertEqual(
+            get_simulation_result_cache().stats()["misses"], stats["misses"]
+        )
+
+        # nothing is refined if the result could not be cached
+        data["preview"] = True
+        with mock.patch(
+            "pkpdapp.models.myokit_model_mixin.get_simulation_results_version",
+            return_value=None,
+        ), mock.patch(
+            "pkpdapp.models.myokit_model_mixin._schedule_refinement"
+        ) as schedule_refinement:
+            response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        schedule_refinement.assert_not_called()
+
+        # simulations from other projects are not allowed
+        other_project = Project.objects.create(
+            name="other project",
+            compound=Compound.objects.create(name="other", compound_type="LM"),
+        )
+        simulation.project = other_project
+        simulation.save()
+        data["preview"] = False
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_simulate_query_count(self):
+        # the number of queries does not depend on the number of variables
+        num_queries = []
+        num_variables = []
+        for name in ["one_compartment_clinical", "three_compartment_clinical"]:
+            m = CombinedModel.objects.create(
+                name=f"model {name}",
+                pk_model=PharmacokineticModel.objects.get(name=name),
+                project=self.project,
+            )
+            m.get_myokit_model()
+            with CaptureQueriesContext(connection) as queries:
+                m.simulate(outputs=["PKCompartment.C1", "environment.t"])
+            num_queries.append(len(queries))
+            num_variables.append(m.variables.count())
+        self.assertLess(num_variables[0], num_variables[1])
+        self.assertEqual(num_queries[0], num_queries[1])
+
+    def test_simulate_cached_results_follow_units(self):
+        m = CombinedModel.objects.create(
+            name="my wonderful model",
+            pd_model=PharmacodynamicModel.objects.get(
+                name="tumour_growth_gompertz",
+                read_only=False,
+            ),
+            pk_model=PharmacokineticModel.objects.get(
+                name="one_compartment_clinical",
+            ),
+            project=self.project,
+        )
+        outputs = ["PDCompartment.TS", "environment.t"]
+        ts_id = Variable.objects.get(qname="PDCompartment.TS", dosed_pk_model=m).id
+        ts0 = Variable.objects.get(qname="PDCompartment.TS0", dosed_pk_model=m)
+        result = m.simulate(outputs=outputs)
+        self.assertEqual(m.simulate(outputs=outputs), result)
+
+        # changing the unit of a variable gives new results
+        unit = next(
+            u
+            for u in ts0.unit.get_compatible_unit_list()
+            if u.multiplier != ts0.unit.multiplier
+        )
+        ts0.unit = unit
+        ts0.save()
+        new_result = m.simulate(outputs=outputs)
+        self.assertNotEqual(new_result[0][ts_id][0], result[0][ts_id][0])
+
+        # as does changing the unit itself
+        unit.multiplier += 1
+        unit.save()
+        newer_result = m.simulate(outputs=outputs)
+        self.assertNotEqual(newer_result[0][ts_id][0], new_result[0][ts_id][0])
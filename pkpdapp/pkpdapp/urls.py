@@ -55,6 +55,11 @@ urlpatterns = [
         api.SimulateCombinedView.as_view(),
         name="simulate-combined-model",
     ),
+    path(
+        "api/combined_model/<int:pk>/simulate/batch",
+        api.SimulateBatchCombinedView.as_view(),
+        name="simulate-batch-combined-model",
+    ),
     path(
         "api/inference/wizard",
         api.InferenceWizardView.as_view(),
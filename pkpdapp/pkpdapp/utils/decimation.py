@@ -0,0 +1,60 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import numpy as np
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Returns the indices of the points selected by the
+    Largest-Triangle-Three-Buckets algorithm (Steinarsson, 2013) to
+    downsample the curve ``(x, y)`` to ``n_out`` points.
+
+    The first and last points are always kept, the remaining points are
+    split into ``n_out - 2`` buckets and from each bucket the point forming
+    the largest triangle with the previously selected point and the average
+    of the next bucket is kept. This preserves peaks and troughs (e.g. Cmax
+    and Cmin) far better than taking every n-th point.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets between the first and last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def decimate_indices(x, ys, max_points):
+    """
+    Returns the sorted indices of the points to keep so that each curve
+    ``(x, y)`` for ``y`` in ``ys`` keeps its shape, using at most
+    ``max_points`` points in total (or 3 per curve, if that is larger).
+    """
+    n = len(x)
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+    ys = list(ys)
+    if len(ys) == 0:
+        ys = [x]
+    points_per_curve = max(3, max_points // len(ys))
+    return np.unique(np.concatenate([lttb_indices(x, y, points_per_curve) for y in ys]))
@@ -3,13 +3,21 @@
 # is released under the BSD 3-clause license. See accompanying LICENSE.md for
 # copyright notice and full license details.
 #
-import openpyxl
+import hashlib
+import json
+import logging
+import os
+import threading
 
+logger = logging.getLogger(__name__)
 
-# Load the workbook
-workbook = openpyxl.load_workbook(
-    "pkpdapp/migrations/models/ParametersValue_Species.xlsx", data_only=True
+MODELS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations", "models"
 )
+# the workbook the default parameters are maintained in
+WORKBOOK_PATH = os.path.join(MODELS_DIR, "ParametersValue_Species.xlsx")
+# the default parameters compiled from the workbook, see write_defaults
+DEFAULTS_PATH = os.path.join(MODELS_DIR, "ParametersValue_Species.json")
 
 sheet_names = [
     "1cmpt_PK_Model",
@@ -29,48 +37,130 @@ model_names = [
 ]
 species_list = ["M", "R", "K", "H"]
 compound_type = ["SM", "LM"]
-clinical = [False, False, False, True]
-
-defaults = {}
-
-for sheet_name, model_name in zip(sheet_names, model_names):
-    worksheet = workbook[sheet_name]
-
-    defaults[model_name] = {}
-    for row in worksheet.iter_rows():
-        row_parameter = row[0].value
-        if row_parameter is None:
-            continue
-        parameters = []
-        if row_parameter == "KD or KSS":
-            parameters = (
-                [f"KD{i}" for i in range(1, 3)]
-                + [f"KSS{i}" for i in range(1, 3)]
-                + ["KD", "KSS"]
-            )
-        elif row_parameter == "CT1_0":
-            parameters = [f"CT{i}_0" for i in range(1, 3)] + ["CT_0"]
-        elif row_parameter == "koff":
-            parameters = [f"koff{i}" for i in range(1, 3)] + ["koff"]
-        elif row_parameter == "kint":
-            parameters = [f"kint{i}" for i in range(1, 4)] + ["kint"]
-        elif row_parameter == "kdeg":
-            parameters = [f"kdegT{i}" for i in range(1, 3)] + ["kdegT"]
-        elif row_parameter == "CLdif":
-            parameters = ["CLdif", "CLdifT1", "CLdifT2"]
-        else:
-            parameters = [row_parameter]
-
-        for parameter in parameters:
-            defaults[model_name][parameter] = {}
-            for i, species in enumerate(species_list):
-                defaults[model_name][parameter][species] = {}
-                for j, ctype in enumerate(compound_type):
-                    rowi = i * 4 + j * 2 + 1
-                    value = row[rowi].value
-                    unit = row[rowi + 1].value
-                    if_clinical = clinical[i]
-                    defaults[model_name][parameter][species][ctype] = {
-                        "value": value,
-                        "unit": unit,
-                    }
+
+_defaults = None
+_defaults_lock = threading.Lock()
+
+
+def get_checksum(path=WORKBOOK_PATH):
+    """
+    Returns the sha256 hash of the contents of the file at ``path``.
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_defaults(path=WORKBOOK_PATH):
+    """
+    Reads the default parameters from the workbook at ``path``, returning a
+    dict mapping model name, parameter name, species and compound type to a
+    dict with the default "value" and "unit".
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, data_only=True)
+
+    defaults = {}
+
+    for sheet_name, model_name in zip(sheet_names, model_names):
+        worksheet = workbook[sheet_name]
+
+        defaults[model_name] = {}
+        for row in worksheet.iter_rows():
+            row_parameter = row[0].value
+            if row_parameter is None:
+                continue
+            parameters = []
+            if row_parameter == "KD or KSS":
+                parameters = (
+                    [f"KD{i}" for i in range(1, 3)]
+                    + [f"KSS{i}" for i in range(1, 3)]
+                    + ["KD", "KSS"]
+                )
+            elif row_parameter == "CT1_0":
+                parameters = [f"CT{i}_0" for i in range(1, 3)] + ["CT_0"]
+            elif row_parameter == "koff":
+                parameters = [f"koff{i}" for i in range(1, 3)] + ["koff"]
+            elif row_parameter == "kint":
+                parameters = [f"kint{i}" for i in range(1, 4)] + ["kint"]
+            elif row_parameter == "kdeg":
+                parameters = [f"kdegT{i}" for i in range(1, 3)] + ["kdegT"]
+            elif row_parameter == "CLdif":
+                parameters = ["CLdif", "CLdifT1", "CLdifT2"]
+            else:
+                parameters = [row_parameter]
+
+            for parameter in parameters:
+                defaults[model_name][parameter] = {}
+                for i, species in enumerate(species_list):
+                    defaults[model_name][parameter][species] = {}
+                    for j, ctype in enumerate(compound_type):
+                        rowi = i * 4 + j * 2 + 1
+                        value = row[rowi].value
+                        unit = row[rowi + 1].value
+                        defaults[model_name][parameter][species][ctype] = {
+                            "value": value,
+                            "unit": unit,
+                        }
+    return defaults
+
+
+def write_defaults(workbook_path=WORKBOOK_PATH, path=DEFAULTS_PATH):
+    """
+    Compiles the default parameters from the workbook at ``workbook_path``
+    and writes them, together with the checksum of the workbook, as json to
+    ``path``.
+    """
+    content = {
+        "checksum": get_checksum(workbook_path),
+        "defaults": compile_defaults(workbook_path),
+    }
+    with open(path, "w") as f:
+        json.dump(content, f, sort_keys=True, separators=(",", ":"))
+        f.write("\n")
+
+
+def is_up_to_date(workbook_path=WORKBOOK_PATH, path=DEFAULTS_PATH):
+    """
+    Returns True if the compiled default parameters at ``path`` were
+    compiled from the current workbook at ``workbook_path``.
+    """
+    try:
+        with open(path) as f:
+            checksum = json.load(f)["checksum"]
+    except (OSError, ValueError, KeyError):
+        return False
+    return checksum == get_checksum(workbook_path)
+
+
+def _load_defaults():
+    try:
+        with open(DEFAULTS_PATH) as f:
+            content = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"could not load {DEFAULTS_PATH}: {e}")
+        content = None
+    if content is not None:
+        if not os.path.exists(WORKBOOK_PATH) or content.get("checksum") == get_checksum(
+            WORKBOOK_PATH
+        ):
+            return content["defaults"]
+        logger.warning(
+            f"{DEFAULTS_PATH} is out of date, run "
+            "'python manage.py compile_default_params' to update it"
+        )
+    return compile_defaults(WORKBOOK_PATH)
+
+
+def get_defaults():
+    """
+    Returns the default parameters of the library models (see
+    :func:`compile_defaults`), loaded on first use from the compiled json
+    file. If this is missing or was compiled from a different version of
+    the workbook, they are read from the workbook instead.
+    """
+    global _defaults
+    with _defaults_lock:
+        if _defaults is None:
+            _defaults = _load_defaults()
+    return _defaults
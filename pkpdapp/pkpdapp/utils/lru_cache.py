@@ -0,0 +1,94 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+from collections import OrderedDict
+import sys
+import threading
+
+
+class LRUCache:
+    """
+    A thread-safe, in-process least-recently-used cache with a memory budget.
+
+    Parameters
+    ----------
+    max_bytes: int
+        approximate maximum total size of the cached values. Items are
+        evicted (least recently used first) once this is exceeded. A value
+        of 0 disables the cache.
+    size_of: callable, optional
+        function returning the approximate size in bytes of a value,
+        defaults to ``sys.getsizeof``
+    """
+
+    def __init__(self, max_bytes, size_of=None):
+        self.max_bytes = max_bytes
+        self._size_of = sys.getsizeof if size_of is None else size_of
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_bytes <= 0:
+            return
+        size = self._size_of(value)
+        # don't flush the whole cache for a value that will never fit
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self.size -= item[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Returns a dict with the number of items, total size, hits, misses
+        and evictions of the cache.
+        """
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "size": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
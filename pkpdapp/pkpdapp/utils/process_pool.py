@@ -0,0 +1,102 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+
+try:
+    import billiard
+except ImportError:  # pragma: no cover
+    billiard = None
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# set in the worker processes started by this app, see can_fork
+_is_worker = False
+
+
+def mark_worker_process():
+    """
+    Marks this process as a worker process, which does not start worker
+    processes of its own (see :func:`can_fork`). Called at the start of
+    every worker process.
+    """
+    global _is_worker
+    _is_worker = True
+
+
+def get_fork_context():
+    """
+    Returns the context used to fork worker processes.
+
+    This is billiard's (celery's fork of multiprocessing) if available,
+    which unlike multiprocessing lets daemonic processes, such as the
+    celery prefork workers that run inferences, have children.
+    """
+    if billiard is not None:
+        return billiard.get_context("fork")
+    return multiprocessing.get_context("fork")
+
+
+def can_fork():
+    """
+    Returns True if this process is allowed to start worker processes.
+
+    Worker processes do not start workers of their own, so pools are never
+    nested. Without billiard daemonic processes cannot have children, and
+    fork is not available on all platforms.
+    """
+    if _is_worker:
+        return False
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return False
+    return billiard is not None or not multiprocessing.current_process().daemon
+
+
+def get_process_pool(name, processes):
+    """
+    Returns a long-lived pool of ``processes`` forked worker processes.
+
+    Pools are created on first use and kept for the lifetime of the process,
+    so that any state the workers build up (e.g. compiled simulators) is
+    reused between calls. Returns None if no pool can be created, in which
+    case callers should fall back to running serially.
+    """
+    if processes is None or processes < 2 or not can_fork():
+        return None
+    key = (name, processes)
+    with _pools_lock:
+        pool, pid = _pools.get(key, (None, None))
+        # pools are not shared with forked children of the owner process
+        if pool is None or pid != os.getpid():
+            try:
+                pool = get_fork_context().Pool(
+                    processes, initializer=mark_worker_process
+                )
+            except (OSError, ValueError, AssertionError) as e:
+                logger.warning(f"could not create process pool {name}: {e}")
+                return None
+            _pools[key] = (pool, os.getpid())
+    return pool
+
+
+def close_process_pools():
+    """
+    Terminates all pools created by this process.
+    """
+    with _pools_lock:
+        for pool, pid in _pools.values():
+            if pid == os.getpid():
+                pool.terminate()
+        _pools.clear()
+
+
+atexit.register(close_process_pools)
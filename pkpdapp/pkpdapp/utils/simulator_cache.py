@@ -0,0 +1,268 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import contextlib
+import hashlib
+import logging
+import os
+import platform
+import stat
+import sys
+import threading
+import uuid
+import myokit
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# myokit changes the working directory and redirects the standard streams
+# of the whole process while compiling, so compilations cannot overlap
+_compile_lock = threading.Lock()
+
+
+def _reset_compile_lock():
+    # a process forked while another thread was compiling (e.g. a preview
+    # refinement) inherits the held lock, but not the thread releasing it
+    global _compile_lock
+    _compile_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_compile_lock)
+
+
+def get_structure_key(model, pacing_labels):
+    """
+    Returns a hash of the structure of ``model`` with the given pacing
+    labels, ignoring the values of literal constants and initial values.
+
+    Literal constants and the state are passed to the compiled simulation
+    at run time, so all models with the same structure (e.g. every project
+    using the same library model) can share one compiled simulation
+    module, see :func:`update_simulation`. The key also includes the myokit
+    version and the platform, which the compiled module depends on.
+    """
+    model = model.clone()
+    for var in model.variables(deep=True):
+        if var.is_state():
+            var.set_initial_value(0)
+        elif var.is_literal():
+            var.set_rhs(0)
+    content = "\n".join(
+        [
+            model.code(),
+            ",".join(sorted(pacing_labels)),
+            myokit.__version__,
+            sys.version,
+            platform.platform(),
+        ]
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def get_literal_constants(model):
+    """
+    Returns a dict mapping qnames to values for all literal constants of
+    ``model``.
+    """
+    return {
+        var.qname(): var.value()
+        for var in model.variables(const=True, deep=True)
+        if var.is_literal()
+    }
+
+
+def update_simulation(sim, protocols, constants, state):
+    """
+    Sets the protocols, literal constants and default state of a compiled
+    simulation and resets it to the start of a simulation. This gives the
+    same result as a simulation newly compiled for a model with the same
+    structure (see :func:`get_structure_key`).
+    """
+    for label, protocol in protocols.items():
+        sim.set_protocol(protocol, label)
+    for qname, value in constants.items():
+        sim.set_constant(qname, value)
+    sim.set_default_state(state)
+    sim.reset()
+
+
+def _compile(model, protocols, path=None):
+    with _compile_lock:
+        return myokit.Simulation(model, protocol=protocols, path=path)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """
+    Context manager holding an exclusive lock on the file at ``path``,
+    shared by all threads and processes on the host.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _evict(cache_dir, max_bytes):
+    """
+    Deletes the least recently used (by modification time) simulators in
+    ``cache_dir`` until their total size is at most ``max_bytes``.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".zip"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _check_cache_dir(cache_dir):
+    """
+    Creates ``cache_dir`` if it does not exist, accessible by the current
+    user only, and returns True if compiled simulators can be loaded from
+    it.
+
+    Loading a simulator runs its native code, so a directory that is not
+    owned by the current user, or that other users can write to, is
+    refused.
+    """
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        st = os.stat(cache_dir)
+    except OSError as e:
+        logger.warning(f"could not create simulator cache {cache_dir}: {e}")
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        logger.warning(f"simulator cache {cache_dir} is not a directory")
+        return False
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        logger.warning(
+            f"not using simulator cache {cache_dir}: not owned by the current user"
+        )
+        return False
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        logger.warning(
+            f"not using simulator cache {cache_dir}: writable by other users"
+        )
+        return False
+    return True
+
+
+def _load(path, model, protocols):
+    try:
+        sim = myokit.Simulation.from_path(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # e.g. a truncated file, or built by an incompatible version
+        logger.warning(f"could not load cached simulator {path}: {e}")
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return None
+    # mark as recently used, for the eviction
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    # the stored simulator has the protocols, constants and state of the
+    # model it was compiled for
+    update_simulation(
+        sim,
+        protocols,
+        get_literal_constants(model),
+        model.initial_values(as_floats=True),
+    )
+    return sim
+
+
+def _build(cache_dir, key, path, model, protocols):
+    """
+    Compiles a simulation and stores it at ``path``.
+    """
+    # build into a unique temporary file, then move it into place so that
+    # readers never see a partially written file
+    tmp_path = os.path.join(cache_dir, f".{key}.{uuid.uuid4().hex}.tmp")
+    try:
+        sim = _compile(model, protocols, path=tmp_path)
+    except OSError as e:
+        logger.warning(f"could not store simulator in {cache_dir}: {e}")
+        return _compile(model, protocols)
+    try:
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"could not store simulator in {cache_dir}: {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return sim
+
+
+def get_simulation(model, protocols):
+    """
+    Returns a ``myokit.Simulation`` of ``model`` with ``protocols`` (a dict
+    mapping pacing labels to protocols).
+
+    If ``settings.SIMULATOR_CACHE_DIR`` is set, compiled simulation modules
+    are stored in this directory, keyed by :func:`get_structure_key`, so
+    that all processes on the host (e.g. gunicorn and celery workers) and
+    all models with the same structure load a prebuilt module instead of
+    invoking the C compiler again. Only one thread or process compiles a
+    given structure at a time, the others wait and then load its result.
+    Files are written atomically, so readers never see a partially written
+    file, and the least recently used files are removed once the directory
+    grows beyond ``settings.SIMULATOR_CACHE_MAX_BYTES``. The directory must
+    be owned by the current user and not writable by others, see
+    :func:`_check_cache_dir`.
+    """
+    cache_dir = settings.SIMULATOR_CACHE_DIR
+    if not cache_dir or not _check_cache_dir(cache_dir):
+        return _compile(model, protocols)
+
+    key = get_structure_key(model, protocols.keys())
+    path = os.path.join(cache_dir, key + ".zip")
+    if os.path.exists(path):
+        sim = _load(path, model, protocols)
+        if sim is not None:
+            return sim
+
+    with _file_lock(os.path.join(cache_dir, f".{key}.lock")):
+        # another thread or process may have built it while we waited
+        if os.path.exists(path):
+            sim = _load(path, model, protocols)
+            if sim is not None:
+                return sim
+        sim = _build(cache_dir, key, path, model, protocols)
+
+    try:
+        _evict(cache_dir, settings.SIMULATOR_CACHE_MAX_BYTES)
+    except OSError as e:
+        logger.warning(f"could not evict simulators from {cache_dir}: {e}")
+    return sim
@@ -0,0 +1,98 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import contextlib
+import threading
+import time
+import uuid
+from django.core.cache import cache
+
+# how long (in seconds) a build may hold the shared lock before others
+# assume the builder has died and build themselves
+BUILD_LOCK_TIMEOUT = 120
+# how often (in seconds) waiting processes check whether the build is done
+BUILD_POLL_INTERVAL = 0.05
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def key_lock(key):
+    """
+    Context manager holding an in-process lock for ``key``. Threads using
+    the same key run one after the other, threads using different keys do
+    not block each other.
+    """
+    with _key_locks_lock:
+        entry = _key_locks.get(key)
+        if entry is None:
+            entry = _key_locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _key_locks[key]
+
+
+def _build_once(key, build, timeout):
+    """
+    Builds and caches the value for ``key``, unless another process is
+    already doing so, in which case waits for its result.
+    """
+    lock_key = "{}_building".format(key)
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + BUILD_LOCK_TIMEOUT
+    while not cache.add(lock_key, token, timeout=BUILD_LOCK_TIMEOUT):
+        if cache.get(lock_key) is None:
+            # nobody holds the lock, so either it was released just now or
+            # the cache backend is unreachable, in which case build it here
+            # instead of waiting for a build that will never be stored
+            value = cache.get(key)
+            if value is not None:
+                return value
+            token = None
+            break
+        time.sleep(BUILD_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if time.monotonic() > deadline:
+            # the builder has most likely died, build it here instead
+            token = None
+            break
+    try:
+        value = build()
+        cache.set(key, value, timeout=timeout)
+    finally:
+        if token is not None and cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    return value
+
+
+def get_or_build(key, build, timeout=None):
+    """
+    Returns the value stored under ``key`` in the shared cache, calling
+    ``build()`` and storing its result (for ``timeout`` seconds, forever if
+    None) if there is none.
+
+    Only one thread in each process, and (using a lock stored in the cache
+    backend) only one process, builds the value for a given key at a time.
+    All others wait and then get the value from the cache, so concurrent
+    cold requests build it only once. Values for different keys are built
+    in parallel.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+    with key_lock(key):
+        value = cache.get(key)
+        if value is not None:
+            return value
+        return _build_once(key, build, timeout)
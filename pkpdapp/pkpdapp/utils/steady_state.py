@@ -0,0 +1,199 @@
+#
+# This file is part of PKPDApp (https://github.com/pkpdapp-team/pkpdapp) which
+# is released under the BSD 3-clause license. See accompanying LICENSE.md for
+# copyright notice and full license details.
+#
+import numpy as np
+
+# relative tolerance on the change in per-period state increments
+STEADY_STATE_RTOL = 1e-6
+# relative tolerance (to the output range) when comparing the logged
+# profiles of consecutive periods, looser as it includes interpolation error
+STEADY_STATE_SHAPE_RTOL = 1e-3
+# minimum number of periods that must be left to extrapolate
+MIN_PERIODS = 4
+
+
+def _get_event_starts(protocol):
+    """
+    Returns the start times of all events in ``protocol``, or None if the
+    events do not all have the same level and duration, or are not equally
+    spaced.
+    """
+    starts = []
+    level_duration = None
+    for e in protocol.events():
+        if level_duration is None:
+            level_duration = (e.level(), e.duration())
+        elif not np.allclose(level_duration, (e.level(), e.duration())):
+            return None
+        if e.period() > 0:
+            if e.multiplier() == 0:
+                return None
+            starts.append(e.start() + e.period() * np.arange(e.multiplier()))
+        else:
+            starts.append(np.array([e.start()]))
+    if len(starts) == 0:
+        return None
+    starts = np.sort(np.concatenate(starts))
+    if len(starts) < 2:
+        return None
+    periods = np.diff(starts)
+    if not np.allclose(periods, periods[0], rtol=1e-9, atol=0):
+        return None
+    return starts
+
+
+def depends_on_time(model):
+    """
+    Returns True if any equation of the myokit ``model``, other than those
+    of variables bound to an external input (e.g. pacing), refers to the
+    time variable, e.g. to switch on a process at a given time.
+    """
+    time = model.time()
+    if time is None:
+        return False
+    return any(v.binding() is None for v in time.refs_by())
+
+
+def get_dosing_period(protocols, time_max, model=None):
+    """
+    Returns ``(t0, period, n_periods)`` describing the time window
+    ``[t0, t0 + n_periods * period]`` in which all myokit ``protocols`` repeat
+    with the same period, or None if there is no such window with at least
+    :data:`MIN_PERIODS` periods.
+
+    If the myokit ``model`` is given and its equations depend on time (see
+    :func:`depends_on_time`) its solution need not repeat with the doses,
+    so None is returned as well.
+    """
+    if model is not None and depends_on_time(model):
+        return None
+    period = None
+    t0 = 0.0
+    t_end = time_max
+    for protocol in protocols.values():
+        starts = _get_event_starts(protocol)
+        if starts is None:
+            return None
+        protocol_period = starts[1] - starts[0]
+        if period is None:
+            period = protocol_period
+        elif not np.isclose(period, protocol_period, rtol=1e-9, atol=0):
+            return None
+        t0 = max(t0, starts[0])
+        t_end = min(t_end, starts[-1] + protocol_period)
+    if period is None or period <= 0:
+        return None
+    n_periods = int(np.floor((t_end - t0) / period + 1e-9))
+    if n_periods < MIN_PERIODS:
+        return None
+    return t0, period, n_periods
+
+
+def _to_arrays(datalog):
+    return {k: np.array(v, dtype=float) for k, v in datalog.items()}
+
+
+def _is_periodic(states, logs, time_key, period):
+    """
+    Returns the per-period state and output increments if the last of the
+    periods described by ``states`` (the state at the start of three
+    consecutive periods and at the end of the last) and ``logs`` (the logs of
+    the last two periods) is periodic, up to a constant increment per
+    period (e.g. for AUC states), and None otherwise.
+    """
+    s0, s1, s2, s3 = states
+    d_prev = s2 - s1
+    d_last = s3 - s2
+    scale = np.maximum(np.abs(s3), np.abs(s0))
+    tol = STEADY_STATE_RTOL * scale + 1e-12
+    if np.any(np.abs(d_last - d_prev) > tol) or np.any(
+        np.abs((s2 - s1) - (s1 - s0)) > tol
+    ):
+        return None
+
+    prev, last = logs
+    t_prev = prev[time_key]
+    t_last = last[time_key]
+    increments = {}
+    for k in last.keys():
+        if k == time_key:
+            increments[k] = period
+            continue
+        v_prev = prev[k]
+        v_last = last[k]
+        increment = v_last[-1] - v_prev[-1]
+        # the last period should be the previous one shifted by the increment
+        expected = np.interp(t_last - period, t_prev, v_prev) + increment
+        value_range = max(np.ptp(v_last), np.abs(v_last).max())
+        if np.any(
+            np.abs(v_last - expected) > STEADY_STATE_SHAPE_RTOL * value_range + 1e-12
+        ):
+            return None
+        increments[k] = increment
+    return d_last, increments
+
+
+def _concatenate_logs(logs, time_key):
+    """
+    Concatenates a list of logs (dicts of arrays), dropping points that do
+    not advance in time (e.g. the duplicate points where runs join).
+    """
+    result = {k: np.concatenate([log[k] for log in logs]) for k in logs[0].keys()}
+    time = result[time_key]
+    keep = np.ones(len(time), dtype=bool)
+    if len(time) > 1:
+        keep[1:] = time[1:] > np.maximum.accumulate(time)[:-1]
+    return {k: v[keep] for k, v in result.items()}
+
+
+def run_to_steady_state(sim, time_max, log, time_key, dosing_period):
+    """
+    Runs the myokit simulation ``sim`` up to ``time_max`` (logging the
+    variables in ``log``, which must include ``time_key``), period by period
+    through the dosing window given by ``dosing_period`` (see
+    :func:`get_dosing_period`, which returns None for models whose
+    equations depend on time, as these cannot be extrapolated).
+
+    Once the state at the start of consecutive periods changes by the same
+    amount every period (i.e. the solution is periodic, or for quantities
+    like the AUC increases by a constant amount every period), the profile
+    of the last period is repeated for the remaining periods instead of
+    solving them, and the simulation continues from the extrapolated state.
+
+    Returns the log as a dict of numpy arrays and the time at which the
+    periodic steady state was reached (None if it was not detected).
+    """
+    t0, period, n_periods = dosing_period
+    logs = []
+    if t0 > 0:
+        logs.append(_to_arrays(sim.run(t0, log=log)))
+    states = [np.array(sim.state())]
+    steady_state_time = None
+    for k in range(n_periods):
+        logs.append(_to_arrays(sim.run(period, log=log)))
+        states.append(np.array(sim.state()))
+        remaining = n_periods - k - 1
+        if len(states) < 4 or remaining == 0:
+            continue
+        periodic = _is_periodic(states[-4:], logs[-2:], time_key, period)
+        if periodic is None:
+            continue
+        state_increment, increments = periodic
+        last = logs[-1]
+        repeats = np.arange(1, remaining + 1)[:, None]
+        logs.append(
+            {
+                k: (last[k][None, :] + repeats * increments[k]).ravel()
+                for k in last.keys()
+            }
+        )
+        steady_state_time = sim.time() - 3 * period
+        sim.set_state(states[-1] + remaining * state_increment)
+        sim.set_time(sim.time() + remaining * period)
+        break
+
+    if time_max > sim.time():
+        logs.append(_to_arrays(sim.run(time_max - sim.time(), log=log)))
+    return _concatenate_logs(logs, time_key), steady_state_time
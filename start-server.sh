@@ -3,6 +3,10 @@
 (python manage.py migrate --no-input)
 (python update_models.py)
 (python update_units.py)
+if [ -n "$WARM_MODELS_ON_STARTUP" ]; then
+  # build and compile models in the background while the server starts
+  (python manage.py warm_models) &
+fi
 (celery -A pkpdapp worker --loglevel=INFO) &
 (gunicorn pkpdapp.wsgi:application --bind unix:/run/gunicorn.socket --workers 3) &
 nginx -g "daemon off;"